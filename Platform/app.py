@@ -1,9 +1,11 @@
+import os
 import dash
 import dash_bootstrap_components as dbc
 from layout import layout
 from callbacks import register_callbacks
+from metrics import stage_metrics, register_metrics_route
 # import ollama_model
-import ollama
+from llm import FakeChatClient, OllamaClient
 # Initialize the Dash app
 external_stylesheets = [dbc.themes.BOOTSTRAP, "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css"]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
@@ -12,12 +14,18 @@ app.title = "Mathurance Dashboard"
 # Set the app layout
 app.layout = layout
 
-# Initialize the model
-model = ollama.Client()
+# Initialize the model (MATHURANCE_FAKE_LLM=1 uses a canned local stand-in, e.g. for tests)
+model = FakeChatClient() if os.environ.get("MATHURANCE_FAKE_LLM") else OllamaClient()
 
 # Register callbacks with the model
 register_callbacks(app, model)  # Pass the model as an argument
 
+# Per-stage timings in the Prometheus text format
+register_metrics_route(app.server, stage_metrics)
+
+# WSGI entry point for production servers (see serve.py)
+server = app.server
+
 # Run the app
 if __name__ == '__main__':
     app.run_server(debug=False)
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""
+Batch reserving of many claim files, without the dashboard.
+
+    python batch.py "entities/*.csv" data/q4/ --output results --workers 8 --format parquet
+
+Each file runs through the upload pipeline (parse, triangle, chain-ladder factors,
+projection) on a process pool. The triangle, the factors and the paid / ultimate / reserve
+per accident year of each file are written to <output>/<file name>/, and summary.csv lists
+the time of every stage per file. Files with development factors that could not be
+estimated (developed with a factor of 1) get the status "warning". manifest.json records
+the content hash of the files already processed: a new run skips those that have not
+changed (unless --force), so an interrupted run resumes where it stopped.
+
+With --out-of-core, CSV and Parquet files are aggregated by the scan backend of scan.py
+(DuckDB, Polars or chunked pandas) instead of being loaded, for histories larger than memory.
+--origin and --development choose quarterly or monthly periods; those triangles are kept
+sparse and written as one row per observed cell.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from cache import content_hash
+from scan import SCAN_EXTENSIONS, aggregate_claims_files
+from reserving import SparseTriangle, undefined_factor_periods
+from utils import (GRANULARITIES, parse_bytes, add_development_periods, create_triangle, compute_chain_ladder_factors,
+                   project_triangle, reserves_by_accident_year)
+
+CLAIM_EXTENSIONS = (".csv", ".xlsx", ".xlsm", ".xls", ".json", ".parquet")
+OUTPUT_FORMATS = ("parquet", "csv")
+STAGES = ["read", "parse", "triangle", "factors", "projection", "write"]
+
+
+def find_claim_files(sources):
+    """
+    Claim files named by sources: files, directories (searched recursively) or glob patterns.
+    """
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            matches = glob.glob(os.path.join(source, "**", "*"), recursive=True)
+        else:
+            matches = glob.glob(source, recursive=True)
+        files += [path for path in matches if os.path.isfile(path) and path.lower().endswith(CLAIM_EXTENSIONS)]
+    return sorted(set(os.path.abspath(path) for path in files))
+
+
+def output_names(files):
+    """
+    Output directory name per file: the file name without extension, plus a short hash of
+    the path when two files share a name (e.g. the same extract in two entity folders).
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in files]
+    return {
+        path: stem if stems.count(stem) == 1 else f"{stem}-{content_hash(path.encode())[:8]}"
+        for path, stem in zip(files, stems)
+    }
+
+
+def write_table(df, path, fmt):
+    if fmt == "parquet":
+        df.to_parquet(f"{path}.parquet", index=False)
+    else:
+        df.to_csv(f"{path}.csv", index=False)
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    content_hash of a file's bytes, read block by block.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def process_file(path, output_dir, fmt="parquet", out_of_core=False, origin="year", development="year"):
+    """
+    Run one claims file through the pipeline and write its results to output_dir.
+    Parquet files, and CSV files when out_of_core, are aggregated by a scan instead of loaded.
+    Quarterly / monthly origin or development periods use a SparseTriangle.
+    Returns the summary row of the file (content hash, row count and seconds per stage), with
+    status "warning" when some factors could not be estimated.
+    """
+    timings = {}
+    start = time.perf_counter()
+    scanned = path.lower().endswith(".parquet") or (out_of_core and path.lower().endswith(SCAN_EXTENSIONS))
+    annual = origin == "year" and development == "year"
+    if scanned and not annual:
+        raise ValueError("out-of-core scans only build annual triangles")
+    if scanned:
+        digest = file_hash(path)
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = content_hash(data)
+    timings["read"] = time.perf_counter() - start
+
+    stage_start = time.perf_counter()
+    if scanned:
+        df = aggregate_claims_files(path)
+        n_rows = df.attrs["rows"]
+    else:
+        # The batch keeps its own manifest; the upload cache would only fill up with one-off files
+        df = parse_bytes(data, path.lower(), cache=None)
+        if df is not None:
+            df = add_development_periods(df, origin, development)
+        n_rows = 0 if df is None else len(df)
+    if not n_rows:
+        raise ValueError("no claims could be read from the file")
+    timings["parse"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    triangle = create_triangle(df) if annual else SparseTriangle.from_claims(df)
+    timings["triangle"] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+    factors = compute_chain_ladder_factors(triangle) if annual else triangle.factors()
+    timings["factors"] = time.perf_counter() - stage_start
+    stage_start = time.perf_counter()
+    if annual:
+        reserves = reserves_by_accident_year(triangle, project_triangle(triangle, factors))
+    else:  # Ultimates straight from the latest cells, the future cells are never filled in
+        reserves = triangle.ultimates(factors)
+    timings["projection"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    if annual:
+        # Parquet needs string column names; development periods become "0", "1", ...
+        table = triangle.rename(columns=str).reset_index()
+    else:
+        table = triangle.cells()
+    write_table(table, os.path.join(output_dir, "triangle"), fmt)
+    write_table(pd.DataFrame({"Development Period": list(factors), "Factor": list(factors.values())}),
+                os.path.join(output_dir, "factors"), fmt)
+    write_table(reserves, os.path.join(output_dir, "ultimates"), fmt)
+    timings["write"] = time.perf_counter() - stage_start
+
+    undefined = undefined_factor_periods(factors)
+    return {
+        "file": path,
+        "status": "warning" if undefined else "done",
+        "warning": f"factors undefined for development periods {undefined}, taken as 1" if undefined else None,
+        "hash": digest,
+        "rows": n_rows,
+        "reserve": reserves["Reserve"].sum(skipna=False),
+        **{f"{stage}_s": timings[stage] for stage in STAGES},
+        "total_s": time.perf_counter() - start,
+    }
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest, path):
+    # Written to a temporary file first: an interrupted run never leaves a truncated manifest
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_unchanged(path, entry, output_dir, fmt, granularity="year/year"):
+    """
+    True if the manifest entry says path was processed as it is now, with the same output
+    format and granularity, and its outputs exist.
+    Size and modification time are compared first; the content is only hashed when they differ.
+    """
+    if not entry or entry.get("format") != fmt or entry.get("granularity", "year/year") != granularity:
+        return False
+    if not all(os.path.exists(os.path.join(output_dir, f"{name}.{fmt}")) for name in ("triangle", "factors", "ultimates")):
+        return False
+    stat = os.stat(path)
+    if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if file_hash(path) != entry["hash"]:
+        return False
+    entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)  # Touched but not modified
+    return True
+
+
+def run_batch(sources, output, workers=1, fmt="parquet", force=False, out_of_core=False,
+              origin="year", development="year", verbose=True):
+    """
+    Process every claims file of sources into output, workers files at a time.
+    Returns the summary table (one row per file: done, warning, skipped or error).
+    """
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("pyarrow is not installed: writing CSV files instead of Parquet.")
+            fmt = "csv"
+
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, "manifest.json")
+    manifest = {} if force else load_manifest(manifest_path)
+    files = find_claim_files(sources)
+    names = output_names(files)
+    granularity = f"{origin}/{development}"
+
+    rows = []
+    pending = []
+    for path in files:
+        if is_unchanged(path, manifest.get(path), os.path.join(output, names[path]), fmt, granularity):
+            rows.append({"file": path, "status": "skipped", "hash": manifest[path]["hash"]})
+        else:
+            pending.append(path)
+    if verbose:
+        print(f"{len(files)} claim files, {len(files) - len(pending)} unchanged since the last run, {len(pending)} to process")
+
+    def record(path, row):
+        rows.append(row)
+        if row["status"] in ("done", "warning"):
+            stat = os.stat(path)
+            manifest[path] = {"hash": row["hash"], "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                              "format": fmt, "granularity": granularity, "output": names[path]}
+            save_manifest(manifest, manifest_path)
+        if verbose:
+            if row["status"] == "error":
+                detail = row["error"]
+            else:
+                detail = f"{row['total_s']:.2f}s, {row['rows']:,} rows" + (f"; {row['warning']}" if row["warning"] else "")
+            print(f"[{len(rows)}/{len(files)}] {os.path.basename(path)}: {row['status']} ({detail})")
+
+    def failed(path, error):
+        lines = str(error).strip().splitlines()  # First line only: DuckDB errors span many lines
+        return {"file": path, "status": "error", "error": f"{type(error).__name__}: {lines[0] if lines else ''}"}
+
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+            futures = {
+                pool.submit(process_file, path, os.path.join(output, names[path]), fmt, out_of_core, origin, development): path
+                for path in pending
+            }
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    row = failed(path, e)
+                record(path, row)
+    else:
+        for path in pending:
+            try:
+                row = process_file(path, os.path.join(output, names[path]), fmt, out_of_core, origin, development)
+            except Exception as e:
+                row = failed(path, e)
+            record(path, row)
+
+    save_manifest(manifest, manifest_path)
+    columns = ["file", "status", "rows", "reserve"] + [f"{stage}_s" for stage in STAGES] + ["total_s", "hash", "warning", "error"]
+    summary = pd.DataFrame(rows).reindex(columns=columns).sort_values("file", ignore_index=True)
+    summary.to_csv(os.path.join(output, "summary.csv"), index=False)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run chain-ladder reserving on many claim files.")
+    parser.add_argument("sources", nargs="+", help="claim files, directories or glob patterns (CSV, XLSX, JSON, Parquet)")
+    parser.add_argument("--output", default="batch_results", help="directory for the results")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="files processed in parallel")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="parquet", help="format of the result tables")
+    parser.add_argument("--force", action="store_true", help="reprocess files even if they have not changed")
+    parser.add_argument("--out-of-core", action="store_true", help="aggregate CSV files by scanning instead of loading them")
+    parser.add_argument("--origin", choices=list(GRANULARITIES), default="year", help="accident period granularity")
+    parser.add_argument("--development", choices=list(GRANULARITIES), default="year",
+                        help="development period granularity (quarter and month need a settlement date column)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    summary = run_batch(args.sources, args.output, args.workers, args.format, args.force, args.out_of_core,
+                        args.origin, args.development)
+    counts = summary["status"].value_counts()
+    print(f"{counts.get('done', 0)} processed, {counts.get('warning', 0)} with undefined factors, "
+          f"{counts.get('skipped', 0)} skipped, {counts.get('error', 0)} failed "
+          f"in {time.perf_counter() - start:.1f}s; summary in {os.path.join(args.output, 'summary.csv')}")
+    return 1 if counts.get("error", 0) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,345 @@
+"""
+Benchmarks of the reserving pipeline on synthetic claim portfolios.
+
+    python benchmark.py --rows 10000 1000000 --shapes 10 50 --repeat 3 --output bench.json
+
+Every (rows, shape) case times the pipeline stages (parse, triangle, factors, projection,
+figures and their sum), then the app's own upload job (process_upload, as the upload callback
+runs it, with the local stand-in LLM), and the results are written as JSON, so two runs can
+be compared stage by stage.
+
+    python benchmark.py --imports --baseline importtime.json
+
+profiles the cold start instead (python -X importtime of the app module) and fails if it
+regressed against the checked-in profile: a heavy module imported at startup again, or a
+total import time over the tolerance.
+"""
+import argparse
+import base64
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.io as pio
+
+from utils import parse_contents, create_triangle, compute_chain_ladder_factors, project_triangle
+
+# Product catalogue of the synthetic portfolios:
+# (Branche, Code Produit, Désignation Produit, Sous-Branche, mean severity, payment decay per period)
+PRODUCTS = [
+    ("Risques Industriels", "IN", "Incendie Risques Annexes", "Incendie", 250_000, 0.45),
+    ("Risques Industriels", "RG", "RC Générale", "Responsabilité Civile", 120_000, 0.75),
+    ("Risques Industriels", "MP", "Multirisques Professionnelles", "Risque simple", 30_000, 0.35),
+    ("Risques Simples", "MH", "Multirisques Habitation", "Risque simple", 8_000, 0.25),
+    ("Automobile", "AM", "Automobile Matériel", "Automobile", 5_000, 0.2),
+    ("Automobile", "AC", "Automobile Corporel", "Automobile", 40_000, 0.8),
+    ("Transport", "TM", "Transport Maritime", "Transport", 90_000, 0.5),
+    ("Engineering", "BR", "Bris de Machines", "Engineering", 60_000, 0.4),
+]
+
+# Share of the synthetic claims whose settlement delay is uniform over every possible age
+TAIL_SHARE = 0.2
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+DEFAULT_SHAPES = [10, 50]
+STAGES = ["parse", "triangle", "factors", "projection", "figures", "pipeline", "upload_job"]
+
+# Modules that must stay out of the app's startup (they are imported lazily, see lazy.py)
+HEAVY_MODULES = ["pandas", "numpy", "plotly.express", "pyarrow", "ollama", "scipy"]
+# Run after the import in the profiled interpreter: heavy modules actually executed, whatever
+# the path that loaded them (a lazy placeholder left in sys.modules does not count)
+LOADED_CHECK = """
+import importlib.util, json, sys
+placeholders = tuple(cls for cls in (getattr(sys.modules.get("lazy"), "_LazyModule", None),
+                                     importlib.util._LazyModule) if cls is not None)
+print(json.dumps(sorted({{heavy for heavy in {heavy!r} for name, module in list(sys.modules.items())
+                          if (name == heavy or name.startswith(heavy + "."))
+                          and module is not None and not isinstance(module, placeholders)}})))
+"""
+
+
+def heavy_package(name):
+    """
+    The heavy module that name is or belongs to (None for any other module).
+    """
+    return next((heavy for heavy in HEAVY_MODULES if name == heavy or name.startswith(heavy + ".")), None)
+
+
+def generate_claims(n_rows, n_years=10, seed=0, last_year=2024):
+    """
+    Synthetic claims table with the schema of the Mathurance extracts: one settlement per row,
+    n_years accident years ending at last_year (so an n_years x n_years triangle), payment
+    delays drawn from a per-product geometric development pattern with a long tail (a share
+    of the rows settled at any age, so every development period is populated) and lognormal
+    amounts.
+    Dates are ISO strings (unambiguous for the parser). Same seed, same table.
+    """
+    rng = np.random.default_rng(seed)
+    products = pd.DataFrame(PRODUCTS, columns=["Branche", "Code Produit", "Désignation Produit", "Sous-Branche", "severity", "decay"])
+    product = rng.integers(0, len(products), n_rows)
+
+    # Accident years grow slightly over time; development delays cannot go past last_year
+    first_year = last_year - n_years + 1
+    weights = np.linspace(1.0, 1.5, n_years)
+    accident_year = first_year + rng.choice(n_years, size=n_rows, p=weights / weights.sum())
+    decay = products["decay"].to_numpy()[product]
+    max_delay = last_year - accident_year
+    delay = np.minimum(rng.geometric(1 - decay) - 1, max_delay)
+    # Long tail: geometric delays die out after a few dozen periods, these reach the last age
+    tail = rng.random(n_rows) < TAIL_SHARE
+    delay[tail] = rng.integers(0, max_delay[tail] + 1)
+
+    # Occurrence dates: formatted once per distinct date (at most 365 per year), then gathered
+    day_of_year = rng.integers(0, 365, n_rows)
+    date_codes, distinct = pd.factorize((accident_year - first_year) * 365 + day_of_year)
+    distinct_dates = pd.to_datetime((first_year + distinct // 365).astype(str), format="%Y") + pd.to_timedelta(distinct % 365, unit="D")
+    dates = distinct_dates.strftime("%Y-%m-%d").to_numpy()[date_codes]
+    severity = products["severity"].to_numpy()[product]
+    amounts = np.round(rng.lognormal(np.log(severity) - 0.5, 1.0), 2)
+
+    return pd.DataFrame({
+        "Exercice ": accident_year + delay,  # Trailing space as in the reference workbook
+        "Branche": products["Branche"].to_numpy()[product],
+        "Code Produit": products["Code Produit"].to_numpy()[product],
+        "Désignation Produit": products["Désignation Produit"].to_numpy()[product],
+        "Sous-Branche": products["Sous-Branche"].to_numpy()[product],
+        "Date Survenance": dates,
+        "Règlement": amounts,
+    })
+
+
+def encode_upload(df, filename="claims.csv"):
+    """
+    dcc.Upload-style contents string (data URL) of a claims table written as CSV.
+    """
+    encoded = base64.b64encode(df.to_csv(index=False).encode("utf-8")).decode()
+    return f"data:text/csv;base64,{encoded}", filename
+
+
+def _time(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def build_figures(triangle, factors, triangle_proj):
+    # Imported lazily: the callbacks module pulls in Dash and the LLM client
+    from callbacks import build_heatmap_figure, build_factors_figure, build_projection_figure
+    return (
+        build_heatmap_figure(triangle),
+        build_factors_figure(factors),
+        build_projection_figure(triangle, triangle_proj),
+    )
+
+
+def upload_job():
+    """
+    The app's upload job (process_upload), registered on a bare Dash app with the local
+    stand-in LLM.
+    """
+    # Imported lazily: the callbacks module pulls in Dash and the LLM client
+    import dash
+    from callbacks import register_callbacks
+    from llm import FakeChatClient
+    return register_callbacks(dash.Dash(__name__), FakeChatClient(delay=0))
+
+
+def run_upload_job(process_upload, contents, filename):
+    """
+    One upload through the app's job, as the upload callback submits it; the first run of a
+    case is cold, later runs hit the parse and figure caches as a re-upload does.
+    Returns the time of the job.
+    """
+    from callbacks import UPLOAD_STAGES
+    from jobs import llm_jobs, upload_progress
+    from store import dataset_store
+    progress_id = upload_progress.create(UPLOAD_STAGES)
+    result, seconds = _time(process_upload, progress_id, contents, filename, "chain_ladder", None, None, None)
+    if "error" in result or "cancelled" in result:
+        raise RuntimeError(f"upload job failed: {result}")
+    dataset_store.discard(result["dataset_handle"])
+    llm_jobs.cancel(result["llm_job"])
+    return seconds
+
+
+def run_pipeline(contents, filename):
+    """
+    One pass over the pipeline stages of the upload (without the LLM call and the caches).
+    Returns the time of every stage, their sum and the size of the serialized figures.
+    """
+    timings = {}
+    total_start = time.perf_counter()
+    df, timings["parse"] = _time(parse_contents, contents, filename, cache=None)
+    triangle, timings["triangle"] = _time(create_triangle, df)
+    factors, timings["factors"] = _time(compute_chain_ladder_factors, triangle)
+    triangle_proj, timings["projection"] = _time(project_triangle, triangle, factors)
+    figures, timings["figures"] = _time(build_figures, triangle, factors, triangle_proj)
+    # The callback's response: figures serialized to JSON for the browser
+    payload = sum(len(pio.to_json(fig)) for fig in figures)
+    timings["pipeline"] = time.perf_counter() - total_start
+    return timings, {"rows": len(df), "triangle_shape": list(triangle.shape), "figure_bytes": payload}
+
+
+def benchmark_case(n_rows, n_years, repeat=3, seed=0, process_upload=None):
+    """
+    Time the pipeline and the upload job repeat times on one synthetic portfolio.
+    Reports min / median / max seconds per stage, keyed by the triangle actually built.
+    """
+    process_upload = process_upload or upload_job()
+    df = generate_claims(n_rows, n_years, seed=seed)
+    contents, filename = encode_upload(df)
+    del df
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        timings, info = run_pipeline(contents, filename)
+        gc.collect()
+        timings["upload_job"] = run_upload_job(process_upload, contents, filename)
+        runs.append(timings)
+    stages = {
+        stage: {
+            "min": min(run[stage] for run in runs),
+            "median": statistics.median(run[stage] for run in runs),
+            "max": max(run[stage] for run in runs),
+        }
+        for stage in STAGES
+    }
+    return {"rows": n_rows, "n_years": n_years, "shape": info["triangle_shape"], "repeat": repeat, "seed": seed, "stages": stages, **info}
+
+
+def environment():
+    """
+    Versions and machine details stored with the results.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "plotly": plotly.__version__,
+    }
+
+
+def import_profile(module="app", runs=3, top=15):
+    """
+    Cold import of module in fresh interpreters with -X importtime (best of runs).
+    Returns the total import time, the slowest modules (cumulative time) and the heavy
+    modules that were imported: found in the log by prefix (a package executed by a lazy
+    loader only logs its submodules) or left loaded in sys.modules after the import.
+    """
+    env = dict(os.environ, MATHURANCE_FAKE_LLM="1")
+    check = LOADED_CHECK.format(heavy=HEAVY_MODULES)
+    best = None
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}\n{check}"],
+            capture_output=True, text=True, check=True, env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        stderr = result.stderr
+        loaded = set(json.loads(result.stdout.strip().splitlines()[-1]))
+        modules = {}
+        for line in stderr.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            modules[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+        if best is None or modules[module][1] < best[module][1]:
+            best = modules
+            heavy = loaded | {heavy_package(name) for name in modules} - {None}
+    slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_seconds": best[module][1],
+        "heavy_modules": [name for name in HEAVY_MODULES if name in heavy],
+        "slowest": [{"module": name, "cumulative_seconds": cumulative, "self_seconds": self_time}
+                    for name, (self_time, cumulative) in slowest],
+    }
+
+
+def import_regressions(profile, baseline, tolerance=0.5):
+    """
+    Differences of an import profile against the baseline that count as regressions.
+    """
+    problems = []
+    for name in profile["heavy_modules"]:
+        if name not in baseline["heavy_modules"]:
+            problems.append(f"{name} is imported at startup")
+    limit = baseline["total_seconds"] * (1 + tolerance)
+    if profile["total_seconds"] > limit:
+        problems.append(f"import of {profile['module']} took {profile['total_seconds']:.2f}s (baseline "
+                        f"{baseline['total_seconds']:.2f}s, limit {limit:.2f}s)")
+    return problems
+
+
+def run_benchmarks(rows=DEFAULT_ROWS, shapes=DEFAULT_SHAPES, repeat=3, seed=0, verbose=True):
+    """
+    Benchmark every (rows, shape) combination. Returns a JSON-serializable dict.
+    """
+    results = {"environment": environment(), "cases": []}
+    process_upload = upload_job()
+    for n_rows in rows:
+        for n_years in shapes:
+            case = benchmark_case(n_rows, n_years, repeat, seed, process_upload)
+            results["cases"].append(case)
+            if verbose:
+                summary = ", ".join(f"{stage} {case['stages'][stage]['median'] * 1000:.1f}ms" for stage in STAGES)
+                print(f"{n_rows:>10,} rows, {'x'.join(map(str, case['shape']))}: {summary}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the reserving pipeline on synthetic portfolios.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="claim rows per portfolio")
+    parser.add_argument("--shapes", type=int, nargs="+", default=DEFAULT_SHAPES, help="triangle sizes (accident years)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic generator")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--imports", action="store_true", help="profile the app's import time instead")
+    parser.add_argument("--baseline", help="import profile to compare with (exit code 1 on regression)")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative import time increase")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        profile = import_profile(runs=args.repeat)
+        print(f"import app: {profile['total_seconds'] * 1000:.0f}ms, heavy modules: {', '.join(profile['heavy_modules']) or 'none'}")
+        for entry in profile["slowest"]:
+            print(f"{entry['cumulative_seconds'] * 1000:>10.1f}ms  {entry['module']}")
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), **profile}, f, indent=2)
+        print(f"Results written to {args.output}")
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                problems = import_regressions(profile, json.load(f), args.tolerance)
+            for problem in problems:
+                print("Regression:", problem)
+            if problems:
+                sys.exit(1)
+        return
+
+    results = run_benchmarks(args.rows, args.shapes, args.repeat, args.seed)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
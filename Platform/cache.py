@@ -0,0 +1,199 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from lazy import lazy_import
+from shared import shared_state
+
+np = lazy_import("numpy")
+pio = lazy_import("plotly.io")
+
+try:
+    pa = lazy_import("pyarrow")
+except ImportError:  # The cache is simply disabled without pyarrow
+    pa = None
+
+# Location and size cap of the parsed-upload cache (overridable through the environment)
+CACHE_DIR = os.environ.get(
+    "MATHURANCE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "uploads"),
+)
+CACHE_MAX_BYTES = int(os.environ.get("MATHURANCE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def content_hash(data):
+    """
+    SHA-256 hex digest of raw bytes, used as a cache key.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def triangle_fingerprint(triangle, factors=None):
+    """
+    Compact fingerprint of a triangle (and optionally its factors): a hash of the labels
+    and of the values rounded to cents, so identical data always gets the same key.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(list(triangle.index)).encode())
+    digest.update(repr(list(triangle.columns)).encode())
+    digest.update(np.round(triangle.to_numpy(dtype=np.float64, na_value=np.nan), 2).tobytes())
+    if factors is not None:
+        digest.update(repr(sorted(factors.items())).encode())
+    return digest.hexdigest()[:16]
+
+
+def evict_lru(directory, suffix, max_bytes):
+    """
+    Delete the least recently used files ending with suffix (oldest mtime first)
+    until the files left in directory take at most max_bytes.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class ParsedUploadCache:
+    """
+    On-disk cache of cleaned claims DataFrames stored as uncompressed Arrow IPC (Feather v2) files.
+    Files are memory-mapped on read, and the least recently used entries are evicted
+    once the directory grows past max_bytes (file mtime records the last access).
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = pa is not None and max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def get(self, key):
+        """
+        Return the cached DataFrame for key, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            from pyarrow import feather
+            table = feather.read_table(path, memory_map=True)
+            os.utime(path)  # Mark as recently used
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return table.to_pandas()
+
+    def put(self, key, df):
+        """
+        Store df under key, then evict old entries if the cache is over its size cap.
+        Errors are reported and ignored: the cache must never break an upload.
+        """
+        if not self.enabled:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            os.close(fd)
+            from pyarrow import feather
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            print("Error writing upload cache:", e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_bytes.
+        """
+        evict_lru(self.directory, ".arrow", self.max_bytes)
+
+
+# Shared cache used by parse_contents
+upload_cache = ParsedUploadCache()
+
+
+# Number of Plotly figures kept in memory by the figure cache
+FIGURE_CACHE_SIZE = int(os.environ.get("MATHURANCE_FIGURE_CACHE_SIZE", 64))
+
+
+class FigureCache:
+    """
+    In-memory LRU cache of built Plotly figures, keyed by (figure kind, data fingerprint).
+    Re-uploading or re-displaying the same triangle reuses the figure instead of rebuilding it.
+    With a shared state (multi-worker server) figures are also stored there as JSON, so a
+    figure built by one worker is reused by the others.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS figures (kind TEXT, key TEXT, figure TEXT, last_access REAL, PRIMARY KEY (kind, key));
+    """
+
+    def __init__(self, max_entries=FIGURE_CACHE_SIZE, state=None):
+        self.max_entries = max_entries
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+        self.state = state
+        if state is not None:
+            state.ensure_schema(self.SCHEMA)
+
+    def get_or_build(self, kind, key, build, *args):
+        with self._lock:
+            figure = self._figures.get((kind, key))
+            if figure is not None:
+                self._figures.move_to_end((kind, key))
+                return figure
+        figure = self._load(kind, key)
+        if figure is None:
+            figure = build(*args)
+            self._save(kind, key, figure)
+        if self.max_entries > 0:
+            with self._lock:
+                self._figures[(kind, key)] = figure
+                while len(self._figures) > self.max_entries:
+                    self._figures.popitem(last=False)
+        return figure
+
+    def _load(self, kind, key):
+        if self.state is None:
+            return None
+        row = self.state.execute("SELECT figure FROM figures WHERE kind = ? AND key = ?", (kind, repr(key))).fetchone()
+        if row is None:
+            return None
+        self.state.execute("UPDATE figures SET last_access = ? WHERE kind = ? AND key = ?", (time.time(), kind, repr(key)))
+        return pio.from_json(row[0], skip_invalid=True)
+
+    def _save(self, kind, key, figure):
+        if self.state is None or self.max_entries <= 0:
+            return
+        with self.state.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?)", (kind, repr(key), pio.to_json(figure), time.time()))
+            conn.execute(
+                "DELETE FROM figures WHERE rowid NOT IN (SELECT rowid FROM figures ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+
+figure_cache = FigureCache(state=shared_state)
@@ -1,14 +1,602 @@
 from dash import Input, Output, State
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from utils import parse_contents, create_triangle, compute_chain_ladder_factors, project_triangle
+from lazy import lazy_import
+from store import dataset_store
+from jobs import llm_jobs, upload_jobs, upload_progress, upload_sessions, JobCancelled
+from llm import cached_generate_text, stream_chat, chat_streams, llm_cache, LLM_MODEL
+from cache import triangle_fingerprint, figure_cache
+from closings import closing_store
+from metrics import stage_metrics, HISTOGRAM_BUCKETS
 from layout import home_layout, about_layout, scenario_analysis_layout, upload_section, chatbot_layout
 from dash import html, dcc
+import dash_bootstrap_components as dbc
 import dash
+import os
+import time
+import uuid
 from dash.exceptions import PreventUpdate
 
+# Analytics and plotting modules are loaded on first use (see lazy.py)
+np = lazy_import("numpy")
+px = lazy_import("plotly.express")
+go = lazy_import("plotly.graph_objects")
+utils = lazy_import("utils")
+reserving = lazy_import("reserving")
+scenarios = lazy_import("scenarios")
+stochastic = lazy_import("stochastic")
+cube_module = lazy_import("cube")
+preview_module = lazy_import("preview")
+
+# Worker processes for the bootstrap simulations (1 runs them in the request thread)
+BOOTSTRAP_WORKERS = int(os.environ.get("MATHURANCE_BOOTSTRAP_WORKERS", 1))
+
+# Worker processes for the per-segment reserving (1 runs the segments in the request thread)
+SEGMENT_WORKERS = int(os.environ.get("MATHURANCE_SEGMENT_WORKERS", 1))
+
+# Triangles with more cells than this are drawn without per-cell text and with WebGL traces
+LARGE_TRIANGLE_CELLS = int(os.environ.get("MATHURANCE_LARGE_TRIANGLE_CELLS", 1000))
+
+# Stages of an upload job and the label the loading message shows for each
+UPLOAD_STAGES = {
+    "parse": "Reading the file",
+    "cube": "Aggregating the claims",
+    "triangle": "Building the triangle",
+    "factors": "Computing the development factors",
+    "projection": "Projecting the ultimates",
+    "figures": "Drawing the charts",
+    "preview": "Preparing the data preview",
+    "interpretation": "Requesting the interpretation",
+}
+
+def is_large_triangle(triangle):
+    return triangle.size > LARGE_TRIANGLE_CELLS
+
+def build_heatmap_figure(triangle):
+    """
+    Heatmap of the cumulative claims triangle (cell values printed on small triangles only).
+    """
+    heatmap_fig = px.imshow(
+        triangle,
+        text_auto=not is_large_triangle(triangle),
+        aspect="auto",
+        labels=dict(x="Development Period", y="Accident Year", color="Cumulative Claims"),
+        x=[f"Period {col}" for col in triangle.columns],
+        y=triangle.index.astype(str)
+    )
+    heatmap_fig.update_layout(title="Claims Triangle (Cumulative)")
+    return heatmap_fig
+
+def build_factors_figure(factors, show_text=True):
+    """
+    Bar chart of the chain-ladder development factors.
+    """
+    factor_keys = list(factors.keys())
+    factor_values = [factors[k] for k in factor_keys]
+    bar_fig = px.bar(
+        x=[f"Period {k} to {k+1}" for k in factor_keys],
+        y=factor_values,
+        labels={"x": "Development Period", "y": "Factor"},
+        text=np.round(factor_values, 2) if show_text else None
+    )
+    bar_fig.update_layout(title="Development Factors (Chain-Ladder)")
+    return bar_fig
+
+def projection_series(triangle, triangle_proj):
+    """
+    Last known cumulative claims (from the original triangle) and projected ultimate
+    (last column of the projection) per accident year.
+    """
+    actual = triangle.ffill(axis=1).iloc[:, -1].tolist()
+    ultimate = triangle_proj[triangle_proj.columns.max()].reindex(triangle.index).tolist()
+    return actual, ultimate
+
+def projection_trace_name(method):
+    return f"Projected Ultimate Claims ({utils.RESERVING_METHODS.get(method, method)})"
+
+def method_status(method, loss_ratio=None, estimated=False):
+    """
+    Reserving method of the projection shown, with the expected loss ratio it used.
+    """
+    label = utils.RESERVING_METHODS.get(method, method)
+    if loss_ratio is None:
+        return f"Projection: {label}."
+    source = " (Cape Cod estimate)" if estimated else ""
+    return f"Projection: {label}, expected loss ratio {loss_ratio:.1%}{source}."
+
+def project_dataset(triangle, factors, method, premiums, expected_loss_ratio):
+    """
+    utils.project_with_method, falling back to chain-ladder when the method cannot run
+    (Bornhuetter-Ferguson and Cape Cod without premiums).
+    Returns the projection, the method and loss ratio used, and the method-status message.
+    """
+    try:
+        triangle_proj, loss_ratio = utils.project_with_method(triangle, factors, method, premiums, expected_loss_ratio)
+    except ValueError as e:
+        triangle_proj, _ = utils.project_with_method(triangle, factors, "chain_ladder")
+        message = html.Span(f"{e} The projection shown is Chain-Ladder.", style={"color": "#b35c00"})
+        return triangle_proj, "chain_ladder", None, message
+    estimated = method == "bornhuetter_ferguson" and expected_loss_ratio is None
+    return triangle_proj, method, loss_ratio, method_status(method, loss_ratio, estimated)
+
+def build_projection_figure(triangle, triangle_proj, method="chain_ladder"):
+    """
+    Line plot of the last known cumulative claims vs. the projected ultimate per accident year.
+    Trace 0 holds the actual claims and trace 1 the projection (see projection_patch).
+    """
+    accident_years = triangle.index.tolist()
+    actual, ultimate = projection_series(triangle, triangle_proj)
+    scatter = go.Scattergl if is_large_triangle(triangle) else go.Scatter
+
+    line_fig = go.Figure()
+    line_fig.add_trace(scatter(
+        x=accident_years, y=actual,
+        mode="lines+markers",
+        name="Last Known Cumulative Claims"
+    ))
+    line_fig.add_trace(scatter(
+        x=accident_years, y=ultimate,
+        mode="lines+markers",
+        name=projection_trace_name(method)
+    ))
+    line_fig.update_layout(
+        title="Actual vs. Projected Ultimate Claims by Accident Year",
+        xaxis_title="Accident Year",
+        yaxis_title="Claims Amount"
+    )
+    return line_fig
+
+def projection_patch(triangle, triangle_proj, method):
+    """
+    Partial update of the projection figure when only the reserving method changed:
+    the actual-claims trace and the layout stay in the browser, only trace 1 is resent.
+    """
+    patch = dash.Patch()
+    patch["data"][1]["y"] = projection_series(triangle, triangle_proj)[1]
+    patch["data"][1]["name"] = projection_trace_name(method)
+    return patch
+
+def build_triangle_figures(triangle, factors, triangle_proj, method, fingerprint):
+    """
+    Heatmap, factor and projection figures of a dataset, memoized by the triangle fingerprint
+    so the same data (re-upload, page revisit) does not rebuild them.
+    """
+    large = is_large_triangle(triangle)
+    return (
+        figure_cache.get_or_build("heatmap", fingerprint, build_heatmap_figure, triangle),
+        figure_cache.get_or_build("factors", fingerprint, build_factors_figure, factors, not large),
+        figure_cache.get_or_build(
+            "projection", (fingerprint, method, triangle_fingerprint(triangle_proj)),
+            build_projection_figure, triangle, triangle_proj, method
+        ),
+    )
+
+def build_reserve_distribution_figure(summary):
+    """
+    Histogram of the simulated total reserve with its mean, VaR and TVaR.
+    """
+    fig = px.histogram(x=summary["total"], nbins=60, labels={"x": "Total Reserve"})
+    for value, name, color in [(summary["mean"], "Mean", "#1675e0"),
+                               (summary["var"], f"VaR {summary['level']}%", "orange"),
+                               (summary["tvar"], f"TVaR {summary['level']}%", "red")]:
+        fig.add_vline(x=value, line_color=color, line_dash="dash", annotation_text=name)
+    fig.update_layout(title="Distribution of the Total Reserve (Bootstrap ODP)", yaxis_title="Simulations")
+    return fig
+
+def build_reserve_percentiles_figure(summary):
+    """
+    Reserve percentiles by accident year.
+    """
+    by_year = summary["by_year"]
+    fig = go.Figure()
+    for percentile in stochastic.RESERVE_PERCENTILES:
+        column = f"{percentile:g}%"
+        fig.add_trace(go.Scatter(x=by_year.index, y=by_year[column], mode="lines+markers", name=f"P{percentile:g}"))
+    fig.update_layout(title="Reserve Percentiles by Accident Year", xaxis_title="Accident Year", yaxis_title="Reserve")
+    return fig
+
+# Development factor values spanned by the scenario sensitivity surface
+SCENARIO_FACTOR_GRID = [round(1.0 + 0.1 * i, 1) for i in range(11)]
+
+def build_scenario_table(results):
+    """
+    Total ultimate and reserve of the base (row 0) and selected (row 1) scenarios.
+    """
+    base_total, scenario_total = results["total_reserve"][:2]
+    return dash.dash_table.DataTable(
+        data=[
+            {"Scenario": "Base", "Total Ultimate": f"{np.nansum(results['ultimates'][0]):,.0f}", "Total Reserve": f"{base_total:,.0f}", "Change": ""},
+            {"Scenario": "Selected", "Total Ultimate": f"{np.nansum(results['ultimates'][1]):,.0f}", "Total Reserve": f"{scenario_total:,.0f}",
+             "Change": f"{(scenario_total / base_total - 1) * 100:+.1f}%" if base_total else ""},
+        ],
+        columns=[{"name": i, "id": i} for i in ["Scenario", "Total Ultimate", "Total Reserve", "Change"]],
+        style_header={"backgroundColor": "#1675e0", "color": "white", "fontWeight": "bold"},
+        style_cell={"textAlign": "left", "padding": "10px"},
+    )
+
+def build_scenario_figures(engine, results, n_grid):
+    """
+    Line plot of ultimates (base vs. selected scenario), summary table and sensitivity surface,
+    all read from one batched evaluation: row 0 is the base, row 1 the selected scenario and
+    the remaining rows the factor grid.
+    """
+    accident_years = list(engine.accident_years)
+    line_fig = go.Figure()
+    for row, name in [(0, "Base (Chain-Ladder, no extra inflation)"), (1, "Selected Scenario")]:
+        line_fig.add_trace(go.Scatter(x=accident_years, y=results["ultimates"][row], mode="lines+markers", name=name))
+    line_fig.update_layout(title="Projected Ultimate Claims by Accident Year", xaxis_title="Accident Year", yaxis_title="Ultimate Claims")
+
+    table = build_scenario_table(results)
+
+    surface = results["total_reserve"][2:].reshape(n_grid, n_grid)
+    surface_fig = go.Figure(go.Surface(x=SCENARIO_FACTOR_GRID, y=SCENARIO_FACTOR_GRID, z=surface))
+    surface_fig.update_layout(
+        title="Total Reserve Sensitivity to Development Factors",
+        scene=dict(xaxis_title="Factor 2 to 3", yaxis_title="Factor 1 to 2", zaxis_title="Total Reserve"),
+    )
+    return line_fig, table, surface_fig
+
+def build_segment_reserve_figure(reserves, segment_name):
+    """
+    Paid to date vs. chain-ladder reserve per segment (product or sub-branch).
+    """
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=reserves["Segment"], y=reserves["Paid"], name="Paid to Date"))
+    fig.add_trace(go.Bar(x=reserves["Segment"], y=reserves["Reserve"], name="Reserve (Chain-Ladder)"))
+    fig.update_layout(barmode="stack", title=f"Paid and Reserve by {segment_name}", xaxis_title=segment_name, yaxis_title="Claims Amount")
+    return fig
+
+def build_reserve_summary_table(reserves):
+    """
+    Consolidated reserve table: one row per (product, sub-branch) segment plus the total.
+    Segments with factors that could not be estimated are marked with an asterisk.
+    """
+    data = reserves.drop(columns="Undefined Factors")
+    flagged = reserves["Undefined Factors"] > 0
+    data.loc[flagged, "Sous-Branche"] = data.loc[flagged, "Sous-Branche"] + " *"
+    for column in ["Paid", "Ultimate", "Reserve"]:
+        data[column] = data[column].map(lambda value: f"{value:,.0f}")
+    note = html.Small(
+        "* Some development periods of this segment have no accident year observed at both ages: "
+        "their factor cannot be estimated and is taken as 1 (no further development).",
+        style={"color": "#888888"},
+    ) if flagged.any() else None
+    return html.Div([
+        html.H4("Reserves by Product and Sub-Branch", className="text-center mb-3"),
+        dash.dash_table.DataTable(
+            data=data.to_dict("records"),
+            columns=[{"name": i, "id": i} for i in data.columns],
+            page_size=15,
+            style_header={"backgroundColor": "#1675e0", "color": "white", "fontWeight": "bold"},
+            style_cell={"textAlign": "left", "padding": "10px"},
+            style_data_conditional=[{"if": {"filter_query": '{Code Produit} = "Total"'}, "fontWeight": "bold"}],
+        ),
+        note,
+    ])
+
+def histogram_sparkline(counts):
+    """
+    Wall time histogram of a stage as a row of block characters (one per bucket).
+    """
+    blocks = " \u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588"
+    top = max(counts) or 1
+    return "".join(blocks[-(-8 * n // top)] for n in counts)
+
+def build_diagnostics_table(rows):
+    """
+    Per-stage timings of the callbacks (rolling window): calls, wall time percentiles,
+    mean CPU time, memory and the wall time distribution.
+    """
+    if not rows:
+        return html.P("No callback has run yet.", style={"color": "#888888"})
+    data = []
+    for row in rows:
+        entry = {"Callback": row["callback"], "Stage": row["stage"], "Calls": row["calls"], "Errors": row["errors"]}
+        if "wall_p50" in row:
+            entry.update({
+                "p50 (ms)": f"{row['wall_p50'] * 1000:,.1f}",
+                "p95 (ms)": f"{row['wall_p95'] * 1000:,.1f}",
+                "Max (ms)": f"{row['wall_max'] * 1000:,.1f}",
+                "CPU (ms)": f"{row['cpu_mean'] * 1000:,.1f}",
+                "Memory (MB)": "n/a" if np.isnan(row["memory"]) else f"{row['memory'] / 2**20:,.1f}",
+                "Distribution": histogram_sparkline(row["histogram"]),
+            })
+        data.append(entry)
+    columns = ["Callback", "Stage", "Calls", "Errors", "p50 (ms)", "p95 (ms)", "Max (ms)", "CPU (ms)", "Memory (MB)", "Distribution"]
+    return html.Div([
+        dash.dash_table.DataTable(
+            data=data,
+            columns=[{"name": i, "id": i} for i in columns],
+            sort_action="native",
+            page_size=25,
+            style_header={"backgroundColor": "#1675e0", "color": "white", "fontWeight": "bold"},
+            style_cell={"textAlign": "left", "padding": "6px", "fontSize": "13px"},
+            style_data_conditional=[{"if": {"filter_query": '{Stage} = "total"'}, "fontWeight": "bold"}],
+        ),
+        html.Small(
+            "Distribution buckets (s): \u2264 " + ", ".join(str(bound) for bound in HISTOGRAM_BUCKETS) + ", more",
+            style={"color": "#888888"},
+        ),
+        html.Br(),
+        html.Small(
+            "Memory: peak allocations of the stage (tracemalloc)." if stage_metrics.trace_memory else
+            "Memory: change of the process RSS over the stage, shared with concurrent callbacks. "
+            "Per-stage peaks need MATHURANCE_TRACE_MEMORY=1.",
+            style={"color": "#888888"},
+        ),
+    ])
+
+def closing_options(closings):
+    """
+    Dropdown options of the saved closings (most recent first).
+    """
+    return [
+        {"label": f"{c['name']} · {c['filename'] or 'unknown file'} · reserve {c['reserve']:,.0f}", "value": c["id"]}
+        for c in closings
+    ]
+
+def build_closing_diff_table(diff, base_name, other_name):
+    """
+    Paid, ultimate and reserve per accident year of two closings, with the changes and a total row.
+    """
+    data = diff[["Accident Year", "Ultimate (base)", "Ultimate (compared)", "Ultimate change",
+                 "Reserve (base)", "Reserve (compared)", "Reserve change"]].copy()
+    total = data.drop(columns="Accident Year").sum()
+    data.loc[len(data)] = ["Total", *total]
+    for column in data.columns[1:]:
+        data[column] = data[column].map(lambda value: f"{value:,.0f}")
+    return html.Div([
+        html.H5(f"{other_name} compared with {base_name}", style={"color": "#1675e0"}),
+        dash.dash_table.DataTable(
+            data=data.to_dict("records"),
+            columns=[{"name": i, "id": i} for i in data.columns],
+            page_size=25,
+            style_header={"backgroundColor": "#1675e0", "color": "white", "fontWeight": "bold"},
+            style_cell={"textAlign": "left", "padding": "6px"},
+            style_data_conditional=[{"if": {"filter_query": '{Accident Year} = "Total"'}, "fontWeight": "bold"}],
+        ),
+    ])
+
+def build_segment_claims_figure(totals, segment_name):
+    """
+    Settlements per segment, stacked by accident year.
+    """
+    fig = go.Figure()
+    for year in totals.columns:
+        fig.add_trace(go.Bar(x=totals.index, y=totals[year], name=str(year)))
+    fig.update_layout(barmode="stack", title=f"Claims by {segment_name}", xaxis_title=segment_name, yaxis_title="Settlements")
+    return fig
+
+def undefined_factors_warning(factors):
+    """
+    Warning listing the development factors that could not be estimated, or None.
+    """
+    periods = reserving.undefined_factor_periods(factors)
+    if not periods:
+        return None
+    return html.P(
+        f"Development factors {', '.join(f'{p} to {p + 1}' for p in periods)} could not be estimated "
+        "(no accident year is observed at both ages) and are taken as 1 in the projections.",
+        style={"color": "#b35c00"},
+    )
+
+def upload_progress_message(snapshot, filename):
+    """
+    Loading message of an upload job: its current stage and a progress bar over UPLOAD_STAGES.
+    """
+    completed = snapshot["completed"] if snapshot else 0
+    stage = UPLOAD_STAGES.get(snapshot["stage"], "Waiting") if snapshot and snapshot["stage"] else "Waiting"
+    elapsed = f", {snapshot['elapsed']:.1f}s" if snapshot else ""
+    return [
+        html.P(
+            "Please wait, your data is being preprocessed...",
+            style={"color": "#1675e0", "fontSize": "18px", "textAlign": "center", "margin": "20px"}
+        ),
+        dbc.Progress(value=completed, max=len(UPLOAD_STAGES), striped=True, animated=True, className="mb-2"),
+        html.Small(f"{filename}: {stage} ({completed}/{len(UPLOAD_STAGES)}{elapsed})", style={"color": "#333333"}),
+    ]
+
+def pending_message(job_id):
+    """
+    Chat placeholder shown while an LLM job is running; replaced by poll_llm_jobs.
+    """
+    return html.Div(
+        html.P("Bot is thinking...", style={"color": "#888888", "fontStyle": "italic"}),
+        id=f"llm-pending-{job_id}",
+        style={"textAlign": "left", "marginBottom": "10px"}
+    )
+
+def llm_result_message(job_id, kind):
+    """
+    Chat message for a finished LLM job (or the matching fallback message on error).
+    """
+    try:
+        text = llm_jobs.result(job_id)
+        return html.Div(
+            dcc.Markdown(f"**Bot:**\n\n{text}"),  # Use Markdown for formatting
+            style={"textAlign": "left", "marginBottom": "10px"}
+        )
+    except Exception as e:
+        if kind == "interpretation":
+            return html.Div(
+                html.P(f"In order to keep the data private, local LLM will be integrated and used to interpret data and help in decision making", style={"color": "green"}),
+                style={"textAlign": "left", "marginBottom": "10px"}
+            )
+        return html.Div(
+            html.P(f"Bot: Error processing your request. Please try again.", style={"color": "red"}),
+            style={"textAlign": "left", "marginBottom": "10px"}
+        )
+
+def stream_message(message_id, state):
+    """
+    Chat message for a streaming reply: partial text with a cursor while generating,
+    then the full text with time-to-first-token and tokens/sec.
+    """
+    if state["error"] and not state["text"]:
+        return html.Div(
+            html.P(f"Bot: Error processing your request. Please try again.", style={"color": "red"}),
+            style={"textAlign": "left", "marginBottom": "10px"}
+        )
+    if not state["done"]:
+        return html.Div(
+            dcc.Markdown(f"**Bot:**\n\n{state['text']} \u258c"),
+            id=message_id,  # Keep the id so later polls can update this message
+            style={"textAlign": "left", "marginBottom": "10px"}
+        )
+
+    stats = []
+    if state["ttft"] is not None:
+        stats.append(f"first token {state['ttft']:.1f} s")
+    if state["tokens_per_sec"] is not None:
+        stats.append(f"{state['tokens_per_sec']:.1f} tokens/s")
+    if state["cancelled"]:
+        stats.append("stopped")
+    return html.Div(
+        [
+            dcc.Markdown(f"**Bot:**\n\n{state['text']}"),  # Use Markdown for formatting
+            html.Small(" \u00b7 ".join(stats), style={"color": "#888888"}),
+        ],
+        style={"textAlign": "left", "marginBottom": "10px"}
+    )
+
 def register_callbacks(app, model):
+    def build_upload(progress, contents, filename, method, expected_loss_ratio, excel_sheet, excel_columns):
+        """
+        Processing of an uploaded file, run as an upload job: parse, cube, triangle, factors,
+        projection, figures and preview, then the dataset is registered and its interpretation
+        requested. progress.advance() is called before each stage (see UPLOAD_STAGES).
+        """
+        # Parse the uploaded file
+        progress.advance("parse")
+        with stage_metrics.stage("process_upload", "parse"):
+            df = utils.parse_contents(contents, filename, sheet_name=(excel_sheet or '').strip() or None, usecols=excel_columns)
+        if df is None or df.empty:
+            return {"error": "Error processing file or file is empty."}
+
+        # Pre-aggregate the claims by product / sub-branch / accident year / period once
+        progress.advance("cube")
+        with stage_metrics.stage("process_upload", "cube"):
+            cube = cube_module.ClaimsCube.from_claims(df)
+
+        # Create the claims triangle (cumulative)
+        progress.advance("triangle")
+        with stage_metrics.stage("process_upload", "triangle"):
+            triangle = utils.create_triangle(df)
+        
+        # Compute Chain-Ladder factors
+        progress.advance("factors")
+        with stage_metrics.stage("process_upload", "factors"):
+            factors = utils.compute_chain_ladder_factors(triangle)
+        
+        # Project the ultimate claims using the selected reserving method
+        progress.advance("projection")
+        with stage_metrics.stage("process_upload", "projection"):
+            premiums = utils.exposure_by_accident_year(df, triangle)
+            triangle_proj, method, loss_ratio, status = project_dataset(triangle, factors, method, premiums, expected_loss_ratio)
+
+        fingerprint = triangle_fingerprint(triangle, factors)
+        preview = preview_module.PreviewIndex(df)
+
+        # Heatmap of the triangle, development factors and actual vs. projected ultimate claims
+        progress.advance("figures")
+        with stage_metrics.stage("process_upload", "figures"):
+            heatmap_fig, bar_fig, line_fig = build_triangle_figures(triangle, factors, triangle_proj, method, fingerprint)
+        
+        # Create the table and message
+        progress.advance("preview")
+        with stage_metrics.stage("process_upload", "preview"):
+            first_page, page_count = preview.page()
+        children = html.Div([
+            html.H5(f"File {filename} successfully uploaded and processed.", style={"color": "#1675e0", "marginBottom": "20px"}),
+            undefined_factors_warning(factors),
+            html.Small(
+                "; ".join(f"Sheet {sheet} parsed in {seconds:.2f}s" for sheet, seconds in df.attrs.get("parse_timings", {}).items()),
+                style={"color": "#333333"},
+            ),
+            html.H6("Data Preview:", style={"color": "#333333", "marginBottom": "10px"}),
+            dash.dash_table.DataTable(
+                id="data-preview",
+                data=first_page,
+                columns=[{"name": i, "id": i} for i in df.columns],
+                # Paging, sorting and filtering run on the server (see update_preview_page)
+                page_current=0,
+                page_size=preview_module.PREVIEW_PAGE_SIZE,
+                page_count=page_count,
+                page_action="custom",
+                sort_action="custom",
+                sort_mode="multi",
+                sort_by=[],
+                filter_action="custom",
+                filter_query="",
+                style_table={
+                    "border": "1px solid #ddd",  # Add border to the table
+                    "borderRadius": "5px",  # Rounded corners
+                    "overflowX": "auto",  # Enable horizontal scrolling if needed
+                },
+                style_header={
+                    "backgroundColor": "#1675e0",  # Header background color
+                    "color": "white",  # Header text color
+                    "fontWeight": "bold",  # Bold header text
+                    "textAlign": "center",  # Center-align header text
+                },
+                style_cell={
+                    "textAlign": "left",  # Align cell text to the left
+                    "padding": "10px",  # Add padding to cells
+                    "border": "1px solid #ddd",  # Add borders to cells
+                },
+                style_data_conditional=[
+                    {
+                        "if": {"row_index": "odd"},  # Alternate row colors
+                        "backgroundColor": "#f9f9f9",  # Light gray for odd rows
+                    }
+                ],
+            )
+        ])
+        
+        # Last stage: a superseded upload stops here, before its dataset and interpretation exist
+        progress.advance("interpretation")
+        # Keep the full dataset on the server; the browser only stores its handle
+        dataset_handle = dataset_store.register(
+            df=df, triangle=triangle, factors=factors, triangle_proj=triangle_proj, filename=filename,
+            premiums=premiums, method=method, loss_ratio=loss_ratio, cube=cube, fingerprint=fingerprint,
+            data_hash=df.attrs.get("content_hash")
+        )
+        preview_module.preview_cache.put(dataset_handle, preview)
+        
+        # Generate an interpretation of the plots using Gemini
+        interpretation_prompt = f"""
+        You are an expert in actuarial science and data visualization. Interpret the following plots:
+        1. Heatmap: {heatmap_fig.layout.title.text}
+        2. Bar Chart: {bar_fig.layout.title.text}
+        3. Line Plot: {line_fig.layout.title.text}
+
+        Provide a detailed analysis of the trends, patterns, and insights from these plots.
+        """
+        # The interpretation runs in the background; the charts are returned right away
+        # Same triangle and prompt: the reply comes from the response cache
+        job_id = llm_jobs.submit(
+            stage_metrics.timed("process_upload", "llm", cached_generate_text), model, interpretation_prompt, fingerprint
+        )
+        return {
+            "children": children,
+            "figures": (heatmap_fig, bar_fig, line_fig),
+            "dataset_handle": dataset_handle,
+            "llm_job": job_id,
+            "method_status": status,
+        }
+
+    @stage_metrics.instrument("process_upload")
+    def process_upload(progress_id, *args):
+        """
+        Upload job: the results of build_upload, {"cancelled": True} if a newer upload of the
+        session superseded it, or {"error": message}.
+        """
+        progress = upload_progress.get(progress_id)
+        try:
+            return build_upload(progress, *args)
+        except JobCancelled:
+            return {"cancelled": True}
+        finally:
+            upload_progress.pop(progress_id)
+
     @app.callback(
         [Output("output-data-upload", "children"),
          Output("heatmap-triangle", "figure"),
@@ -20,14 +608,28 @@ def register_callbacks(app, model):
          Output("chatbot-container", "style"),  # Control chatbot visibility
          Output("chat-history", "children"),  # Update chat history
          Output("user-input", "value"),  # Clear input box
-         Output("dynamic-upload-section", "children")],  # Control upload/loading message section
+         Output("dynamic-upload-section", "children"),  # Control upload/loading message section
+         Output("stored-data", "data"),  # Handle of the server-side dataset
+         Output("llm-jobs", "data"),  # Pending LLM jobs
+         Output("llm-poll", "disabled"),  # Poll while LLM jobs are pending
+         Output("loading-message", "children"),  # Progress of the upload being processed
+         Output("loading-message", "style"),
+         Output("loading-state", "data"),  # Upload job in progress
+         Output("loading-interval", "disabled")],  # Poll the upload job
         [Input("upload-data", "contents"),  # Triggered by file upload
          Input("send-button", "n_clicks")],  # Triggered by user input
         [State("upload-data", "filename"),
          State("user-input", "value"),
-         State("chat-history", "children")]
+         State("stored-data", "data"),
+         State("model-dropdown", "value"),
+         State("expected-loss-ratio", "value"),
+         State("excel-sheet", "value"),
+         State("excel-columns", "value"),
+         State("loading-state", "data")]
     )
-    def update_app(contents, n_clicks, filename, user_input, chat_history):
+    @stage_metrics.instrument("update_app")
+    def update_app(contents, n_clicks, filename, user_input, dataset_handle, method, expected_loss_ratio,
+                   excel_sheet, excel_columns, loading_state):
         ctx = dash.callback_context  # Determine which input triggered the callback
 
         if not ctx.triggered:
@@ -39,156 +641,41 @@ def register_callbacks(app, model):
             if contents is None:
                 # No file uploaded yet
                 return (
-                    ["Please upload a CSV file.", {}, {}, {}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, [], "", upload_section]
-                )
-            
-            # Show the loading message
-            loading_message_div = html.Div(
-                children=[
-                    html.P(
-                        "Please wait, your data is being preprocessed...",
-                        style={"color": "#1675e0", "fontSize": "18px", "textAlign": "center", "margin": "20px"}
-                    )
-                ]
-            )
-
-            # Parse the uploaded file
-            df = parse_contents(contents, filename)
-            if df is None or df.empty:
-                # Error processing file
-                return (
-                    ["Error processing file or file is empty.", {}, {}, {}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, [], "", upload_section]
+                    ["Please upload a CSV file.", {}, {}, {}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, [], "", upload_section, None, [], True,
+                     dash.no_update, dash.no_update, dash.no_update, dash.no_update]
                 )
-
-            # Create the claims triangle (cumulative)
-            triangle = create_triangle(df)
-            
-            # Compute Chain-Ladder factors
-            factors = compute_chain_ladder_factors(triangle)
-            
-            # Project the ultimate claims using the Chain-Ladder method
-            triangle_proj = project_triangle(triangle, factors)
-            
-            # --- Plot 1: Heatmap of the Claims Triangle ---
-            heatmap_fig = px.imshow(
-                triangle,
-                text_auto=True,
-                aspect="auto",
-                labels=dict(x="Development Period", y="Accident Year", color="Cumulative Claims"),
-                x=[f"Period {col}" for col in triangle.columns],
-                y=triangle.index.astype(str)
-            )
-            heatmap_fig.update_layout(title="Claims Triangle (Cumulative)")
             
-            # --- Plot 2: Bar Chart of Chain-Ladder Development Factors ---
-            factor_keys = list(factors.keys())
-            factor_values = [factors[k] for k in factor_keys]
-            bar_fig = px.bar(
-                x=[f"Period {k} to {k+1}" for k in factor_keys],
-                y=factor_values,
-                labels={"x": "Development Period", "y": "Factor"},
-                text=np.round(factor_values, 2)
+            # Processing runs as an upload job; poll_upload shows its progress and then its results
+            session = (loading_state or {}).get("session") or uuid.uuid4().hex
+            progress_id = upload_progress.create(UPLOAD_STAGES)
+            job_id = upload_jobs.submit(
+                process_upload, progress_id, contents, filename, method, expected_loss_ratio, excel_sheet, excel_columns
             )
-            bar_fig.update_layout(title="Development Factors (Chain-Ladder)")
-            
-            # --- Plot 3: Line Plot for Actual vs. Projected Ultimate Claims ---
-            accident_years = triangle.index.tolist()
-            actual = []
-            ultimate = []
-            for year in accident_years:
-                # Last known cumulative value from the original triangle
-                row = triangle.loc[year].dropna()
-                last_known_period = row.index.max() if not row.empty else None
-                actual_val = row[last_known_period] if last_known_period is not None else np.nan
-                # Ultimate claim from the projected triangle (last period column)
-                ultimate_val = triangle_proj.loc[year, triangle_proj.columns.max()]
-                actual.append(actual_val)
-                ultimate.append(ultimate_val)
-            
-            line_fig = go.Figure()
-            line_fig.add_trace(go.Scatter(
-                x=accident_years, y=actual,
-                mode="lines+markers",
-                name="Last Known Cumulative Claims"
-            ))
-            line_fig.add_trace(go.Scatter(
-                x=accident_years, y=ultimate,
-                mode="lines+markers",
-                name="Projected Ultimate Claims"
-            ))
-            line_fig.update_layout(
-                title="Actual vs. Projected Ultimate Claims by Accident Year",
-                xaxis_title="Accident Year",
-                yaxis_title="Claims Amount"
-            )
-            
-            # Create the table and message
-            children = html.Div([
-                html.H5(f"File {filename} successfully uploaded and processed.", style={"color": "#1675e0", "marginBottom": "20px"}),
-                html.H6("Data Preview:", style={"color": "#333333", "marginBottom": "10px"}),
-                dash.dash_table.DataTable(
-                    data=df.head(10).to_dict("records"),
-                    columns=[{"name": i, "id": i} for i in df.columns],
-                    page_size=10,
-                    style_table={
-                        "border": "1px solid #ddd",  # Add border to the table
-                        "borderRadius": "5px",  # Rounded corners
-                        "overflowX": "auto",  # Enable horizontal scrolling if needed
-                    },
-                    style_header={
-                        "backgroundColor": "#1675e0",  # Header background color
-                        "color": "white",  # Header text color
-                        "fontWeight": "bold",  # Bold header text
-                        "textAlign": "center",  # Center-align header text
-                    },
-                    style_cell={
-                        "textAlign": "left",  # Align cell text to the left
-                        "padding": "10px",  # Add padding to cells
-                        "border": "1px solid #ddd",  # Add borders to cells
-                    },
-                    style_data_conditional=[
-                        {
-                            "if": {"row_index": "odd"},  # Alternate row colors
-                            "backgroundColor": "#f9f9f9",  # Light gray for odd rows
-                        }
-                    ],
-                )
-            ])
-            
-            # Generate an interpretation of the plots using Gemini
-            interpretation_prompt = f"""
-            You are an expert in actuarial science and data visualization. Interpret the following plots:
-            1. Heatmap: {heatmap_fig.layout.title.text}
-            2. Bar Chart: {bar_fig.layout.title.text}
-            3. Line Plot: {line_fig.layout.title.text}
-
-            Provide a detailed analysis of the trends, patterns, and insights from these plots.
-            """
-            try:
-                interpretation = model.generate_content(interpretation_prompt)
-                interpretation_message = html.Div(
-                    dcc.Markdown(f"**Bot:**\n\n{interpretation.text}"),  # Use Markdown for formatting
-                    style={"textAlign": "left", "marginBottom": "10px"}
-                )
-            except Exception as e:
-                interpretation_message = html.Div(
-                    html.P(f"In order to keep the data private, local LLM will be integrated and used to interpret data and help in decision making", style={"color": "green"}),
-                    style={"textAlign": "left", "marginBottom": "10px"}
-                )
-            
-            # Show plots, table, and chatbot after successful upload
+            # A newer upload supersedes the one still being processed in this session
+            previous = upload_sessions.start(session, job_id, progress_id)
+            if previous is not None:
+                previous_job, previous_progress = previous
+                upload_progress.cancel(previous_progress)
+                upload_jobs.cancel(previous_job)
             return (
-                children,  # Table and message
-                heatmap_fig,  # Heatmap figure
-                bar_fig,  # Bar chart figure
-                line_fig,  # Line plot figure
-                {"display": "block"},  # Show heatmap
-                {"display": "block"},  # Show bar chart
-                {"display": "block"},  # Show line plot
-                {"display": "block"},  # Show chatbot
-                [interpretation_message],  # Add interpretation to chat history
-                "",  # Clear input box
-                html.Div()  # Hide the upload button by returning an empty Div
+                dash.no_update,  # Previous results stay until the new ones are ready
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,  # Keep the upload button so a corrected file can replace this one
+                dash.no_update,
+                dash.no_update,
+                dash.no_update,
+                upload_progress_message(None, filename),  # Show the loading message
+                {"display": "block"},
+                {"session": session, "job": job_id, "progress": progress_id, "filename": filename},  # Upload in progress
+                False  # Poll the upload job
             )
 
         elif triggered_id == "send-button":
@@ -201,22 +688,31 @@ def register_callbacks(app, model):
                 html.P(f"**You:** {user_input}", style={"color": "#1675e0", "fontWeight": "bold"}),
                 style={"textAlign": "right", "marginBottom": "10px"}
             )
-            chat_history = chat_history + [user_message] if chat_history else [user_message]
+            # Appended with a Patch: a poll swapping a placeholder at the same time keeps its update
+            history = dash.Patch()
+            history.append(user_message)
+            pending = dash.no_update
 
-            # Get chatbot response using Gemini API
-            try:
-                response = model.generate_content(user_input)
-                bot_message = html.Div(
-                    dcc.Markdown(f"**Bot:**\n\n{response.text}"),  # Use Markdown for formatting
-                    style={"textAlign": "left", "marginBottom": "10px"}
-                )
-                chat_history.append(bot_message)
-            except Exception as e:
-                error_message = html.Div(
-                    html.P(f"Bot: Error processing your request. Please try again.", style={"color": "red"}),
+            # Repeated questions about the same data are answered from the response cache
+            triangle = dataset_store.get(dataset_handle, "triangle")
+            fingerprint = triangle_fingerprint(triangle) if triangle is not None else ""
+            cache_key = llm_cache.key(user_input, LLM_MODEL, fingerprint)
+            cached_reply = llm_cache.get(cache_key)
+            if cached_reply is not None:
+                history.append(html.Div(
+                    dcc.Markdown(f"**Bot:**\n\n{cached_reply}"),  # Use Markdown for formatting
                     style={"textAlign": "left", "marginBottom": "10px"}
+                ))
+            else:
+                # Stream the chatbot response from a background job
+                stream_id = chat_streams.create()
+                job_id = llm_jobs.submit(
+                    stage_metrics.timed("update_app", "llm_chat", stream_chat),
+                    model, user_input, chat_streams.get(stream_id), cache_key=cache_key
                 )
-                chat_history.append(error_message)
+                history.append(pending_message(job_id))
+                pending = dash.Patch()
+                pending.append({"id": job_id, "kind": "chat", "stream": stream_id})
 
             return (
                 dash.no_update,  # No change to output-data-upload
@@ -227,27 +723,515 @@ def register_callbacks(app, model):
                 dash.no_update,  # No change to bar-factors style
                 dash.no_update,  # No change to line-projection style
                 dash.no_update,  # No change to chatbot-container style
-                chat_history,  # Update chat history
+                history,  # Append to the chat history
                 "",  # Clear input box
-                dash.no_update  # No change to upload/loading message section
+                dash.no_update,  # No change to upload/loading message section
+                dash.no_update,  # No change to stored dataset handle
+                pending,  # Add the reply job to the pending LLM jobs
+                dash.no_update,  # toggle_llm_poll follows the pending jobs
+                dash.no_update,  # No change to the loading message
+                dash.no_update,
+                dash.no_update,  # No change to the upload job
+                dash.no_update
             )
 
         else:
             raise PreventUpdate  # Unknown trigger
 
+    @app.callback(
+        [Output("output-data-upload", "children", allow_duplicate=True),
+         Output("heatmap-triangle", "figure", allow_duplicate=True),
+         Output("bar-factors", "figure", allow_duplicate=True),
+         Output("line-projection", "figure", allow_duplicate=True),
+         Output("heatmap-triangle", "style", allow_duplicate=True),
+         Output("bar-factors", "style", allow_duplicate=True),
+         Output("line-projection", "style", allow_duplicate=True),
+         Output("chatbot-container", "style", allow_duplicate=True),
+         Output("chat-history", "children", allow_duplicate=True),
+         Output("dynamic-upload-section", "children", allow_duplicate=True),
+         Output("stored-data", "data", allow_duplicate=True),
+         Output("llm-jobs", "data", allow_duplicate=True),
+         Output("llm-poll", "disabled", allow_duplicate=True),
+         Output("loading-message", "children", allow_duplicate=True),
+         Output("loading-message", "style", allow_duplicate=True),
+         Output("loading-state", "data", allow_duplicate=True),
+         Output("loading-interval", "disabled", allow_duplicate=True),
+         Output("method-status", "children", allow_duplicate=True)],
+        [Input("loading-interval", "n_intervals")],
+        [State("loading-state", "data")],
+        prevent_initial_call=True
+    )
+    def poll_upload(n_intervals, loading_state):
+        if not loading_state or "job" not in loading_state:
+            return (*[dash.no_update] * 13, [], {"display": "none"}, dash.no_update, True, dash.no_update)
+
+        # A poll of an upload superseded by a newer one of the session must not touch its state
+        session, job_id = loading_state["session"], loading_state["job"]
+        if not upload_sessions.is_current(session, job_id):
+            upload_jobs.forget(job_id)
+            raise PreventUpdate
+
+        status = upload_jobs.status(job_id)
+        if status in ("pending", "running"):
+            progress = upload_progress.get(loading_state["progress"])
+            snapshot = progress.snapshot() if progress is not None else None
+            return (*[dash.no_update] * 13, upload_progress_message(snapshot, loading_state["filename"]),
+                    dash.no_update, dash.no_update, dash.no_update, dash.no_update)
+
+        if not upload_sessions.finish(session, job_id):
+            upload_jobs.forget(job_id)  # Superseded while this poll was running
+            raise PreventUpdate
+        try:
+            result = upload_jobs.result(job_id)
+        except Exception as e:
+            result = {"error": f"Error processing file: {e}"}
+        if "children" not in result:
+            # Failed upload: the previous results, if any, are left as they were
+            message = result.get("error", "The upload was cancelled.")
+            return (message, *[dash.no_update] * 12, [], {"display": "none"}, {"session": session}, True, dash.no_update)
+
+        heatmap_fig, bar_fig, line_fig = result["figures"]
+        return (
+            result["children"],  # Table and message
+            heatmap_fig,  # Heatmap figure
+            bar_fig,  # Bar chart figure
+            line_fig,  # Line plot figure
+            {"display": "block"},  # Show heatmap
+            {"display": "block"},  # Show bar chart
+            {"display": "block"},  # Show line plot
+            {"display": "block"},  # Show chatbot
+            [pending_message(result["llm_job"])],  # Interpretation placeholder in chat history
+            html.Div(),  # Hide the upload button by returning an empty Div
+            result["dataset_handle"],  # Handle of the server-side dataset
+            [{"id": result["llm_job"], "kind": "interpretation"}],  # Pending LLM jobs
+            False,  # Start polling for the interpretation
+            [],  # Hide the loading message
+            {"display": "none"},
+            {"session": session},  # No upload in progress
+            True,  # Stop polling the upload job
+            result["method_status"]  # Method and loss ratio used
+        )
+
+    @app.callback(
+        [Output("chat-history", "children", allow_duplicate=True),
+         Output("llm-jobs", "data", allow_duplicate=True)],
+        [Input("llm-poll", "n_intervals")],
+        [State("llm-jobs", "data"),
+         State("chat-history", "children")],
+        prevent_initial_call=True
+    )
+    def poll_llm_jobs(n_intervals, llm_pending, chat_history):
+        if not llm_pending:
+            raise PreventUpdate
+
+        updates = {}
+        finished = []
+        for job in llm_pending:
+            message_id = f"llm-pending-{job['id']}"
+            stream = chat_streams.get(job["stream"]) if job.get("stream") else None
+            if stream is not None:
+                # Streaming chat reply: show the tokens received so far
+                state = stream.snapshot()
+                if state["done"]:
+                    chat_streams.pop(job["stream"])
+                    llm_jobs.forget(job["id"])  # The reply came through the stream
+                    updates[message_id] = stream_message(message_id, state)
+                    finished.append(job)
+                elif state["text"]:
+                    updates[message_id] = stream_message(message_id, state)
+            elif llm_jobs.status(job["id"]) in ("done", "error", "unknown"):
+                updates[message_id] = llm_result_message(job["id"], job["kind"])
+                finished.append(job)
+        if not updates:
+            raise PreventUpdate  # Nothing new yet
+
+        # Only the placeholders are swapped and only the finished jobs removed, so a message
+        # or job added by update_app while this poll was in flight is kept
+        history = dash.Patch()
+        for index, message in enumerate(chat_history or []):
+            message_id = message.get("props", {}).get("id") if isinstance(message, dict) else None
+            if message_id in updates:
+                history[index] = updates[message_id]
+        pending = dash.Patch()
+        for job in finished:
+            pending.remove(job)
+        return history, pending if finished else dash.no_update
+
+    @app.callback(
+        Output("llm-poll", "disabled", allow_duplicate=True),
+        [Input("llm-jobs", "data")],
+        prevent_initial_call=True
+    )
+    def toggle_llm_poll(llm_pending):
+        # Poll exactly while the stored list holds pending jobs, whichever callback changed it
+        return not llm_pending
+
+    @app.callback(
+        Output("llm-poll", "disabled", allow_duplicate=True),
+        [Input("cancel-button", "n_clicks")],
+        [State("llm-jobs", "data")],
+        prevent_initial_call=True
+    )
+    def cancel_generation(n_clicks, llm_pending):
+        if not n_clicks or not llm_pending:
+            raise PreventUpdate
+        for job in llm_pending:
+            if job.get("stream"):
+                chat_streams.cancel(job["stream"])
+        return False  # Keep polling so the cancelled replies are rendered
+
+    @app.callback(
+        [Output("line-projection", "figure", allow_duplicate=True),
+         Output("method-status", "children", allow_duplicate=True)],
+        [Input("model-dropdown", "value"),
+         Input("expected-loss-ratio", "value")],
+        [State("stored-data", "data")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("switch_reserving_method")
+    def switch_reserving_method(method, expected_loss_ratio, dataset_handle):
+        # Only the final projection step is redone; triangle and factors come from the dataset store
+        dataset = dataset_store.get_many(dataset_handle, ("triangle", "factors", "premiums"))
+        if not dataset:
+            raise PreventUpdate  # Nothing uploaded yet
+
+        triangle = dataset["triangle"]
+        triangle_proj, method, loss_ratio, status = project_dataset(
+            triangle, dataset["factors"], method, dataset["premiums"], expected_loss_ratio
+        )
+        dataset_store.update(dataset_handle, triangle_proj=triangle_proj, method=method, loss_ratio=loss_ratio)
+        return projection_patch(triangle, triangle_proj, method), status
+
+    @app.callback(
+        [Output("heatmap-triangle", "figure", allow_duplicate=True),
+         Output("bar-factors", "figure", allow_duplicate=True),
+         Output("line-projection", "figure", allow_duplicate=True),
+         Output("append-status", "children"),
+         Output("method-status", "children", allow_duplicate=True)],
+        [Input("append-data", "contents")],
+        [State("append-data", "filename"),
+         State("stored-data", "data"),
+         State("model-dropdown", "value"),
+         State("expected-loss-ratio", "value")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("append_claims")
+    def append_claims(contents, filename, dataset_handle, method, expected_loss_ratio):
+        # New settlement rows are added to the stored triangle instead of re-uploading the history
+        dataset = dataset_store.get_many(dataset_handle, ("df", "incremental", "premium_totals", "cube"))
+        if not dataset or contents is None:
+            raise PreventUpdate
+        if dataset.get("df") is None:  # Reopened closing: only the results were saved
+            return dash.no_update, dash.no_update, dash.no_update, "Upload the claims file to append settlements to it.", dash.no_update
+
+        with stage_metrics.stage("append_claims", "parse"):
+            new_claims = utils.parse_contents(contents, filename)
+        if new_claims is None or new_claims.empty:
+            return dash.no_update, dash.no_update, dash.no_update, f"Could not read {filename}.", dash.no_update
+
+        # The incremental triangle and the premium totals hold everything appended so far
+        incremental, premium_totals = dataset["incremental"], dataset["premium_totals"]
+        if incremental is None:
+            incremental = reserving.IncrementalTriangle.from_claims(dataset["df"])
+            premium_totals = utils.premiums_by_accident_year(dataset["df"])
+        new_premiums = utils.premiums_by_accident_year(new_claims)
+        if new_premiums is not None:
+            premium_totals = new_premiums if premium_totals is None else premium_totals.add(new_premiums, fill_value=0)
+        with stage_metrics.stage("append_claims", "triangle"):
+            updated_years = incremental.add_claims(new_claims)
+            triangle = incremental.triangle()
+        with stage_metrics.stage("append_claims", "factors"):
+            factors = incremental.factors()
+        with stage_metrics.stage("append_claims", "projection"):
+            premiums = utils.align_exposure(premium_totals, triangle)
+            triangle_proj, method, loss_ratio, status = project_dataset(triangle, factors, method, premiums, expected_loss_ratio)
+        with stage_metrics.stage("append_claims", "cube"):
+            cube = dataset["cube"].merge(cube_module.ClaimsCube.from_claims(new_claims))
+        fingerprint = triangle_fingerprint(triangle, factors)
+        dataset_store.update(
+            dataset_handle, incremental=incremental, premium_totals=premium_totals, triangle=triangle, factors=factors,
+            cube=cube, triangle_proj=triangle_proj, premiums=premiums, method=method, loss_ratio=loss_ratio,
+            scenario_engine=None, data_hash=None, fingerprint=fingerprint  # No longer the content of a single file
+        )
+        with stage_metrics.stage("append_claims", "figures"):
+            figures = build_triangle_figures(triangle, factors, triangle_proj, method, fingerprint)
+        return (
+            *figures,
+            f"{len(new_claims)} rows from {filename} added ({len(updated_years)} accident years updated).",
+            status
+        )
+
+    @app.callback(
+        [Output("closing-version", "options"),
+         Output("closing-compare", "options")],
+        [Input("closing-version", "id")]  # Fires when the home page is rendered
+    )
+    def list_closings(_):
+        options = closing_options(closing_store.list_closings())
+        return options, options
+
+    @app.callback(
+        [Output("closing-status", "children"),
+         Output("closing-version", "options", allow_duplicate=True),
+         Output("closing-compare", "options", allow_duplicate=True)],
+        [Input("save-closing", "n_clicks")],
+        [State("closing-name", "value"),
+         State("stored-data", "data")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("save_closing")
+    def save_closing(n_clicks, name, dataset_handle):
+        # The run is saved as computed: reopening it later reads these results back as they are
+        dataset = dataset_store.get_many(dataset_handle, (
+            "triangle", "factors", "triangle_proj", "method", "premiums", "loss_ratio", "filename", "data_hash", "fingerprint"
+        ))
+        if not dataset:
+            return "Upload a claims file first.", dash.no_update, dash.no_update
+        name = (name or "").strip()
+        if not name:
+            return "Give the closing a name.", dash.no_update, dash.no_update
+        try:
+            closing_store.save(
+                name, dataset["triangle"], dataset["factors"], dataset["triangle_proj"], dataset["method"],
+                premiums=dataset.get("premiums"), loss_ratio=dataset.get("loss_ratio"), filename=dataset.get("filename"),
+                data_hash=dataset.get("data_hash"), fingerprint=dataset.get("fingerprint"),
+            )
+        except ValueError as e:
+            return str(e), dash.no_update, dash.no_update
+        options = closing_options(closing_store.list_closings())
+        return f"Closing {name} saved.", options, options
+
+    @app.callback(
+        [Output("heatmap-triangle", "figure", allow_duplicate=True),
+         Output("bar-factors", "figure", allow_duplicate=True),
+         Output("line-projection", "figure", allow_duplicate=True),
+         Output("heatmap-triangle", "style", allow_duplicate=True),
+         Output("bar-factors", "style", allow_duplicate=True),
+         Output("line-projection", "style", allow_duplicate=True),
+         Output("stored-data", "data", allow_duplicate=True),
+         Output("closing-status", "children", allow_duplicate=True),
+         Output("method-status", "children", allow_duplicate=True)],
+        [Input("closing-version", "value")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("open_closing")
+    def open_closing(closing_id):
+        # A saved closing replaces the session dataset without re-parsing or recomputing anything
+        if closing_id is None:
+            raise PreventUpdate
+        with stage_metrics.stage("open_closing", "load"):
+            start = time.perf_counter()
+            closing = closing_store.load(closing_id)
+            elapsed = time.perf_counter() - start
+        if closing is None:
+            return (*[dash.no_update] * 7, "This closing no longer exists.", dash.no_update)
+        dataset_handle = dataset_store.register(**closing)
+        with stage_metrics.stage("open_closing", "figures"):
+            figures = build_triangle_figures(
+                closing["triangle"], closing["factors"], closing["triangle_proj"], closing["method"], closing["fingerprint"]
+            )
+        return (
+            *figures,
+            {"display": "block"},
+            {"display": "block"},
+            {"display": "block"},
+            dataset_handle,
+            f"Closing {closing['closing']} ({closing['filename']}, {utils.RESERVING_METHODS.get(closing['method'], closing['method'])}) "
+            f"loaded in {elapsed * 1000:.0f} ms.",
+            method_status(closing["method"], closing["loss_ratio"]),
+        )
+
+    @app.callback(
+        Output("closing-diff", "children"),
+        [Input("closing-compare", "value"),
+         Input("closing-version", "value")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("compare_closings")
+    def compare_closings(other_id, base_id):
+        if other_id is None:
+            return None
+        if base_id is None:
+            return html.P("Open a closing to compare it with another one.", style={"color": "#333333"})
+        base, other = closing_store.info(base_id), closing_store.info(other_id)
+        if base is None or other is None:
+            return html.P("This closing no longer exists.", style={"color": "#333333"})
+        return build_closing_diff_table(closing_store.diff(base_id, other_id), base["name"], other["name"])
+
+    @app.callback(
+        [Output("reserve-distribution", "figure"),
+         Output("reserve-percentiles", "figure"),
+         Output("reserve-distribution", "style"),
+         Output("reserve-percentiles", "style"),
+         Output("bootstrap-summary", "children")],
+        [Input("bootstrap-button", "n_clicks")],
+        [State("bootstrap-simulations", "value"),
+         State("stored-data", "data")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("run_bootstrap")
+    def run_bootstrap(n_clicks, n_sims, dataset_handle):
+        triangle = dataset_store.get(dataset_handle, "triangle")
+        if triangle is None:
+            return {}, {}, {"display": "none"}, {"display": "none"}, "Upload a claims file first."
+
+        try:
+            with stage_metrics.stage("run_bootstrap", "simulation"):
+                simulated = stochastic.bootstrap_odp(triangle, n_sims=int(n_sims or 10000), seed=0, workers=BOOTSTRAP_WORKERS)
+        except ValueError as e:
+            return {}, {}, {"display": "none"}, {"display": "none"}, f"Bootstrap not possible: {e}"
+        summary = stochastic.reserve_risk_summary(simulated)
+        dataset_store.update(dataset_handle, simulated_reserves=simulated)
+
+        return (
+            build_reserve_distribution_figure(summary),
+            build_reserve_percentiles_figure(summary),
+            {"display": "block"},
+            {"display": "block"},
+            html.P(
+                f"Mean reserve {summary['mean']:,.0f} \u00b7 std {summary['std']:,.0f} \u00b7 "
+                f"VaR {summary['level']}% {summary['var']:,.0f} \u00b7 TVaR {summary['level']}% {summary['tvar']:,.0f}",
+                style={"color": "#333333"}
+            ),
+        )
+
+    @app.callback(
+        [Output("scenario-line-plot", "figure"),
+         Output("scenario-summary-table", "children"),
+         Output("scenario-sensitivity-surface", "figure")],
+        [Input("inflation-rate-2024", "value"),
+         Input("inflation-rate-2025", "value"),
+         Input("dev-factor-1-2", "value"),
+         Input("dev-factor-2-3", "value")],
+        [State("stored-data", "data")]
+    )
+    @stage_metrics.instrument("update_scenarios")
+    def update_scenarios(inflation_2024, inflation_2025, factor_1_2, factor_2_3, dataset_handle):
+        dataset = dataset_store.get_many(dataset_handle, ("triangle", "factors", "scenario_engine"))
+        if not dataset:
+            return {}, "Upload a claims file on the home page to run scenarios.", {}
+
+        # The engine holds the precomputed base projection; slider changes only re-evaluate
+        engine = dataset.get("scenario_engine")
+        if engine is None:
+            engine = scenarios.ScenarioEngine(dataset["triangle"], dataset["factors"], override_periods=(1, 2), inflation_years=(2024, 2025))
+            dataset_store.update(dataset_handle, scenario_engine=engine)
+
+        inflation = [inflation_2024 or 0, inflation_2025 or 0]
+        if dash.ctx.triggered_id in ("dev-factor-1-2", "dev-factor-2-3"):
+            # The sensitivity surface only depends on inflation: re-evaluate the selected
+            # scenario and patch its line instead of resending the figures
+            results = engine.evaluate([[0, 0], inflation], [[np.nan, np.nan], [factor_1_2, factor_2_3]])
+            patch = dash.Patch()
+            patch["data"][1]["y"] = results["ultimates"][1].tolist()
+            return patch, build_scenario_table(results), dash.no_update
+
+        # Base, selected scenario and the factor grid, evaluated in one batched pass
+        grid = [(f12, f23) for f12 in SCENARIO_FACTOR_GRID for f23 in SCENARIO_FACTOR_GRID]
+        inflation_rates = [[0, 0], inflation] + [inflation] * len(grid)
+        factor_overrides = [[np.nan, np.nan], [factor_1_2, factor_2_3]] + grid
+        results = engine.evaluate(inflation_rates, factor_overrides)
+        return build_scenario_figures(engine, results, len(SCENARIO_FACTOR_GRID))
+
+    @app.callback(
+        [Output("risk-factor-product", "figure"),
+         Output("risk-factor-sub-branch", "figure"),
+         Output("risk-factor-product", "style"),
+         Output("risk-factor-sub-branch", "style"),
+         Output("reserve-summary", "children"),
+         Output("reserve-summary", "style")],
+        [Input("stored-data", "data")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("update_segment_risk")
+    def update_segment_risk(dataset_handle):
+        # Per-segment triangles are sliced from the cube, not regrouped from the raw claims
+        cube = dataset_store.get(dataset_handle, "cube")
+        if cube is None:
+            return {}, {}, {"display": "none"}, {"display": "none"}, None, {"display": "none"}
+        with stage_metrics.stage("update_segment_risk", "segment_reserves"):
+            # Segments, products and sub-branches in one run over the segment worker pool
+            views = cube_module.reserve_segment_views(cube, workers=SEGMENT_WORKERS)
+        return (
+            build_segment_reserve_figure(views["product"], "Product"),
+            build_segment_reserve_figure(views["sub_branch"], "Sub-Branch"),
+            {"display": "block"},
+            {"display": "block"},
+            build_reserve_summary_table(views["segments"]),
+            {"display": "block"},
+        )
+
+    @app.callback(
+        [Output("claims-by-product-plot", "figure"),
+         Output("claims-by-sub-branch-plot", "figure")],
+        [Input("claims-by-product-plot", "id")],  # Fires when the scenario page is rendered
+        [State("stored-data", "data")]
+    )
+    @stage_metrics.instrument("update_segment_claims")
+    def update_segment_claims(_, dataset_handle):
+        cube = dataset_store.get(dataset_handle, "cube")
+        if cube is None:
+            return {}, {}
+        return (
+            build_segment_claims_figure(cube.totals("product", by_accident_year=True), "Product"),
+            build_segment_claims_figure(cube.totals("sub_branch", by_accident_year=True), "Sub-Branch"),
+        )
+
+    @app.callback(
+        [Output("data-preview", "data"),
+         Output("data-preview", "page_count")],
+        [Input("data-preview", "page_current"),
+         Input("data-preview", "page_size"),
+         Input("data-preview", "sort_by"),
+         Input("data-preview", "filter_query")],
+        [State("stored-data", "data")],
+        prevent_initial_call=True
+    )
+    @stage_metrics.instrument("update_preview_page")
+    def update_preview_page(page_current, page_size, sort_by, filter_query, dataset_handle):
+        # Only the requested page is sent to the browser, never the full claims file
+        df = dataset_store.get(dataset_handle, "df")
+        if df is None:
+            raise PreventUpdate
+        preview = preview_module.preview_cache.get(dataset_handle, df)
+        return preview.page(page_current, page_size or preview_module.PREVIEW_PAGE_SIZE, sort_by, filter_query)
+
+    @app.callback(
+        [Output("diagnostics-collapse", "is_open"),
+         Output("diagnostics-interval", "disabled")],
+        [Input("diagnostics-toggle", "n_clicks")],
+        [State("diagnostics-collapse", "is_open")],
+        prevent_initial_call=True
+    )
+    def toggle_diagnostics(n_clicks, is_open):
+        # The panel refreshes itself only while it is open
+        return not is_open, is_open
+
+    @app.callback(
+        Output("diagnostics-panel", "children"),
+        [Input("diagnostics-collapse", "is_open"),
+         Input("diagnostics-interval", "n_intervals")],
+        prevent_initial_call=True
+    )
+    def update_diagnostics(is_open, n_intervals):
+        if not is_open:
+            raise PreventUpdate
+        return build_diagnostics_table(stage_metrics.summary())
+
     @app.callback(
         Output('page-content', 'children'),
         [Input('url', 'pathname')]
     )
     def display_page(pathname):
+        # Pages are built on their first visit, then reused
         if pathname == '/about':
-            return about_layout
+            return about_layout()
         elif pathname == '/scenario-analysis':
-            return scenario_analysis_layout
+            return scenario_analysis_layout()
         elif pathname == '/chatbot':
-            return chatbot_layout
+            return chatbot_layout()
         else:
-            return home_layout
+            return home_layout()
 
     @app.callback(
         Output("sidebar", "is_open"),
@@ -257,4 +1241,7 @@ def register_callbacks(app, model):
     def toggle_sidebar(n_clicks, is_open):
         if n_clicks:
             return not is_open
-        return is_open
\ No newline at end of file
+        return is_open
+
+    # The upload job, for callers timing uploads outside of a request (see benchmark.py)
+    return process_upload
@@ -0,0 +1,196 @@
+import os
+import shutil
+import threading
+import time
+
+from lazy import lazy_import
+from shared import SharedState
+
+pd = lazy_import("pandas")
+try:
+    pa = lazy_import("pyarrow")
+except ImportError:  # Triangles are then saved as pickles instead of Parquet files
+    pa = None
+
+# Directory of the saved closings: an SQLite index plus one folder of Parquet files per closing
+CLOSINGS_DIR = os.environ.get(
+    "MATHURANCE_CLOSINGS", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "closings")
+)
+
+
+def _write_frame(df, path):
+    if pa is not None:
+        # Parquet needs string column names; development periods are restored by _read_frame
+        df.rename(columns=str).to_parquet(f"{path}.parquet")
+    else:
+        df.to_pickle(f"{path}.pkl")
+
+
+def _read_frame(path):
+    if os.path.exists(f"{path}.pkl"):
+        return pd.read_pickle(f"{path}.pkl")
+    df = pd.read_parquet(f"{path}.parquet")
+    df.columns = pd.Index(pd.to_numeric(df.columns), name="Development Period")
+    return df
+
+
+class ClosingStore:
+    """
+    Named snapshots ("closings") of reserving runs, kept across sessions.
+    The SQLite index holds one row per closing (method, data hash, totals) and its factors
+    and ultimates per accident year, so listing or diffing closings are indexed reads; the
+    triangle and its projection are Parquet files read back as they were saved, without
+    re-parsing the claims or recomputing anything.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS closings (
+            id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, created REAL, filename TEXT, data_hash TEXT,
+            fingerprint TEXT, method TEXT, loss_ratio REAL, paid REAL, ultimate REAL, reserve REAL
+        );
+        CREATE TABLE IF NOT EXISTS closing_factors (
+            closing_id INTEGER, period, factor REAL, PRIMARY KEY (closing_id, period)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS closing_ultimates (
+            closing_id INTEGER, accident_year, premium REAL, paid REAL, ultimate REAL, reserve REAL,
+            PRIMARY KEY (closing_id, accident_year)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, directory=CLOSINGS_DIR):
+        self.directory = directory
+        self._state = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        # The directory and the SQLite index are only created on first use, not on import
+        with self._lock:
+            if self._state is None:
+                state = SharedState(os.path.join(self.directory, "closings.sqlite"))
+                state.ensure_schema(self.SCHEMA)
+                self._state = state
+            return self._state
+
+    def _folder(self, closing_id):
+        return os.path.join(self.directory, str(closing_id))
+
+    def save(self, name, triangle, factors, triangle_proj, method, premiums=None, loss_ratio=None,
+             filename=None, data_hash=None, fingerprint=None):
+        """
+        Save a run under name and return the closing id. Raises ValueError if the name is taken.
+        """
+        from utils import reserves_by_accident_year
+
+        reserves = reserves_by_accident_year(triangle, triangle_proj)
+        reserves["Premium"] = premiums if premiums is not None else float("nan")
+        # Accident years are stored as plain Python values (NumPy integers would be blobs)
+        years = reserves["Accident Year"].tolist()
+        with self.state.transaction() as conn:
+            if conn.execute("SELECT 1 FROM closings WHERE name = ?", (name,)).fetchone():
+                raise ValueError(f"A closing named {name!r} already exists")
+            closing_id = conn.execute(
+                "INSERT INTO closings (name, created, filename, data_hash, fingerprint, method, loss_ratio, paid, ultimate, reserve) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, time.time(), filename, data_hash, fingerprint, method,
+                 None if loss_ratio is None else float(loss_ratio),
+                 float(reserves["Paid"].sum()), float(reserves["Ultimate"].sum()), float(reserves["Reserve"].sum())),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO closing_factors VALUES (?, ?, ?)",
+                [(closing_id, int(period), float(factor)) for period, factor in factors.items()],
+            )
+            conn.executemany(
+                "INSERT INTO closing_ultimates VALUES (?, ?, ?, ?, ?, ?)",
+                [(closing_id, year, *map(float, values)) for year, values in
+                 zip(years, reserves[["Premium", "Paid", "Ultimate", "Reserve"]].to_numpy())],
+            )
+            # Written inside the transaction: a failed write leaves no index row behind
+            folder = self._folder(closing_id)
+            shutil.rmtree(folder, ignore_errors=True)
+            os.makedirs(folder)
+            _write_frame(triangle, os.path.join(folder, "triangle"))
+            _write_frame(triangle_proj, os.path.join(folder, "triangle_proj"))
+        return closing_id
+
+    def list_closings(self):
+        """
+        Saved closings, most recent first (id, name, created, filename, method, reserve).
+        """
+        rows = self.state.execute(
+            "SELECT id, name, created, filename, method, reserve FROM closings ORDER BY created DESC"
+        ).fetchall()
+        return [dict(zip(("id", "name", "created", "filename", "method", "reserve"), row)) for row in rows]
+
+    def info(self, closing_id):
+        row = self.state.execute(
+            "SELECT id, name, created, filename, data_hash, fingerprint, method, loss_ratio, paid, ultimate, reserve "
+            "FROM closings WHERE id = ?", (closing_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "name", "created", "filename", "data_hash", "fingerprint", "method", "loss_ratio",
+                         "paid", "ultimate", "reserve"), row))
+
+    def ultimates(self, closing_id):
+        """
+        Premium, paid, ultimate and reserve per accident year of a closing.
+        """
+        rows = self.state.execute(
+            "SELECT accident_year, premium, paid, ultimate, reserve FROM closing_ultimates WHERE closing_id = ? "
+            "ORDER BY accident_year", (closing_id,)
+        ).fetchall()
+        # SQLite stores NaN as NULL: read back as NaN
+        return pd.DataFrame(rows, columns=["Accident Year", "Premium", "Paid", "Ultimate", "Reserve"]).astype(
+            {"Premium": float, "Paid": float, "Ultimate": float, "Reserve": float}
+        )
+
+    def load(self, closing_id):
+        """
+        The artifacts of a closing as the upload stores them (triangle, factors, triangle_proj,
+        premiums, method, ...), or None for an unknown id.
+        """
+        info = self.info(closing_id)
+        if info is None:
+            return None
+        factors = {
+            period: float("nan") if factor is None else factor
+            for period, factor in self.state.execute(
+                "SELECT period, factor FROM closing_factors WHERE closing_id = ? ORDER BY period", (closing_id,)
+            )
+        }
+        folder = self._folder(closing_id)
+        triangle = _read_frame(os.path.join(folder, "triangle"))
+        return {
+            "triangle": triangle,
+            "factors": factors,
+            "triangle_proj": _read_frame(os.path.join(folder, "triangle_proj")),
+            "premiums": self.ultimates(closing_id)["Premium"].to_numpy(),
+            "method": info["method"],
+            "loss_ratio": info["loss_ratio"],
+            "filename": info["filename"],
+            "data_hash": info["data_hash"],
+            "fingerprint": info["fingerprint"],
+            "closing": info["name"],
+        }
+
+    def diff(self, base_id, other_id):
+        """
+        Paid, ultimate and reserve per accident year of two closings and their changes
+        (other minus base); accident years present in only one closing count as 0 in the other.
+        """
+        base = self.ultimates(base_id).drop(columns="Premium").set_index("Accident Year")
+        other = self.ultimates(other_id).drop(columns="Premium").set_index("Accident Year")
+        diff = base.join(other, how="outer", lsuffix=" (base)", rsuffix=" (compared)").fillna(0.0)
+        for column in ("Paid", "Ultimate", "Reserve"):
+            diff[f"{column} change"] = diff[f"{column} (compared)"] - diff[f"{column} (base)"]
+        return diff.reset_index()
+
+    def delete(self, closing_id):
+        with self.state.transaction() as conn:
+            for table, key in (("closings", "id"), ("closing_factors", "closing_id"), ("closing_ultimates", "closing_id")):
+                conn.execute(f"DELETE FROM {table} WHERE {key} = ?", (closing_id,))
+        shutil.rmtree(self._folder(closing_id), ignore_errors=True)
+
+
+# Closings saved from the dashboard
+closing_store = ClosingStore()
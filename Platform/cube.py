@@ -0,0 +1,250 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from reserving import undefined_factor_periods
+from utils import compute_chain_ladder_factors, project_triangle, summarize_reserves
+
+# Segment dimensions of the claims cube, as named in the claims extracts
+PRODUCT_COLUMN = 'Code Produit'
+SUB_BRANCH_COLUMN = 'Sous-Branche'
+MISSING_SEGMENT = '(missing)'
+
+
+class ClaimsCube:
+    """
+    Pre-aggregated claims: settlement sums and row counts on a dense
+    (product, sub-branch, accident year, development period) grid.
+    Built once at ingestion with categorical codes; every per-segment triangle or
+    segment total is then sliced from the cube in O(cells) without touching the raw rows.
+    """
+    def __init__(self, products, sub_branches, accident_years, periods, sums, counts):
+        self.products = pd.Index(products, name=PRODUCT_COLUMN)
+        self.sub_branches = pd.Index(sub_branches, name=SUB_BRANCH_COLUMN)
+        self.accident_years = pd.Index(accident_years, name='Accident Year')
+        self.periods = pd.Index(periods, name='Development Period')
+        self.sums = sums
+        self.counts = counts
+
+    @classmethod
+    def from_claims(cls, df):
+        """
+        Build the cube from cleaned claims rows (Accident Year, Development Period, Règlement
+        and, when present, the product and sub-branch columns).
+        """
+        df = df[df['Development Period'] >= 0]
+        product = cls._categorical(df, PRODUCT_COLUMN)
+        sub_branch = cls._categorical(df, SUB_BRANCH_COLUMN)
+        years = df['Accident Year'].to_numpy().astype(np.int64)
+        devs = df['Development Period'].to_numpy().astype(np.int64)
+
+        accident_years = np.arange(years.min(), years.max() + 1) if len(years) else np.arange(0)
+        periods = np.arange(devs.min(), devs.max() + 1) if len(devs) else np.arange(0)
+        shape = (len(product.categories), len(sub_branch.categories), len(accident_years), len(periods))
+
+        # One bincount over the flattened cell index of every row
+        if len(years):
+            flat = np.ravel_multi_index(
+                (product.codes, sub_branch.codes, years - accident_years[0], devs - periods[0]), shape
+            )
+        else:
+            flat = np.zeros(0, dtype=np.int64)
+        size = int(np.prod(shape))
+        amounts = np.nan_to_num(pd.to_numeric(df['Règlement'], errors='coerce').to_numpy(dtype=np.float64))
+        sums = np.bincount(flat, weights=amounts, minlength=size).reshape(shape)
+        counts = np.bincount(flat, minlength=size).reshape(shape)
+        return cls(product.categories, sub_branch.categories, accident_years, periods, sums, counts)
+
+    @staticmethod
+    def _categorical(df, column):
+        if column not in df.columns:
+            return pd.Categorical([MISSING_SEGMENT] * len(df))
+        return pd.Categorical(df[column].astype('string').str.strip().fillna(MISSING_SEGMENT))
+
+    def merge(self, other):
+        """
+        Cube holding the claims of both cubes (e.g. the history plus newly appended rows).
+        """
+        products = self.products.union(other.products)
+        sub_branches = self.sub_branches.union(other.sub_branches)
+        accident_years = np.arange(min(self.accident_years.min(), other.accident_years.min()),
+                                   max(self.accident_years.max(), other.accident_years.max()) + 1)
+        periods = np.arange(min(self.periods.min(), other.periods.min()),
+                            max(self.periods.max(), other.periods.max()) + 1)
+        shape = (len(products), len(sub_branches), len(accident_years), len(periods))
+        sums = np.zeros(shape)
+        counts = np.zeros(shape, dtype=np.int64)
+        for cube in (self, other):
+            where = np.ix_(
+                products.get_indexer(cube.products),
+                sub_branches.get_indexer(cube.sub_branches),
+                cube.accident_years - accident_years[0],
+                cube.periods - periods[0],
+            )
+            sums[where] += cube.sums
+            counts[where] += cube.counts
+        return ClaimsCube(products, sub_branches, accident_years, periods, sums, counts)
+
+    def slice(self, product=None, sub_branch=None):
+        """
+        (accident year x development period) sums and counts for one product and/or
+        sub-branch (None means all of them).
+        """
+        p = slice(None) if product is None else [self.products.get_loc(product)]
+        b = slice(None) if sub_branch is None else [self.sub_branches.get_loc(sub_branch)]
+        return self.sums[p][:, b].sum(axis=(0, 1)), self.counts[p][:, b].sum(axis=(0, 1))
+
+    def triangle(self, product=None, sub_branch=None):
+        """
+        Cumulative triangle of a segment, in the same shape as utils.create_triangle
+        (only accident years and periods with claims, NaN where no claim row exists).
+        """
+        sums, counts = self.slice(product, sub_branch)
+        observed = counts > 0
+        cumulative = np.where(observed, np.cumsum(sums, axis=1), np.nan)
+        rows = observed.any(axis=1)
+        cols = observed.any(axis=0)
+        return pd.DataFrame(
+            cumulative[rows][:, cols],
+            index=self.accident_years[rows],
+            columns=self.periods[cols],
+        )
+
+    def totals(self, dimension, by_accident_year=False):
+        """
+        Total settlements per product ('product') or sub-branch ('sub_branch'),
+        optionally split by accident year.
+        """
+        if dimension == 'product':
+            labels, axes = self.products, (1, 3)
+        elif dimension == 'sub_branch':
+            labels, axes = self.sub_branches, (0, 3)
+        else:
+            raise ValueError(f"Unknown cube dimension: {dimension}")
+        sums = self.sums.sum(axis=axes)
+        if by_accident_year:
+            return pd.DataFrame(sums, index=labels, columns=self.accident_years)
+        return pd.Series(sums.sum(axis=1), index=labels)
+
+
+def segment_reserves(cube, dimension, workers=1):
+    """
+    Chain-ladder run per product ('product') or sub-branch ('sub_branch') on triangles sliced
+    from the cube. Returns paid to date, projected ultimate and reserve per segment, and the
+    number of its factors that could not be estimated (developed with a factor of 1).
+    """
+    if dimension not in ('product', 'sub_branch'):
+        raise ValueError(f"Unknown cube dimension: {dimension}")
+    return reserve_segment_views(cube, workers, dimensions=(dimension,))[dimension]
+
+
+def _segment_row(cube, product, sub_branch):
+    # Chain ladder on one segment triangle (None: every product or sub-branch); None when it has no claims
+    triangle = cube.triangle(product=product, sub_branch=sub_branch)
+    if triangle.empty:
+        return None
+    factors = compute_chain_ladder_factors(triangle)
+    triangle_proj = project_triangle(triangle, factors)
+    return {PRODUCT_COLUMN: product, SUB_BRANCH_COLUMN: sub_branch, **summarize_reserves(triangle, triangle_proj),
+            'Undefined Factors': len(undefined_factor_periods(factors))}
+
+
+def _reserve_segment_batch(spec, segments):
+    # Worker side: rebuild the cube on top of the shared sums/counts (no copy) and run the segments
+    sums_block = shared_memory.SharedMemory(name=spec['sums'])
+    counts_block = shared_memory.SharedMemory(name=spec['counts'])
+    sums = np.ndarray(spec['shape'], dtype=np.float64, buffer=sums_block.buf)
+    counts = np.ndarray(spec['shape'], dtype=np.int64, buffer=counts_block.buf)
+    cube = ClaimsCube(spec['products'], spec['sub_branches'], spec['accident_years'], spec['periods'], sums, counts)
+    rows = [_segment_row(cube, product, sub_branch) for product, sub_branch in segments]
+    # The views must be released before the blocks can be closed
+    del cube, sums, counts
+    sums_block.close()
+    counts_block.close()
+    return rows
+
+
+def _share_array(array, dtype):
+    block = shared_memory.SharedMemory(create=True, size=max(array.size * np.dtype(dtype).itemsize, 1))
+    np.ndarray(array.shape, dtype=dtype, buffer=block.buf)[...] = array
+    return block
+
+
+def _run_segments(cube, segments, workers):
+    # Segment rows in the order of segments, over a process pool when workers > 1
+    if workers <= 1 or len(segments) <= 1:
+        return [_segment_row(cube, product, sub_branch) for product, sub_branch in segments]
+    sums_block = _share_array(cube.sums, np.float64)
+    counts_block = _share_array(cube.counts, np.int64)
+    spec = {
+        'sums': sums_block.name, 'counts': counts_block.name, 'shape': cube.sums.shape,
+        'products': list(cube.products), 'sub_branches': list(cube.sub_branches),
+        'accident_years': np.asarray(cube.accident_years), 'periods': np.asarray(cube.periods),
+    }
+    # One task per worker (round robin) so every process attaches to the blocks only once
+    n_batches = min(workers, len(segments))
+    batches = [segments[i::n_batches] for i in range(n_batches)]
+    try:
+        with ProcessPoolExecutor(max_workers=n_batches) as pool:
+            results = list(pool.map(_reserve_segment_batch, [spec] * n_batches, batches))
+    finally:
+        for block in (sums_block, counts_block):
+            block.close()
+            block.unlink()
+    rows = [None] * len(segments)
+    for i, batch in enumerate(results):
+        rows[i::n_batches] = batch
+    return rows
+
+
+def reserve_segment_views(cube, workers=1, dimensions=('segments', 'product', 'sub_branch')):
+    """
+    Chain-ladder reserves of the requested views in a single run over the process pool:
+    'segments' is the reserve_all_segments table, 'product' and 'sub_branch' the tables of
+    segment_reserves. Returns a dict of DataFrames keyed by view.
+    """
+    counts = cube.counts.sum(axis=(2, 3))
+    segments = {
+        'segments': [(cube.products[p], cube.sub_branches[b]) for p, b in zip(*np.nonzero(counts))],
+        'product': [(product, None) for product, n in zip(cube.products, counts.sum(axis=1)) if n],
+        'sub_branch': [(None, sub_branch) for sub_branch, n in zip(cube.sub_branches, counts.sum(axis=0)) if n],
+    }
+    rows = _run_segments(cube, [segment for view in dimensions for segment in segments[view]], workers)
+
+    views = {}
+    for view in dimensions:
+        view_rows = [row for row in rows[:len(segments[view])] if row is not None]
+        rows = rows[len(segments[view]):]
+        if view == 'segments':
+            views[view] = _consolidated_table(view_rows)
+        else:
+            label = PRODUCT_COLUMN if view == 'product' else SUB_BRANCH_COLUMN
+            views[view] = pd.DataFrame(
+                [{'Segment': row[label], **{k: row[k] for k in ('Paid', 'Ultimate', 'Reserve', 'Undefined Factors')}}
+                 for row in view_rows],
+                columns=['Segment', 'Paid', 'Ultimate', 'Reserve', 'Undefined Factors'],
+            )
+    return views
+
+
+def _consolidated_table(rows):
+    # Segment rows sorted by product and sub-branch, then the grand total. The total's undefined
+    # factors are left empty: it is a sum of segment runs, not a run on the whole portfolio
+    columns = [PRODUCT_COLUMN, SUB_BRANCH_COLUMN, 'Paid', 'Ultimate', 'Reserve', 'Undefined Factors']
+    table = pd.DataFrame(rows, columns=columns)
+    table = table.sort_values([PRODUCT_COLUMN, SUB_BRANCH_COLUMN], ignore_index=True)
+    total = {PRODUCT_COLUMN: 'Total', SUB_BRANCH_COLUMN: '', **table[['Paid', 'Ultimate', 'Reserve']].sum(),
+             'Undefined Factors': np.nan}
+    return pd.concat([table, pd.DataFrame([total])], ignore_index=True)
+
+
+def reserve_all_segments(cube, workers=1):
+    """
+    Chain-ladder reserves for every (product, sub-branch) segment holding claims, as one
+    consolidated table with a grand total row. With workers > 1 the segments are spread
+    over a process pool: the cube's sums and counts are placed once in shared memory and
+    the workers read their slices from there, so no claims data is pickled per task.
+    """
+    return reserve_segment_views(cube, workers, dimensions=('segments',))['segments']
@@ -0,0 +1,283 @@
+import functools
+import io
+import posixpath
+import re
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from xml.sax.saxutils import unescape
+
+import numpy as np
+import pandas as pd
+
+try:
+    import python_calamine  # noqa: F401  (Rust reader, used through pandas when installed)
+except ImportError:
+    python_calamine = None
+
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Built-in number formats that display dates/times (ECMA-376, 18.8.30)
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | {27, 30, 36, 45, 46, 47, 50, 57}
+
+# Namespace prefix of the worksheet elements (b"x:" for <x:worksheet> from OpenXML SDK writers)
+ROOT_PATTERN = re.compile(rb'<(?:([\w.-]+):)?worksheet[\s>]')
+
+
+@functools.lru_cache(maxsize=None)
+def sheet_patterns(prefix):
+    """
+    Patterns of the worksheet XML for an element prefix. A cell is read as column letters,
+    row number, attributes and cached value (a formula is skipped, its cached value is read
+    like any other value): "ordered" expects r as the first attribute, as Excel writes it,
+    "any_order" finds r, t and s anywhere in the tag (slower).
+    """
+    c, f, v = (b"<" + prefix + name for name in (b"c", b"f", b"v"))
+    rest = (rb'([^>]*?)(?:/>|>\s*(?:' + f + rb'[^>]*(?:/>|>[^<]*</' + prefix + rb'f>)\s*)?'
+            rb'(?:' + v + rb'>([^<]*)</' + prefix + rb'v>)?)')
+    return {
+        "ordered": re.compile(c + rb' r="([A-Z]+)(\d+)"' + rest),
+        "any_order": re.compile(c + rb'\s(?=[^>]*?\br="([A-Z]+)(\d+)")' + rest),
+        # Cells whose tag is not "<c " (another whitespace, no attributes) or that have no reference
+        "other_tag": re.compile(re.escape(c) + rb'[\t\r\n/>]'),
+        "unreferenced": re.compile(re.escape(c) + rb'(?![^>]*?\br=")[\s/>]'),
+        "inline": re.compile(
+            c + rb'\s(?=[^>]*?\br="([A-Z]+\d+)")(?=[^>]*?\bt="inlineStr")[^>]*>\s*<' + prefix + rb'is>(.*?)</' + prefix + rb'is>',
+            re.DOTALL,
+        ),
+        "text": re.compile(rb'<' + prefix + rb't(?:\s[^>]*)?>([^<]*)</' + prefix + rb't>'),
+        "row_end": b"</" + prefix + b"row>",
+    }
+
+
+def _column_index(letters):
+    # Zero-based index of a column reference such as b"A" or b"AB"
+    index = 0
+    for letter in letters:
+        index = index * 26 + letter - 64
+    return index - 1
+
+
+def _has(attrs, text):
+    # Vectorized substring test on an array of cell attributes
+    return np.char.find(attrs, text) >= 0
+
+
+class XlsxReader:
+    """
+    Minimal reader for .xlsx/.xlsm workbooks.
+    Lists the sheets from the workbook part and scans a worksheet's XML with a single regex
+    pass into fixed-width byte arrays (no per-cell Python objects as in openpyxl), then
+    converts each requested column straight to a typed array: shared strings are looked up
+    by index, numbers become float64 (int64 when integral and complete), and numbers with a
+    date format become datetimes.
+    """
+    def __init__(self, data):
+        self.zip = zipfile.ZipFile(io.BytesIO(data))
+        self.sheets = self._sheet_paths()
+        self._shared_strings = None
+        self._date_styles = None
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def _sheet_paths(self):
+        workbook = ET.fromstring(self.zip.read("xl/workbook.xml"))
+        rels = ET.fromstring(self.zip.read("xl/_rels/workbook.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{PACKAGE_REL_NS}Relationship")}
+        paths = {}
+        for sheet in workbook.iter(f"{MAIN_NS}sheet"):
+            target = targets[sheet.get(f"{REL_NS}id")]
+            paths[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+        return paths
+
+    def shared_strings(self):
+        if self._shared_strings is None:
+            strings = []
+            if "xl/sharedStrings.xml" in self.zip.namelist():
+                root = ET.fromstring(self.zip.read("xl/sharedStrings.xml"))
+                # Plain items hold one <t>, rich text items one <t> per run
+                strings = [
+                    "".join(t.text or "" for t in si.findall(f"{MAIN_NS}t") + si.findall(f"{MAIN_NS}r/{MAIN_NS}t"))
+                    for si in root.iter(f"{MAIN_NS}si")
+                ]
+            self._shared_strings = np.array(strings, dtype=object)
+        return self._shared_strings
+
+    def date_styles(self):
+        """
+        Cell style indices whose number format displays a date.
+        """
+        if self._date_styles is None:
+            self._date_styles = []
+            if "xl/styles.xml" in self.zip.namelist():
+                root = ET.fromstring(self.zip.read("xl/styles.xml"))
+                custom_dates = set()
+                for fmt in root.iter(f"{MAIN_NS}numFmt"):
+                    # Date codes use d/m/y/h/s outside of quoted literals and colour/locale brackets
+                    code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', "", fmt.get("formatCode", "")).lower()
+                    if re.search(r"[dmyhs]", code):
+                        custom_dates.add(int(fmt.get("numFmtId")))
+                cell_xfs = root.find(f"{MAIN_NS}cellXfs")
+                if cell_xfs is not None:
+                    for i, xf in enumerate(cell_xfs.findall(f"{MAIN_NS}xf")):
+                        fmt_id = int(xf.get("numFmtId", 0))
+                        if fmt_id in BUILTIN_DATE_FORMATS or fmt_id in custom_dates:
+                            self._date_styles.append(i)
+        return self._date_styles
+
+    def read_sheet(self, sheet_name=None, usecols=None):
+        """
+        Read one sheet (the first one by default) into a DataFrame, using the first row as
+        the header. usecols restricts the result to the given header names (matched after
+        stripping whitespace); the other columns are never converted.
+        """
+        sheet_name = sheet_name or self.sheet_names[0]
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Worksheet {sheet_name!r} not found (sheets: {', '.join(self.sheet_names)})")
+        xml = self.zip.read(self.sheets[sheet_name])
+        cell_pattern, patterns = self._cell_pattern(xml)
+        first_cell = cell_pattern.search(xml)
+        if first_cell is None:
+            raise ValueError("No cells found by the fast reader")
+        inline = {}
+        if b'"inlineStr"' in xml:
+            inline = {
+                ref: b"".join(patterns["text"].findall(text)) for ref, text in patterns["inline"].findall(xml)
+            }
+
+        # The first row with cells is the header; only the wanted columns of the body are scanned
+        header_end = xml.find(patterns["row_end"], first_cell.start())
+        header = {}
+        for letter, row, attrs, value in cell_pattern.findall(xml, first_cell.start(), header_end):
+            header[letter] = self._cell_value(attrs, value, inline.get(letter + row))
+        wanted = None if usecols is None else {str(col).strip() for col in usecols}
+        letters = [
+            letter for letter in sorted(header, key=_column_index)
+            if header[letter] is not None and (wanted is None or str(header[letter]).strip() in wanted)
+        ]
+        if not letters:
+            raise ValueError("No header cell found by the fast reader")
+        pattern = cell_pattern if wanted is None else re.compile(cell_pattern.pattern.replace(b"[A-Z]+", b"|".join(letters), 1))
+        cells = pd.DataFrame.from_records(pattern.findall(xml, header_end), columns=["letter", "row", "attrs", "value"])
+        if cells.empty:
+            raise ValueError("No data rows found by the fast reader")
+
+        # Fixed-width byte arrays: comparisons and number parsing run vectorized in NumPy
+        cell_letters, attrs, values = (cells[field].to_numpy().astype("S") for field in ("letter", "attrs", "value"))
+        rows = cells["row"].to_numpy().astype("S").astype(np.int64)
+        data_rows = np.unique(rows)
+
+        columns = {}
+        for letter in letters:
+            selected = cell_letters == letter
+            column_inline = {
+                i: inline[letter + row] for i, row in enumerate(cells["row"][selected]) if letter + row in inline
+            } if inline else {}
+            columns[header[letter]] = self._column(
+                len(data_rows), np.searchsorted(data_rows, rows[selected]), attrs[selected], values[selected], column_inline
+            )
+        return pd.DataFrame(columns)
+
+    @staticmethod
+    def _cell_pattern(xml):
+        """
+        Cell pattern that reads every cell of the sheet, with the patterns of its prefix.
+        Raises ValueError when some cells cannot be read, so that the caller falls back to
+        pandas instead of silently dropping them.
+        """
+        root = ROOT_PATTERN.search(xml)
+        prefix = root.group(1) + b":" if root is not None and root.group(1) else b""
+        patterns = sheet_patterns(prefix)
+        # Fast path: every cell tag starts with its reference
+        tag = b"<" + prefix + b"c"
+        n_cells = xml.count(tag + b" ")
+        if n_cells and xml.count(tag + b' r="') == n_cells and patterns["other_tag"].search(xml) is None:
+            return patterns["ordered"], patterns
+        if patterns["unreferenced"].search(xml) is not None:
+            raise ValueError("Cells without a reference attribute are not supported by the fast reader")
+        return patterns["any_order"], patterns
+
+    def _cell_value(self, attrs, value, inline=None):
+        # Single-cell conversion, for the header row and the rare non-numeric, non-shared cells
+        if inline is not None:
+            return unescape(inline.decode("utf-8"))
+        if not value:
+            return None
+        if b't="s"' in attrs:
+            return self.shared_strings()[int(value)]
+        if b't="str"' in attrs or b't="e"' in attrs:
+            return unescape(value.decode("utf-8"))
+        if b't="b"' in attrs:
+            return value == b"1"
+        return float(value)
+
+    def _column(self, n_rows, positions, attrs, values, inline):
+        # Conversion of one column's cells into a Series of length n_rows (missing cells: NaN/None)
+        has_value = values != b""
+        typed = _has(attrs, b't="') & ~_has(attrs, b't="n"')
+
+        if not inline and not (typed & has_value).any():
+            # Purely numeric column: one float conversion, dates if the cells carry a date format
+            numbers = np.full(n_rows, np.nan)
+            numbers[positions[has_value]] = values[has_value].astype(np.float64)
+            date_cells = np.zeros(len(attrs), dtype=bool)
+            for style in self.date_styles():
+                date_cells |= _has(attrs, f's="{style}"'.encode())
+            if has_value.any() and date_cells[has_value].all():
+                return pd.Series(pd.to_datetime(numbers, unit="D", origin="1899-12-30"))
+            if np.array_equal(numbers, np.round(numbers)):  # Integral and no missing cell
+                return pd.Series(numbers.astype(np.int64))
+            return pd.Series(numbers)
+
+        out = np.full(n_rows, None, dtype=object)
+        shared = _has(attrs, b't="s"') & has_value
+        out[positions[shared]] = self.shared_strings()[values[shared].astype(np.int64)]
+        numeric = ~typed & has_value
+        out[positions[numeric]] = values[numeric].astype(np.float64)
+        for i in np.flatnonzero(typed & ~shared & has_value):
+            out[positions[i]] = self._cell_value(attrs[i], values[i])
+        for i, text in inline.items():
+            out[positions[i]] = self._cell_value(attrs[i], values[i], text)
+        return pd.Series(out).infer_objects()
+
+
+def excel_sheet_names(data, filename):
+    """
+    Sheet names of an uploaded workbook, without reading any cells.
+    """
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        return XlsxReader(data).sheet_names
+    return pd.ExcelFile(io.BytesIO(data)).sheet_names
+
+
+def read_excel(data, filename, sheet_name=None, usecols=None):
+    """
+    Read one sheet of an uploaded workbook (the first one by default), optionally only some
+    columns, with the fastest reader available: calamine when installed, XlsxReader for
+    .xlsx/.xlsm, pandas/openpyxl otherwise (and as a fallback).
+    Returns the DataFrame and the parse time per sheet in seconds.
+    """
+    start = time.perf_counter()
+    df = None
+    if python_calamine is None and filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            reader = XlsxReader(data)
+            sheet_name = sheet_name or reader.sheet_names[0]
+            df = reader.read_sheet(sheet_name, usecols)
+        except (KeyError, ValueError, zipfile.BadZipFile):
+            df = None  # Sheets the fast reader cannot read are read by pandas below
+    if df is None:
+        wanted = None if usecols is None else {str(col).strip() for col in usecols}
+        df = pd.read_excel(
+            io.BytesIO(data),
+            sheet_name=sheet_name or 0,
+            usecols=None if wanted is None else (lambda col: str(col).strip() in wanted),
+            engine="calamine" if python_calamine is not None else None,
+        )
+    elapsed = time.perf_counter() - start
+    sheet_label = sheet_name or "first sheet"
+    return df, {sheet_label: elapsed}
@@ -0,0 +1,341 @@
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from shared import shared_state
+
+
+class JobQueue:
+    """
+    Local background job queue backed by a thread pool.
+    submit() returns a job id right away; callbacks poll status() / result()
+    (e.g. from a dcc.Interval) instead of blocking the request thread.
+    With a shared state (multi-worker server), finished jobs are also written to the shared
+    database, so a poll served by another worker process still gets the outcome.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT, value BLOB, finished_at REAL);
+    """
+
+    def __init__(self, max_workers=2, name="mathurance-job", state=None, ttl=3600):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.state = state
+        self.ttl = ttl
+        if state is not None:
+            state.ensure_schema(self.SCHEMA)
+
+    def submit(self, fn, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        if self.state is not None:
+            self.state.execute("INSERT INTO jobs VALUES (?, 'running', NULL, NULL)", (job_id,))
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures[job_id] = future
+        if self.state is not None:
+            future.add_done_callback(lambda f: self._publish(job_id, f))
+        return job_id
+
+    def _publish(self, job_id, future):
+        # Outcome of a finished job, for the other worker processes
+        if future.cancelled():
+            status, value = "cancelled", None
+        elif future.exception() is not None:
+            error = future.exception()
+            try:
+                status, value = "error", pickle.dumps(error)
+            except Exception:
+                status, value = "error", pickle.dumps(RuntimeError(str(error)))
+        else:
+            status, value = "done", pickle.dumps(future.result())
+        with self.state.transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - self.ttl,))
+            conn.execute("UPDATE jobs SET status = ?, value = ?, finished_at = ? WHERE job_id = ?",
+                         (status, value, time.time(), job_id))
+
+    def _shared_row(self, job_id, pop=False):
+        if self.state is None:
+            return None
+        row = self.state.execute("SELECT status, value FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is not None and pop:
+            self.state.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return row
+
+    def status(self, job_id):
+        """
+        One of "pending", "running", "done", "error", "cancelled" or "unknown".
+        """
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is None:
+            row = self._shared_row(job_id)  # Submitted by another worker
+            return row[0] if row is not None else "unknown"
+        if future.cancelled():
+            return "cancelled"
+        if not future.done():
+            return "running" if future.running() else "pending"
+        return "error" if future.exception() is not None else "done"
+
+    def result(self, job_id):
+        """
+        Return the result of a finished job and forget it (re-raises the job's exception).
+        """
+        with self._lock:
+            future = self._futures.pop(job_id, None)
+        if future is None:
+            row = self._shared_row(job_id, pop=True)
+            if row is None or row[0] not in ("done", "error"):
+                raise KeyError(job_id)
+            value = pickle.loads(row[1])
+            if row[0] == "error":
+                raise value
+            return value
+        self._shared_row(job_id, pop=True)
+        return future.result()
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that has not started yet. Returns True if it was cancelled.
+        """
+        with self._lock:
+            future = self._futures.pop(job_id, None)
+        self._shared_row(job_id, pop=True)
+        return future is not None and future.cancel()
+
+    def forget(self, job_id):
+        """
+        Drop a job whose outcome is not needed (e.g. a streamed reply already rendered),
+        without reading its result.
+        """
+        with self._lock:
+            self._futures.pop(job_id, None)
+        self._shared_row(job_id, pop=True)
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job whose JobProgress was cancelled, at its next stage.
+    """
+
+
+class JobProgress:
+    """
+    Stage-by-stage progress of a running job.
+    The job calls advance() before each stage; the polling callback reads snapshot().
+    cancel() stops the job at its next stage boundary (a stage in progress runs to its end).
+    """
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.stage = None
+        self.completed = 0
+        self.cancelled = False
+        self.started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def advance(self, stage):
+        """
+        Mark the previous stage as completed and start stage; raises JobCancelled if cancelled.
+        """
+        if self.cancelled:
+            raise JobCancelled(stage)
+        with self._lock:
+            if self.stage is not None:
+                self.completed += 1
+            self.stage = stage
+
+    def cancel(self):
+        self.cancelled = True
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stage": self.stage,
+                "completed": self.completed,
+                "total": len(self.stages),
+                "cancelled": self.cancelled,
+                "elapsed": time.perf_counter() - self.started_at,
+            }
+
+
+class ProgressRegistry:
+    """
+    Progress of the jobs in flight, by id, so callbacks running in any thread can read or cancel them.
+    """
+    def __init__(self):
+        self._progress = {}
+        self._lock = threading.Lock()
+
+    def create(self, stages):
+        progress_id = uuid.uuid4().hex
+        with self._lock:
+            self._progress[progress_id] = JobProgress(stages)
+        return progress_id
+
+    def get(self, progress_id):
+        with self._lock:
+            return self._progress.get(progress_id)
+
+    def pop(self, progress_id):
+        with self._lock:
+            return self._progress.pop(progress_id, None)
+
+    def cancel(self, progress_id):
+        progress = self.get(progress_id)
+        if progress is not None:
+            progress.cancel()
+
+
+class SharedJobProgress(JobProgress):
+    """
+    JobProgress of the multi-worker server: every stage change is published to the shared
+    state and a cancellation requested from any worker is seen at the next stage.
+    """
+    def __init__(self, state, progress_id, stages):
+        self.state = state
+        self.progress_id = progress_id
+        super().__init__(stages)
+
+    def advance(self, stage):
+        row = self.state.execute("SELECT cancelled FROM progress WHERE progress_id = ?", (self.progress_id,)).fetchone()
+        if row and row[0]:
+            self.cancelled = True
+        super().advance(stage)
+        self.state.execute("UPDATE progress SET snapshot = ?, updated_at = ? WHERE progress_id = ?",
+                           (json.dumps(self.snapshot()), time.time(), self.progress_id))
+
+
+class RemoteJobProgress:
+    """
+    Read side of a SharedJobProgress running in another worker process.
+    """
+    def __init__(self, state, progress_id):
+        self.state = state
+        self.progress_id = progress_id
+
+    def snapshot(self):
+        row = self.state.execute("SELECT snapshot, cancelled FROM progress WHERE progress_id = ?", (self.progress_id,)).fetchone()
+        if row is None or row[0] is None:
+            return {"stage": None, "completed": 0, "total": 0, "cancelled": bool(row and row[1]), "elapsed": 0.0}
+        return json.loads(row[0])
+
+    def cancel(self):
+        self.state.execute("UPDATE progress SET cancelled = 1 WHERE progress_id = ?", (self.progress_id,))
+
+
+class SharedProgressRegistry(ProgressRegistry):
+    """
+    ProgressRegistry whose progress can be read and cancelled from any worker process.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS progress (progress_id TEXT PRIMARY KEY, snapshot TEXT, cancelled INTEGER, updated_at REAL);
+    """
+
+    def __init__(self, state, ttl=3600):
+        super().__init__()
+        self.state = state
+        self.ttl = ttl
+        state.ensure_schema(self.SCHEMA)
+
+    def create(self, stages):
+        progress_id = uuid.uuid4().hex
+        with self.state.transaction() as conn:
+            conn.execute("DELETE FROM progress WHERE updated_at < ?", (time.time() - self.ttl,))
+            conn.execute("INSERT INTO progress VALUES (?, NULL, 0, ?)", (progress_id, time.time()))
+        with self._lock:
+            self._progress[progress_id] = SharedJobProgress(self.state, progress_id, stages)
+        return progress_id
+
+    def get(self, progress_id):
+        progress = super().get(progress_id)
+        if progress is None and self.state.execute("SELECT 1 FROM progress WHERE progress_id = ?", (progress_id,)).fetchone():
+            progress = RemoteJobProgress(self.state, progress_id)
+        return progress
+
+    def pop(self, progress_id):
+        progress = self.get(progress_id)
+        with self._lock:
+            self._progress.pop(progress_id, None)
+        self.state.execute("DELETE FROM progress WHERE progress_id = ?", (progress_id,))
+        return progress
+
+    def cancel(self, progress_id):
+        self.state.execute("UPDATE progress SET cancelled = 1 WHERE progress_id = ?", (progress_id,))
+        super().cancel(progress_id)
+
+
+class UploadSessions:
+    """
+    Upload job currently processed for each browser session. A newer upload replaces it, so the
+    polls of a superseded job can tell and leave the session's state alone.
+    """
+    def __init__(self):
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def start(self, session, job_id, progress_id):
+        """
+        Make job_id the current upload of session; returns the (job_id, progress_id) it replaces.
+        """
+        with self._lock:
+            previous = self._uploads.get(session)
+            self._uploads[session] = (job_id, progress_id)
+        return previous
+
+    def is_current(self, session, job_id):
+        with self._lock:
+            upload = self._uploads.get(session)
+        return upload is not None and upload[0] == job_id
+
+    def finish(self, session, job_id):
+        """
+        Forget the upload of session if job_id is still its current one (False if it was superseded).
+        """
+        with self._lock:
+            upload = self._uploads.get(session)
+            if upload is None or upload[0] != job_id:
+                return False
+            del self._uploads[session]
+            return True
+
+
+class SharedUploadSessions(UploadSessions):
+    """
+    UploadSessions of the multi-worker server: an upload started by one worker supersedes the
+    polls served by any other.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS upload_sessions (session TEXT PRIMARY KEY, job_id TEXT, progress_id TEXT, updated_at REAL);
+    """
+
+    def __init__(self, state, ttl=3600):
+        super().__init__()
+        self.state = state
+        self.ttl = ttl
+        state.ensure_schema(self.SCHEMA)
+
+    def start(self, session, job_id, progress_id):
+        with self.state.transaction() as conn:
+            conn.execute("DELETE FROM upload_sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+            previous = conn.execute("SELECT job_id, progress_id FROM upload_sessions WHERE session = ?", (session,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO upload_sessions VALUES (?, ?, ?, ?)", (session, job_id, progress_id, time.time()))
+        return tuple(previous) if previous is not None else None
+
+    def is_current(self, session, job_id):
+        return self.state.execute("SELECT 1 FROM upload_sessions WHERE session = ? AND job_id = ?", (session, job_id)).fetchone() is not None
+
+    def finish(self, session, job_id):
+        return self.state.execute("DELETE FROM upload_sessions WHERE session = ? AND job_id = ?", (session, job_id)).rowcount == 1
+
+
+# Worker pool for LLM interpretation and chat replies
+llm_jobs = JobQueue(max_workers=int(os.environ.get("MATHURANCE_LLM_WORKERS", 2)), name="mathurance-llm", state=shared_state)
+# Worker pool for upload processing (parse, triangle, figures), with the progress of each upload
+upload_jobs = JobQueue(max_workers=int(os.environ.get("MATHURANCE_UPLOAD_WORKERS", 2)), name="mathurance-upload", state=shared_state)
+upload_progress = SharedProgressRegistry(shared_state) if shared_state is not None else ProgressRegistry()
+# Current upload job of each session
+upload_sessions = SharedUploadSessions(shared_state) if shared_state is not None else UploadSessions()
@@ -1,5 +1,10 @@
+import functools
 from dash import html, dcc
 import dash_bootstrap_components as dbc
+from lazy import lazy_import
+
+# Only needed for the column names of the Excel section, loaded when the home page is first built
+utils = lazy_import("utils")
 
 # Sidebar Layout
 sidebar = dbc.Offcanvas(
@@ -63,7 +68,7 @@ sidebar = dbc.Offcanvas(
     style={"backgroundColor": "white"},  # Base color for sidebar
 )
 
-# Upload Section with Dropdown
+# Upload Section
 upload_section = dbc.Row(
     [
         dbc.Col(
@@ -101,24 +106,122 @@ upload_section = dbc.Row(
             ),
             md=8,  # Adjust column width for the upload button
         ),
+    ],
+    className="mb-4",  # Add margin below the row
+)
+
+# Reserving Method Selection (kept visible after upload so the method can be switched)
+method_section = dbc.Row(
+    [
         dbc.Col(
-            dcc.Dropdown(
-                id="model-dropdown",
-                options=[
-                    {"label": "Chain-Ladder", "value": "chain_ladder"},
-                    {"label": "Bornhuetter-Ferguson", "value": "bornhuetter_ferguson"},
-                    {"label": "Cape Cod", "value": "cape_cod"},
-                ],
-                value="chain_ladder",  # Default selection
-                clearable=False,
-                style={"width": "100%", "marginTop": "10px"},  # Style for the dropdown
-            ),
+            [
+                dcc.Dropdown(
+                    id="model-dropdown",
+                    options=[
+                        {"label": "Chain-Ladder", "value": "chain_ladder"},
+                        {"label": "Bornhuetter-Ferguson", "value": "bornhuetter_ferguson"},
+                        {"label": "Cape Cod", "value": "cape_cod"},
+                    ],
+                    value="chain_ladder",  # Default selection
+                    clearable=False,
+                    style={"width": "100%", "marginTop": "10px"},  # Style for the dropdown
+                ),
+                html.Small(id="method-status", style={"color": "#333333"}),  # Method and loss ratio used
+            ],
             md=4,  # Adjust column width for the dropdown
         ),
+        dbc.Col(
+            dbc.Input(
+                id="expected-loss-ratio",
+                type="number",
+                min=0,
+                step=0.01,
+                placeholder="Expected loss ratio (Bornhuetter-Ferguson, default: Cape Cod estimate)",
+                style={"marginTop": "10px"},
+            ),
+            md=5,
+        ),
+        dbc.Col(
+            [
+                dcc.Upload(
+                    id="append-data",
+                    children=html.A("Append new settlements", style={"cursor": "pointer", "color": "#1675e0"}),
+                    multiple=False,
+                    style={"marginTop": "16px"},
+                ),
+                html.Small(id="append-status", style={"color": "#333333"}),
+            ],
+            md=3,
+        ),
     ],
     className="mb-4",  # Add margin below the row
 )
 
+# Saved closings: save the current run under a name, reopen one, or compare two
+closings_section = html.Div(
+    [
+        dbc.Row(
+            [
+                dbc.Col(
+                    dbc.InputGroup([
+                        dbc.Input(id="closing-name", type="text", placeholder="Closing name, e.g. 2024-Q4"),
+                        dbc.Button("Save closing", id="save-closing", color="primary"),
+                    ]),
+                    md=4,
+                ),
+                dbc.Col(
+                    dcc.Dropdown(id="closing-version", placeholder="Open a saved closing", style={"width": "100%"}),
+                    md=4,
+                ),
+                dbc.Col(
+                    dcc.Dropdown(id="closing-compare", placeholder="Compare with closing...", style={"width": "100%"}),
+                    md=4,
+                ),
+            ],
+        ),
+        html.Small(id="closing-status", style={"color": "#333333"}),
+        html.Div(id="closing-diff", className="mt-2"),
+    ],
+    className="mb-4",
+)
+
+# Excel Options (built with the home page: the column names come from utils)
+def excel_section():
+    return dbc.Row(
+        [
+            dbc.Col(
+                dbc.Input(
+                    id="excel-sheet",
+                    type="text",
+                    placeholder="Excel sheet (default: first sheet)",
+                    style={"marginTop": "10px"},
+                ),
+                md=4,
+            ),
+            dbc.Col(
+                dcc.Dropdown(
+                    id="excel-columns",
+                    options=[{"label": col, "value": col} for col in utils.CLAIMS_COLUMNS + utils.PREMIUM_COLUMNS],
+                    multi=True,
+                    placeholder="Excel columns to load (default: all)",
+                    style={"width": "100%", "marginTop": "10px"},
+                ),
+                md=8,
+            ),
+        ],
+        className="mb-4",
+    )
+
+# Diagnostics: per-stage timings of the callbacks, collapsed by default
+diagnostics_section = html.Div(
+    [
+        dbc.Button("Diagnostics", id="diagnostics-toggle", color="link", size="sm"),
+        dbc.Collapse(html.Div(id="diagnostics-panel"), id="diagnostics-collapse", is_open=False),
+        dcc.Interval(id="diagnostics-interval", interval=5000, disabled=True),  # Refresh while open
+    ],
+    className="mb-4",
+)
+
 # Loading Message
 loading_message = html.Div(
     id="loading-message",
@@ -134,13 +237,13 @@ loading_message = html.Div(
 # Loading Interval
 loading_interval = dcc.Interval(
     id="loading-interval",
-    interval=1000,  # Check every 1 second
+    interval=500,  # Check the upload job every 0.5 second
     n_intervals=0,
     disabled=True  # Disabled by default
 )
 
-# Chatbot Layout
-chatbot_layout = html.Div(
+# Chatbot Section of the home page
+chatbot_section = html.Div(
     id="chatbot-container",
     style={"display": "none"},  # Hidden initially
     children=[
@@ -158,183 +261,219 @@ chatbot_layout = html.Div(
         ),
         dbc.Input(id="user-input", placeholder="Ask me about the plots...", type="text", style={"marginBottom": "10px"}),
         dbc.Button("Send", id="send-button", color="primary"),
+        dbc.Button("Stop", id="cancel-button", color="secondary", className="ms-2"),  # Cancel a running reply
     ]
 )
 
 # Home Page Layout
-# Home Page Layout
-home_layout = dbc.Container([
-    html.H1("Welcome to the Mathurance Platform", className="my-4", style={"color": "#1675e0"}),
-    html.P(
-        "Your one-stop solution for advanced actuarial analysis and claims forecasting.",
-        style={"color": "#333333", "fontSize": "18px", "marginBottom": "30px"}
-    ),
-    dcc.Store(id="loading-state", data=False),  # Store to track loading state
-    html.Div(id="dynamic-upload-section", children=upload_section),  # Dynamic section for upload/loading message
-    html.Div(id="output-data-upload", className="mb-5"),  # Add margin-bottom to the table
-    loading_interval,  # Interval to control loading message
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="heatmap-triangle", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
-        dbc.Col(dcc.Graph(id="bar-factors", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
-    ]),
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="line-projection", style={"display": "none"}), md=12, className="mb-5"),  # Add more margin-bottom
-    ]),
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="cumulative-claims", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
-        dbc.Col(dcc.Graph(id="claims-distribution", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
-    ]),
-    dbc.Row([
-        dbc.Col(html.Div(id="reserve-summary", style={"display": "none"}), md=12, className="mb-5"),  # Add more margin-bottom
-    ]),
-    dbc.Row([
-        dbc.Col(dcc.Graph(id="risk-factor-product", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
-        dbc.Col(dcc.Graph(id="risk-factor-sub-branch", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
-    ]),
-    dbc.Row([
-        dbc.Col(
-            html.Div(id="next-year-prediction", style={"display": "none"}),  # Hidden initially
-            md=12,
-            className="mb-5",  # Add more margin-bottom
+@functools.lru_cache(maxsize=None)
+def home_layout():
+    return dbc.Container([
+        html.H1("Welcome to the Mathurance Platform", className="my-4", style={"color": "#1675e0"}),
+        html.P(
+            "Your one-stop solution for advanced actuarial analysis and claims forecasting.",
+            style={"color": "#333333", "fontSize": "18px", "marginBottom": "30px"}
         ),
-    ]),
-    chatbot_layout  # Add the chatbot to the home layout
-], fluid=True, style={"padding": "20px"})
+        dcc.Store(id="loading-state", data=False),  # Store to track loading state
+        html.Div(id="dynamic-upload-section", children=upload_section),  # Dynamic section for upload/loading message
+        loading_message,  # Progress of the upload being processed
+        method_section,  # Reserving method selection
+        closings_section,  # Save, reopen and compare closings
+        excel_section(),  # Sheet and columns read from Excel uploads
+        html.Div(id="output-data-upload", className="mb-5"),  # Add margin-bottom to the table
+        loading_interval,  # Interval to control loading message
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="heatmap-triangle", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
+            dbc.Col(dcc.Graph(id="bar-factors", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
+        ]),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="line-projection", style={"display": "none"}), md=12, className="mb-5"),  # Add more margin-bottom
+        ]),
+        dbc.Row([
+            dbc.Col([
+                html.H4("Stochastic Reserving (Bootstrap ODP)", style={"color": "#1675e0"}),
+                dbc.InputGroup([
+                    dbc.InputGroupText("Simulations"),
+                    dbc.Input(id="bootstrap-simulations", type="number", value=10000, min=100, max=100000, step=100),
+                    dbc.Button("Run", id="bootstrap-button", color="primary"),
+                ], style={"maxWidth": "400px", "marginBottom": "10px"}),
+                dcc.Loading(html.Div(id="bootstrap-summary")),
+            ], md=12, className="mb-4"),
+        ]),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="reserve-distribution", style={"display": "none"}), md=6, className="mb-4"),  # Total reserve histogram
+            dbc.Col(dcc.Graph(id="reserve-percentiles", style={"display": "none"}), md=6, className="mb-4"),  # Percentiles by accident year
+        ]),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="cumulative-claims", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
+            dbc.Col(dcc.Graph(id="claims-distribution", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
+        ]),
+        dbc.Row([
+            dbc.Col(html.Div(id="reserve-summary", style={"display": "none"}), md=12, className="mb-5"),  # Add more margin-bottom
+        ]),
+        dbc.Row([
+            dbc.Col(dcc.Graph(id="risk-factor-product", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
+            dbc.Col(dcc.Graph(id="risk-factor-sub-branch", style={"display": "none"}), md=6, className="mb-4"),  # Add margin-bottom
+        ]),
+        dbc.Row([
+            dbc.Col(
+                html.Div(id="next-year-prediction", style={"display": "none"}),  # Hidden initially
+                md=12,
+                className="mb-5",  # Add more margin-bottom
+            ),
+        ]),
+        chatbot_section,  # Add the chatbot to the home layout
+        diagnostics_section  # Collapsible per-stage timings
+    ], fluid=True, style={"padding": "20px"})
 
 # About Page Layout
-about_layout = dbc.Container([
-    html.H1("About Mathurance Platform", className="my-4", style={"color": "#1675e0"}),
-    html.P(
-        "The Mathurance Platform is designed to provide advanced actuarial tools for claims forecasting and analysis. "
-        "Our platform leverages the Chain-Ladder method to help you make data-driven decisions with confidence.",
-        style={"color": "#333333", "fontSize": "18px"}
-    )
-], fluid=True, style={"padding": "20px"})
+@functools.lru_cache(maxsize=None)
+def about_layout():
+    return dbc.Container([
+        html.H1("About Mathurance Platform", className="my-4", style={"color": "#1675e0"}),
+        html.P(
+            "The Mathurance Platform is designed to provide advanced actuarial tools for claims forecasting and analysis. "
+            "Our platform leverages the Chain-Ladder method to help you make data-driven decisions with confidence.",
+            style={"color": "#333333", "fontSize": "18px"}
+        )
+    ], fluid=True, style={"padding": "20px"})
 
 # Scenario Analysis Page Layout
-scenario_analysis_layout = dbc.Container([
-    html.H1("Scenario Analysis", className="my-4", style={"color": "#1675e0"}),
-    html.P(
-        "Simulate different scenarios for claims forecasting by adjusting inflation rates and development factors.",
-        style={"color": "#333333", "fontSize": "18px", "marginBottom": "30px"}
-    ),
-    dbc.Row([
-        dbc.Col(
-            dbc.Card(
-                dbc.CardBody([
-                    html.H5("Adjust Inflation Rates", className="card-title"),
-                    html.Label("Inflation Rate for 2024 (%)"),
-                    dcc.Input(
-                        id="inflation-rate-2024",
-                        type="number",
-                        value=5.0,  # Default value
-                        min=0,
-                        max=20,
-                        step=0.1,
-                    ),
-                    html.Label("Inflation Rate for 2025 (%)"),
-                    dcc.Input(
-                        id="inflation-rate-2025",
-                        type="number",
-                        value=5.0,  # Default value
-                        min=0,
-                        max=20,
-                        step=0.1,
-                    ),
-                ]),
-            ),
-            md=6,
-            className="mb-4",  # Add margin-bottom to this column
+@functools.lru_cache(maxsize=None)
+def scenario_analysis_layout():
+    return dbc.Container([
+        html.H1("Scenario Analysis", className="my-4", style={"color": "#1675e0"}),
+        html.P(
+            "Simulate different scenarios for claims forecasting by adjusting inflation rates and development factors.",
+            style={"color": "#333333", "fontSize": "18px", "marginBottom": "30px"}
         ),
-        dbc.Col(
-            dbc.Card(
-                dbc.CardBody([
-                    html.H5("Adjust Development Factors", className="card-title"),
-                    html.Label("Development Factor for Period 1 to 2"),
-                    dcc.Slider(
-                        id="dev-factor-1-2",
-                        min=1.0,
-                        max=2.0,
-                        step=0.1,
-                        value=1.5,  # Default value
-                        marks={i: str(i) for i in [1.0, 1.5, 2.0]},
-                    ),
-                    html.Label("Development Factor for Period 2 to 3"),
-                    dcc.Slider(
-                        id="dev-factor-2-3",
-                        min=1.0,
-                        max=2.0,
-                        step=0.1,
-                        value=1.3,  # Default value
-                        marks={i: str(i) for i in [1.0, 1.5, 2.0]},
-                    ),
-                ]),
+        dbc.Row([
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody([
+                        html.H5("Adjust Inflation Rates", className="card-title"),
+                        html.Label("Inflation Rate for 2024 (%)"),
+                        dcc.Input(
+                            id="inflation-rate-2024",
+                            type="number",
+                            value=5.0,  # Default value
+                            min=0,
+                            max=20,
+                            step=0.1,
+                        ),
+                        html.Label("Inflation Rate for 2025 (%)"),
+                        dcc.Input(
+                            id="inflation-rate-2025",
+                            type="number",
+                            value=5.0,  # Default value
+                            min=0,
+                            max=20,
+                            step=0.1,
+                        ),
+                    ]),
+                ),
+                md=6,
+                className="mb-4",  # Add margin-bottom to this column
             ),
-            md=6,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-    ], className="mb-4"),  # Add margin-bottom to the entire row
-    dbc.Row([
-        dbc.Col(
-            dcc.Graph(id="scenario-line-plot"),
-            md=12,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-    ]),
-    dbc.Row([
-        dbc.Col(
-            html.Div(id="scenario-summary-table"),
-            md=12,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-    ]),
-    dbc.Row([
-        dbc.Col(
-            dcc.Graph(id="inflation-trend-plot"),
-            md=6,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-        dbc.Col(
-            dcc.Graph(id="claims-by-product-plot"),
-            md=6,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-    ]),
-    dbc.Row([
-        dbc.Col(
-            dcc.Graph(id="claims-by-sub-branch-plot"),
-            md=6,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-        dbc.Col(
-            dcc.Graph(id="claims-forecast-plot"),
-            md=6,
-            className="mb-4",  # Add margin-bottom to this column
-        ),
-    ]),
-], fluid=True, style={"padding": "20px"})
+            dbc.Col(
+                dbc.Card(
+                    dbc.CardBody([
+                        html.H5("Adjust Development Factors", className="card-title"),
+                        html.Label("Development Factor for Period 1 to 2"),
+                        dcc.Slider(
+                            id="dev-factor-1-2",
+                            min=1.0,
+                            max=2.0,
+                            step=0.1,
+                            value=1.5,  # Default value
+                            marks={i: str(i) for i in [1.0, 1.5, 2.0]},
+                        ),
+                        html.Label("Development Factor for Period 2 to 3"),
+                        dcc.Slider(
+                            id="dev-factor-2-3",
+                            min=1.0,
+                            max=2.0,
+                            step=0.1,
+                            value=1.3,  # Default value
+                            marks={i: str(i) for i in [1.0, 1.5, 2.0]},
+                        ),
+                    ]),
+                ),
+                md=6,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+        ], className="mb-4"),  # Add margin-bottom to the entire row
+        dbc.Row([
+            dbc.Col(
+                dcc.Graph(id="scenario-line-plot"),
+                md=12,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+        ]),
+        dbc.Row([
+            dbc.Col(
+                html.Div(id="scenario-summary-table"),
+                md=12,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+        ]),
+        dbc.Row([
+            dbc.Col(
+                dcc.Graph(id="scenario-sensitivity-surface"),
+                md=12,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+        ]),
+        dbc.Row([
+            dbc.Col(
+                dcc.Graph(id="inflation-trend-plot"),
+                md=6,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+            dbc.Col(
+                dcc.Graph(id="claims-by-product-plot"),
+                md=6,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+        ]),
+        dbc.Row([
+            dbc.Col(
+                dcc.Graph(id="claims-by-sub-branch-plot"),
+                md=6,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+            dbc.Col(
+                dcc.Graph(id="claims-forecast-plot"),
+                md=6,
+                className="mb-4",  # Add margin-bottom to this column
+            ),
+        ]),
+    ], fluid=True, style={"padding": "20px"})
 
 # Chatbot Page Layout
-chatbot_layout = dbc.Container([
-    html.H1("Chatbot", className="my-4", style={"color": "#1675e0"}),
-    html.P(
-        "Ask questions about your data and get insights from the chatbot.",
-        style={"color": "#333333", "fontSize": "18px", "marginBottom": "30px"}
-    ),
-    html.Div(
-        id="chat-history",
-        style={
-            "height": "300px",
-            "overflowY": "scroll",
-            "border": "1px solid #ddd",
-            "padding": "10px",
-            "marginBottom": "10px",
-            "backgroundColor": "#f9f9f9",  # Light background for chat history
-        },
-    ),
-    dbc.Input(id="user-input", placeholder="Ask me about the plots...", type="text", style={"marginBottom": "10px"}),
-    dbc.Button("Send", id="send-button", color="primary"),
-], fluid=True, style={"padding": "20px"})
+@functools.lru_cache(maxsize=None)
+def chatbot_layout():
+    return dbc.Container([
+        html.H1("Chatbot", className="my-4", style={"color": "#1675e0"}),
+        html.P(
+            "Ask questions about your data and get insights from the chatbot.",
+            style={"color": "#333333", "fontSize": "18px", "marginBottom": "30px"}
+        ),
+        html.Div(
+            id="chat-history",
+            style={
+                "height": "300px",
+                "overflowY": "scroll",
+                "border": "1px solid #ddd",
+                "padding": "10px",
+                "marginBottom": "10px",
+                "backgroundColor": "#f9f9f9",  # Light background for chat history
+            },
+        ),
+        dbc.Input(id="user-input", placeholder="Ask me about the plots...", type="text", style={"marginBottom": "10px"}),
+        dbc.Button("Send", id="send-button", color="primary"),
+        dbc.Button("Stop", id="cancel-button", color="secondary", className="ms-2"),  # Cancel a running reply
+    ], fluid=True, style={"padding": "20px"})
 
 # Main Layout
 layout = html.Div(
@@ -346,6 +485,8 @@ layout = html.Div(
         dcc.Location(id='url', refresh=False),
         dcc.Store(id="stored-data"),  # Store for uploaded data
         dcc.Store(id="stored-scenario-inputs"),  # Store for scenario analysis inputs
+        dcc.Store(id="llm-jobs", data=[]),  # Pending background LLM jobs
+        dcc.Interval(id="llm-poll", interval=500, disabled=True),  # Polls LLM jobs while any are pending
         dbc.Button(
             html.I(className="fas fa-bars"),  # FontAwesome hamburger icon
             id="sidebar-toggle",
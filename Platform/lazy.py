@@ -0,0 +1,68 @@
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+import types
+
+# MATHURANCE_LAZY_IMPORTS=0 imports every module at startup (as before); by default the heavy
+# analytics, plotting and LLM modules are only loaded the first time one of their names is used
+LAZY_IMPORTS = os.environ.get("MATHURANCE_LAZY_IMPORTS", "1") != "0"
+
+_lazy_modules = []
+_lock = threading.Lock()
+# One lock per lazy module, held while its code runs
+_load_locks = {}
+_loading = set()
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Module whose code runs on first attribute access. A thread touching it while another
+    thread runs its code waits for the load to finish instead of seeing a half-executed
+    module (importlib.util.LazyLoader only guards against this from Python 3.12.3).
+    """
+    def __getattribute__(self, attr):
+        spec = object.__getattribute__(self, "__spec__")
+        with _load_locks[spec.name]:
+            # Re-entrant access from the module's own code (or its imports) sees it as loaded so far
+            if type(self) is _LazyModule and spec.name not in _loading:
+                _loading.add(spec.name)
+                try:
+                    spec.loader.exec_module(self)
+                    self.__class__ = types.ModuleType
+                finally:
+                    _loading.discard(spec.name)
+        return types.ModuleType.__getattribute__(self, attr)  # Honours a module-level __getattr__ (e.g. plotly.io)
+
+
+def lazy_import(name):
+    """
+    Module object for name whose code only runs on first attribute access
+    (see _LazyModule). Raises ImportError right away if the module does not exist.
+    """
+    if name in sys.modules:  # Returned as is: importing it again would load a lazy module
+        return sys.modules[name]
+    if not LAZY_IMPORTS:
+        return importlib.import_module(name)
+    with _lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            raise ImportError(f"No module named {name!r}", name=name)
+        module = importlib.util.module_from_spec(spec)
+        _load_locks[name] = threading.RLock()
+        module.__class__ = _LazyModule
+        sys.modules[name] = module
+        _lazy_modules.append(name)
+    return module
+
+
+def preload():
+    """
+    Load every module registered by lazy_import now, e.g. in a server's master process
+    before the workers fork so they share the imported code.
+    """
+    for name in list(_lazy_modules):
+        getattr(sys.modules[name], "__name__")
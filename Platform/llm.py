@@ -0,0 +1,359 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from cache import evict_lru
+from lazy import lazy_import
+from shared import shared_state
+
+try:
+    ollama = lazy_import("ollama")
+except ImportError:  # Only needed by OllamaClient
+    ollama = None
+
+# Model served by the local Ollama instance for chat replies
+LLM_MODEL = os.environ.get("MATHURANCE_LLM_MODEL", "llama3.2")
+
+# Location and size cap of the LLM response cache (overridable through the environment)
+LLM_CACHE_DIR = os.environ.get(
+    "MATHURANCE_LLM_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm"),
+)
+LLM_CACHE_MAX_BYTES = int(os.environ.get("MATHURANCE_LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+
+class LLMResponseCache:
+    """
+    On-disk cache of LLM replies keyed by prompt, model name and a fingerprint of the data
+    the prompt is about (see cache.triangle_fingerprint). One small text file per reply,
+    least recently used replies are evicted past max_bytes. Hits and misses are counted.
+    """
+    def __init__(self, directory=LLM_CACHE_DIR, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(prompt, model_name=LLM_MODEL, fingerprint=""):
+        return hashlib.sha256("\0".join([model_name, fingerprint, prompt]).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.txt")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            text = None
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def put(self, key, text):
+        if self.max_bytes <= 0:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self._path(key))
+            evict_lru(self.directory, ".txt", self.max_bytes)
+        except OSError as e:
+            print("Error writing LLM cache:", e)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else None}
+
+
+llm_cache = LLMResponseCache()
+
+
+def generate_text(model, prompt):
+    """
+    Run a prompt through the LLM client and return the reply text.
+    """
+    response = model.generate_content(prompt)
+    return response.text
+
+
+def cached_generate_text(model, prompt, fingerprint="", cache=llm_cache):
+    """
+    generate_text with the response cache in front of it.
+    """
+    key = cache.key(prompt, LLM_MODEL, fingerprint)
+    text = cache.get(key)
+    if text is None:
+        text = generate_text(model, prompt)
+        cache.put(key, text)
+    return text
+
+
+class ChatStream:
+    """
+    Reply being generated token by token.
+    Written by the background job, read by the polling callback; cancel() asks the
+    generating job to stop at the next token.
+    """
+    def __init__(self):
+        self.parts = []
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.token_count = 0
+        self._lock = threading.Lock()
+
+    def append(self, text):
+        with self._lock:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.parts.append(text)
+            self.token_count += 1
+
+    def finish(self, error=None, token_count=None):
+        with self._lock:
+            self.error = error
+            if token_count:
+                self.token_count = token_count
+            self.finished_at = time.perf_counter()
+            self.done = True
+
+    def cancel(self):
+        self.cancelled = True
+
+    def snapshot(self):
+        """
+        Current text plus time-to-first-token (s) and generation speed (tokens/s).
+        """
+        with self._lock:
+            text = "".join(self.parts)
+            end = self.finished_at or time.perf_counter()
+            ttft = self.first_token_at - self.started_at if self.first_token_at else None
+            generation_time = end - self.first_token_at if self.first_token_at else 0
+            tokens_per_sec = self.token_count / generation_time if generation_time > 0 else None
+            return {
+                "text": text,
+                "done": self.done,
+                "cancelled": self.cancelled,
+                "error": self.error,
+                "ttft": ttft,
+                "tokens_per_sec": tokens_per_sec,
+            }
+
+
+class ChatStreamRegistry:
+    """
+    Streams in flight, by id, so callbacks running in any thread can read or cancel them.
+    """
+    def __init__(self):
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def create(self):
+        stream_id = uuid.uuid4().hex
+        with self._lock:
+            self._streams[stream_id] = ChatStream()
+        return stream_id
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def pop(self, stream_id):
+        with self._lock:
+            return self._streams.pop(stream_id, None)
+
+    def cancel(self, stream_id):
+        stream = self.get(stream_id)
+        if stream is not None:
+            stream.cancel()
+
+
+class SharedChatStream(ChatStream):
+    """
+    ChatStream of the multi-worker server: its snapshot is published to the shared state
+    (at most every publish_interval seconds, and when it finishes) and a cancellation
+    requested from any worker is seen by the generating job.
+    """
+    def __init__(self, state, stream_id, publish_interval=0.1):
+        self.state = state
+        self.stream_id = stream_id
+        self.publish_interval = publish_interval
+        self._published_at = 0.0
+        self._checked_at = 0.0
+        super().__init__()
+
+    @property
+    def cancelled(self):
+        now = time.monotonic()
+        if not self._cancelled and now - self._checked_at > self.publish_interval:
+            self._checked_at = now
+            row = self.state.execute("SELECT cancelled FROM streams WHERE stream_id = ?", (self.stream_id,)).fetchone()
+            self._cancelled = bool(row and row[0])
+        return self._cancelled
+
+    @cancelled.setter
+    def cancelled(self, value):
+        self._cancelled = value
+
+    def append(self, text):
+        super().append(text)
+        if time.monotonic() - self._published_at > self.publish_interval:
+            self.publish()
+
+    def finish(self, error=None, token_count=None):
+        super().finish(error, token_count)
+        self.publish()
+
+    def publish(self):
+        self._published_at = time.monotonic()
+        self.state.execute("UPDATE streams SET snapshot = ?, updated_at = ? WHERE stream_id = ?",
+                           (json.dumps(self.snapshot()), time.time(), self.stream_id))
+
+
+class RemoteChatStream:
+    """
+    Read side of a SharedChatStream generated by another worker process.
+    """
+    def __init__(self, state, stream_id):
+        self.state = state
+        self.stream_id = stream_id
+
+    def snapshot(self):
+        row = self.state.execute("SELECT snapshot, cancelled FROM streams WHERE stream_id = ?", (self.stream_id,)).fetchone()
+        if row is None or row[0] is None:
+            return {"text": "", "done": False, "cancelled": bool(row and row[1]), "error": None, "ttft": None, "tokens_per_sec": None}
+        return json.loads(row[0])
+
+    def cancel(self):
+        self.state.execute("UPDATE streams SET cancelled = 1 WHERE stream_id = ?", (self.stream_id,))
+
+
+class SharedChatStreamRegistry(ChatStreamRegistry):
+    """
+    ChatStreamRegistry whose streams can be read and cancelled from any worker process.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS streams (stream_id TEXT PRIMARY KEY, snapshot TEXT, cancelled INTEGER, updated_at REAL);
+    """
+
+    def __init__(self, state, ttl=3600):
+        super().__init__()
+        self.state = state
+        self.ttl = ttl
+        state.ensure_schema(self.SCHEMA)
+
+    def create(self):
+        stream_id = uuid.uuid4().hex
+        with self.state.transaction() as conn:
+            conn.execute("DELETE FROM streams WHERE updated_at < ?", (time.time() - self.ttl,))
+            conn.execute("INSERT INTO streams VALUES (?, NULL, 0, ?)", (stream_id, time.time()))
+        with self._lock:
+            self._streams[stream_id] = SharedChatStream(self.state, stream_id)
+        return stream_id
+
+    def get(self, stream_id):
+        stream = super().get(stream_id)
+        if stream is None and self.state.execute("SELECT 1 FROM streams WHERE stream_id = ?", (stream_id,)).fetchone():
+            stream = RemoteChatStream(self.state, stream_id)
+        return stream
+
+    def pop(self, stream_id):
+        stream = self.get(stream_id)
+        with self._lock:
+            self._streams.pop(stream_id, None)
+        self.state.execute("DELETE FROM streams WHERE stream_id = ?", (stream_id,))
+        return stream
+
+    def cancel(self, stream_id):
+        self.state.execute("UPDATE streams SET cancelled = 1 WHERE stream_id = ?", (stream_id,))
+        super().cancel(stream_id)
+
+
+chat_streams = SharedChatStreamRegistry(shared_state) if shared_state is not None else ChatStreamRegistry()
+
+
+def stream_chat(client, prompt, stream, model_name=LLM_MODEL, cache_key=None, cache=llm_cache):
+    """
+    Generate a chat reply with ollama.Client.chat(stream=True), pushing every token into stream.
+    Stops early if the stream is cancelled. Returns the full (possibly partial) reply text.
+    Complete replies are stored in the response cache under cache_key, if given.
+    """
+    token_count = None
+    try:
+        for chunk in client.chat(model=model_name, messages=[{"role": "user", "content": prompt}], stream=True):
+            if stream.cancelled:
+                break
+            content = chunk["message"]["content"]
+            if content:
+                stream.append(content)
+            if chunk.get("done"):
+                # Ollama reports the exact number of generated tokens in the last chunk
+                token_count = chunk.get("eval_count")
+    except Exception as e:
+        stream.finish(error=str(e))
+        raise
+    stream.finish(token_count=token_count)
+    text = stream.snapshot()["text"]
+    if cache_key is not None and not stream.cancelled:
+        cache.put(cache_key, text)
+    return text
+
+
+class OllamaClient:
+    """
+    ollama.Client created on first use, so the ollama package (and its HTTP stack) is only
+    loaded when the first request reaches the LLM.
+    """
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        with self._lock:
+            if self._client is None:
+                self._client = ollama.Client(**self._kwargs)
+        return getattr(self._client, name)
+
+
+class FakeChatClient:
+    """
+    Local stand-in for ollama.Client that streams a canned reply word by word.
+    Used for tests and for running the dashboard without an Ollama server.
+    """
+    def __init__(self, reply="This is a simulated answer from the local model.", delay=0.05):
+        self.reply = reply
+        self.delay = delay
+
+    def chat(self, model, messages, stream=False):
+        words = self.reply.split(" ")
+        if not stream:
+            return {"message": {"role": "assistant", "content": self.reply}, "done": True, "eval_count": len(words)}
+        return self._stream(words)
+
+    def _stream(self, words):
+        for i, word in enumerate(words):
+            time.sleep(self.delay)
+            yield {"message": {"role": "assistant", "content": word if i == 0 else " " + word}, "done": False}
+        yield {"message": {"role": "assistant", "content": ""}, "done": True, "eval_count": len(words)}
+
+    def generate_content(self, prompt):
+        return type("FakeResponse", (), {"text": self.reply})()
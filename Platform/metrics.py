@@ -0,0 +1,265 @@
+import functools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+
+from lazy import lazy_import
+
+np = lazy_import("numpy")
+
+try:
+    import resource
+except ImportError:  # Not available on Windows: the process peak RSS is simply not reported
+    resource = None
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Samples kept per stage for the rolling percentiles and histogram of the diagnostics panel
+METRICS_WINDOW = int(os.environ.get("MATHURANCE_METRICS_WINDOW", 256))
+# MATHURANCE_TRACE_MEMORY=1 measures each stage's peak allocations with tracemalloc
+# (exact but slows allocation-heavy code); by default the RSS change over the stage is recorded
+TRACE_MEMORY = os.environ.get("MATHURANCE_TRACE_MEMORY") == "1"
+# Upper bounds (seconds) of the wall time histogram buckets
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def process_peak_rss():
+    """
+    Peak resident set size of the process in bytes (None when unavailable).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Kilobytes on Linux
+
+
+def process_rss():
+    """
+    Current resident set size of the process in bytes (None when /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class StageStats:
+    """
+    Measurements of one (callback, stage): cumulative counters and wall time buckets for
+    Prometheus, plus the last window samples for the in-app percentiles.
+    """
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)  # (wall, cpu, memory) per call
+        self.count = 0
+        self.errors = 0
+        self.wall_sum = 0.0
+        self.cpu_sum = 0.0
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+
+    def add(self, wall, cpu, memory):
+        self.samples.append((wall, cpu, memory))
+        self.count += 1
+        self.wall_sum += wall
+        self.cpu_sum += cpu
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if wall <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class StageMetrics:
+    """
+    In-process instrumentation of the pipeline stages run by the callbacks.
+    Each stage records its wall time, the CPU time of its thread and its memory: the
+    tracemalloc peak above the start when tracing, otherwise the change of the process RSS
+    between the start and the end of the stage (not a peak, and shared with the threads
+    running at the same time; NaN without /proc). The cost per stage is a few clock reads
+    and two reads of /proc/self/statm, so it stays on in production.
+    Nested stages are supported (e.g. a callback total around its stages).
+    """
+    def __init__(self, window=METRICS_WINDOW, trace_memory=TRACE_MEMORY):
+        self.window = window
+        self.trace_memory = trace_memory
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _frames(self):
+        if not hasattr(self._local, "frames"):
+            self._local.frames = []
+        return self._local.frames
+
+    def _stats_for(self, callback, stage):
+        key = (callback, stage)
+        if key not in self._stats:
+            self._stats[key] = StageStats(self.window)
+        return self._stats[key]
+
+    @contextmanager
+    def stage(self, callback, stage):
+        """
+        Measure the enclosed block as one run of stage within callback.
+        PreventUpdate is not counted; other exceptions count as errors of the stage.
+        """
+        frames = self._frames()
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if frames:  # The enclosing stage keeps the peak reached so far before it is reset
+                frames[-1]["peak"] = max(frames[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame = {"start": current, "peak": current}
+        else:
+            frame = {"start": process_rss()}
+        frames.append(frame)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        except PreventUpdate:
+            raise
+        except Exception:
+            with self._lock:
+                self._stats_for(callback, stage).errors += 1
+            raise
+        else:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            if self.trace_memory:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                memory = peak - frame["start"]
+                if len(frames) > 1:
+                    frames[-2]["peak"] = max(frames[-2]["peak"], peak)
+            else:
+                end = process_rss()
+                memory = np.nan if end is None or frame["start"] is None else end - frame["start"]
+            with self._lock:
+                self._stats_for(callback, stage).add(wall, cpu, memory)
+        finally:
+            frames.pop()
+
+    def memory_label(self):
+        """
+        What the memory of a stage measures under the current mode.
+        """
+        return "peak traced allocation" if self.trace_memory else "process RSS change"
+
+    def timed(self, callback, stage, fn):
+        """
+        fn wrapped so that every call is measured as stage of callback
+        (for work handed to background jobs).
+        """
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(callback, stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def instrument(self, callback):
+        """
+        Decorator measuring a whole callback as its "total" stage.
+        """
+        def decorator(fn):
+            return self.timed(callback, "total", fn)
+        return decorator
+
+    def summary(self):
+        """
+        One row per (callback, stage): calls, errors, wall time percentiles and CPU time
+        over the rolling window, largest memory sample and the window's wall time histogram.
+        """
+        with self._lock:
+            snapshot = [(key, list(stats.samples), stats.count, stats.errors) for key, stats in self._stats.items()]
+        rows = []
+        for (callback, stage), samples, count, errors in sorted(snapshot):
+            if not samples:
+                rows.append({"callback": callback, "stage": stage, "calls": count, "errors": errors})
+                continue
+            wall, cpu, memory = np.array(samples).T
+            p50, p95 = np.percentile(wall, [50, 95])
+            rows.append({
+                "callback": callback,
+                "stage": stage,
+                "calls": count,
+                "errors": errors,
+                "wall_p50": p50,
+                "wall_p95": p95,
+                "wall_max": wall.max(),
+                "cpu_mean": cpu.mean(),
+                "memory": np.nanmax(memory) if not np.isnan(memory).all() else np.nan,
+                "histogram": np.histogram(wall, bins=(0.0,) + HISTOGRAM_BUCKETS + (np.inf,))[0].tolist(),
+            })
+        return rows
+
+    def prometheus(self, prefix="mathurance"):
+        """
+        All counters in the Prometheus text exposition format.
+        """
+        with self._lock:
+            snapshot = [
+                (key, list(stats.buckets), stats.count, stats.errors, stats.wall_sum, stats.cpu_sum,
+                 max((sample[2] for sample in stats.samples if not np.isnan(sample[2])), default=None))
+                for key, stats in sorted(self._stats.items())
+            ]
+        wall, cpu, memory, errors = [], [], [], []
+        for (callback, stage), buckets, count, n_errors, wall_sum, cpu_sum, peak in snapshot:
+            labels = f'callback="{callback}",stage="{stage}"'
+            cumulative = 0
+            for bound, n in zip(HISTOGRAM_BUCKETS, buckets):
+                cumulative += n
+                wall.append(f'{prefix}_stage_wall_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            wall.append(f'{prefix}_stage_wall_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            wall.append(f"{prefix}_stage_wall_seconds_sum{{{labels}}} {wall_sum}")
+            wall.append(f"{prefix}_stage_wall_seconds_count{{{labels}}} {count}")
+            cpu.append(f"{prefix}_stage_cpu_seconds_total{{{labels}}} {cpu_sum}")
+            if peak is not None:
+                memory.append(f"{prefix}_stage_memory_bytes{{{labels}}} {peak}")
+            errors.append(f"{prefix}_stage_errors_total{{{labels}}} {n_errors}")
+
+        lines = [
+            f"# HELP {prefix}_stage_wall_seconds Wall time of the pipeline stages.",
+            f"# TYPE {prefix}_stage_wall_seconds histogram",
+            *wall,
+            f"# HELP {prefix}_stage_cpu_seconds_total CPU time of the pipeline stages (thread time).",
+            f"# TYPE {prefix}_stage_cpu_seconds_total counter",
+            *cpu,
+            f"# HELP {prefix}_stage_memory_bytes Largest {self.memory_label()} of a stage over the recent calls.",
+            f"# TYPE {prefix}_stage_memory_bytes gauge",
+            *memory,
+            f"# HELP {prefix}_stage_errors_total Failed runs of the pipeline stages.",
+            f"# TYPE {prefix}_stage_errors_total counter",
+            *errors,
+        ]
+        rss = process_peak_rss()
+        if rss is not None:
+            lines += [
+                f"# HELP {prefix}_process_peak_rss_bytes Peak resident set size of the process.",
+                f"# TYPE {prefix}_process_peak_rss_bytes gauge",
+                f"{prefix}_process_peak_rss_bytes {rss}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def register_metrics_route(server, metrics, path="/metrics"):
+    """
+    Expose metrics on the Flask server at path, in the Prometheus text format.
+    """
+    from flask import Response
+
+    @server.route(path)
+    def prometheus_metrics():
+        return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+
+    return prometheus_metrics
+
+
+# Shared instrumentation of the dashboard callbacks
+stage_metrics = StageMetrics()
@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Rows per page of the upload preview table
+PREVIEW_PAGE_SIZE = 10
+
+# Filter operators of the DataTable query syntax: word form first, then the symbol the table may send
+FILTER_OPERATORS = [
+    ["ge ", ">="],
+    ["le ", "<="],
+    ["lt ", "<"],
+    ["gt ", ">"],
+    ["ne ", "!="],
+    ["eq ", "="],
+    ["contains "],
+    ["datestartswith "],
+]
+
+
+def split_filter_part(filter_part):
+    """
+    Parse one clause of a DataTable filter_query (e.g. '{Règlement} > 1000') into
+    (column, operator, value). Returns (None, None, None) if the clause is not understood.
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator not in filter_part:
+                continue
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+            value_part = value_part.strip()
+            if value_part and value_part[0] == value_part[-1] and value_part[0] in ("'", '"', "`"):
+                value = value_part[1:-1].replace("\\" + value_part[0], value_part[0])
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+class PreviewIndex:
+    """
+    Server-side paging, sorting and filtering of a parsed claims DataFrame for the
+    preview table (DataTable with page_action/sort_action/filter_action="custom").
+    Sort orders and filter masks are computed once per sort key / filter query and kept,
+    so flipping through pages only slices precomputed row positions.
+    """
+    def __init__(self, df, max_cached=16):
+        self.df = df
+        self.max_cached = max_cached
+        self._orders = OrderedDict()
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _remember(cache, key, value, max_entries):
+        cache[key] = value
+        while len(cache) > max_entries:
+            cache.popitem(last=False)
+
+    def _cached(self, cache, key, compute):
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = compute()
+        with self._lock:
+            self._remember(cache, key, value, self.max_cached)
+        return value
+
+    def _sort_order(self, sort_by):
+        # Row positions in sort order; lexsort takes its primary key last
+        keys = []
+        for entry in reversed(sort_by):
+            column = self.df[entry["column_id"]]
+            descending = entry["direction"] == "desc"
+            if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+                values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+                keys.append(np.nan_to_num(-values if descending else values, nan=np.inf))  # Missing values sort last
+                continue
+            codes = pd.factorize(column, sort=True)[0]
+            if descending:
+                codes = np.where(codes >= 0, codes.max() - codes, codes)
+            keys.append(np.where(codes >= 0, codes, len(codes)))
+        return np.lexsort(keys)
+
+    def _filter_mask(self, filter_query):
+        mask = np.ones(len(self.df), dtype=bool)
+        for filter_part in filter_query.split(" && "):
+            column, operator, value = split_filter_part(filter_part)
+            if column not in self.df.columns:
+                continue
+            series = self.df[column]
+            if operator in ("contains", "datestartswith"):
+                text = series.astype("string")
+                matches = text.str.contains(str(value), regex=False) if operator == "contains" else text.str.startswith(str(value))
+            else:
+                if pd.api.types.is_datetime64_any_dtype(series):
+                    value = pd.to_datetime(value, dayfirst=True, errors="coerce")
+                elif pd.api.types.is_numeric_dtype(series) and isinstance(value, str):
+                    value = pd.to_numeric(value, errors="coerce")
+                elif not pd.api.types.is_numeric_dtype(series):
+                    series, value = series.astype("string"), str(value)
+                try:
+                    matches = {
+                        "ge": series.__ge__, "le": series.__le__, "lt": series.__lt__,
+                        "gt": series.__gt__, "ne": series.__ne__, "eq": series.__eq__,
+                    }[operator](value)
+                except TypeError:  # Value not comparable with the column
+                    matches = pd.Series(False, index=series.index)
+            mask &= matches.fillna(False).to_numpy(dtype=bool)
+        return mask
+
+    def rows(self, sort_by=None, filter_query=""):
+        """
+        Positions of the rows matching filter_query, in sort_by order.
+        """
+        sort_by = sort_by or []
+        filter_query = filter_query or ""
+        sort_key = tuple((entry["column_id"], entry["direction"]) for entry in sort_by)
+        rows = np.arange(len(self.df))
+        if sort_key:
+            rows = self._cached(self._orders, sort_key, lambda: self._sort_order(sort_by))
+        if filter_query:
+            mask = self._cached(self._masks, filter_query, lambda: self._filter_mask(filter_query))
+            rows = rows[mask[rows]]
+        return rows
+
+    def page(self, page_current=0, page_size=PREVIEW_PAGE_SIZE, sort_by=None, filter_query=""):
+        """
+        One page of records for the DataTable, and the number of pages.
+        """
+        rows = self.rows(sort_by, filter_query)
+        page_count = max(-(-len(rows) // page_size), 1)
+        start = (page_current or 0) * page_size
+        return self.df.iloc[rows[start:start + page_size]].to_dict("records"), page_count
+
+
+class PreviewCache:
+    """
+    PreviewIndex of the recent datasets of this process, by dataset handle. The index is rebuilt
+    from the stored claims when they change or were dropped from the cache, so it never has
+    to be stored (or pickled) next to them.
+    """
+    def __init__(self, max_datasets=8):
+        self.max_datasets = max_datasets
+        self._previews = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, handle, df):
+        with self._lock:
+            preview = self._previews.get(handle)
+            if preview is not None and preview.df is df:
+                self._previews.move_to_end(handle)
+                return preview
+        preview = PreviewIndex(df)
+        self.put(handle, preview)
+        return preview
+
+    def put(self, handle, preview):
+        with self._lock:
+            self._previews[handle] = preview
+            self._previews.move_to_end(handle)
+            while len(self._previews) > self.max_datasets:
+                self._previews.popitem(last=False)
+
+
+# Preview indexes of the datasets served by this process
+preview_cache = PreviewCache()
@@ -0,0 +1,428 @@
+import numpy as np
+import pandas as pd
+
+
+def triangle_to_array(triangle):
+    """
+    Convert a cumulative triangle DataFrame into a dense NumPy representation.
+    Returns the values (float64, NaN for missing cells) and a boolean mask of observed cells.
+    """
+    values = triangle.to_numpy(dtype=np.float64, na_value=np.nan)
+    mask = ~np.isnan(values)
+    return values, mask
+
+
+def chain_ladder_factors_array(values, mask, periods):
+    """
+    Compute age-to-age factors on a dense triangle.
+    periods holds the (sorted) development period labels of the columns. The factor for
+    column j is sum(next period) / sum(current period) over rows observed in both columns.
+    Columns whose next period is not present, or whose base sum is zero, get NaN.
+    Returns an array with one factor per column except the last.
+    """
+    periods = np.asarray(periods)
+    n_factors = max(values.shape[1] - 1, 0)
+    factors = np.full(n_factors, np.nan)
+    if n_factors == 0:
+        return factors
+
+    # Pairs of neighbouring columns that are exactly one period apart
+    adjacent = periods[1:] == periods[:-1] + 1
+    both = mask[:, :-1] & mask[:, 1:]
+
+    # Each column is summed over its own compacted cells so the additions happen in the
+    # same order as the pandas reference implementation (bit-identical factors).
+    for j in np.flatnonzero(adjacent & both.any(axis=0)):
+        rows = both[:, j]
+        denominator = values[rows, j].sum()
+        if denominator != 0:
+            factors[j] = values[rows, j + 1].sum() / denominator
+    return factors
+
+
+def factor_vector(factors, periods):
+    """
+    Factor developing each of periods into the next one, from a {period: factor} dict.
+    Periods without a factor, or whose factor is undefined (NaN: no accident year observed
+    at both ages), develop with a factor of 1.
+    """
+    vector = np.array([factors.get(period, 1.0) for period in periods], dtype=np.float64)
+    return np.where(np.isnan(vector), 1.0, vector)
+
+
+def undefined_factor_periods(factors):
+    """
+    Development periods whose factor could not be estimated from the triangle (NaN).
+    """
+    return [period for period, factor in factors.items() if np.isnan(factor)]
+
+
+def cumulative_development_factors(factors):
+    """
+    Cumulative-to-ultimate factors: entry j is the product of every age-to-age factor
+    from period j onwards (the last period develops with a factor of 1). Undefined (NaN)
+    factors count as 1, so one gap does not make the whole pattern NaN.
+    """
+    factors = np.asarray(factors, dtype=np.float64)
+    factors = np.where(np.isnan(factors), 1.0, factors)
+    return np.append(np.cumprod(factors[::-1])[::-1], 1.0)
+
+
+def last_observed_index(mask):
+    """
+    Column index of the last observed cell in each row (-1 for rows with no data).
+    """
+    n_cols = mask.shape[1]
+    last = n_cols - 1 - np.argmax(mask[:, ::-1], axis=1)
+    return np.where(mask.any(axis=1), last, -1)
+
+
+def project_array(values, mask, factors):
+    """
+    Project every row of a dense triangle beyond its last observed cell.
+    factors[j] develops column j into column j + 1. The future cells of a row are the
+    running product last_value * f[k] * f[k + 1] * ..., computed with a single cumprod
+    over the whole triangle, so the result matches a cell-by-cell loop exactly.
+    Cells up to and including the last observed one are returned unchanged.
+    """
+    n_rows, n_cols = values.shape
+    last = last_observed_index(mask)
+    cols = np.arange(n_cols)
+
+    # Build the sequence 1, ..., 1, last_value, f[k], f[k + 1], ... for every row
+    steps = np.ones((n_rows, n_cols))
+    if n_cols > 1:
+        steps[:, 1:] = np.broadcast_to(np.asarray(factors, dtype=np.float64), (n_rows, n_cols - 1))
+    has_data = last >= 0
+    steps[cols[None, :] < last[:, None]] = 1.0
+    steps[has_data, last[has_data]] = values[has_data, last[has_data]]
+
+    future = (cols[None, :] > last[:, None]) & has_data[:, None]
+    return np.where(future, np.cumprod(steps, axis=1), values)
+
+
+def percent_developed(values, mask, factors):
+    """
+    Share of the ultimate reached at each development period (1 / cumulative factor),
+    plus the share reached at the last observed cell of every row (NaN for empty rows).
+    """
+    pattern = 1.0 / cumulative_development_factors(factors)
+    last = last_observed_index(mask)
+    latest_pattern = np.where(last >= 0, pattern[np.maximum(last, 0)], np.nan)
+    return pattern, latest_pattern
+
+
+def latest_diagonal(values, mask):
+    """
+    Last observed cumulative value of every row (NaN for empty rows).
+    """
+    last = last_observed_index(mask)
+    return np.where(last >= 0, values[np.arange(values.shape[0]), np.maximum(last, 0)], np.nan)
+
+
+def cape_cod_loss_ratio(values, mask, factors, premiums):
+    """
+    Cape Cod expected loss ratio: reported claims over used-up premium,
+    sum(latest) / sum(premium * percent developed), over rows with data.
+    """
+    _, latest_pattern = percent_developed(values, mask, factors)
+    latest = latest_diagonal(values, mask)
+    used_premium = np.asarray(premiums, dtype=np.float64) * latest_pattern
+    rows = ~np.isnan(latest)
+    return np.nansum(latest[rows]) / np.nansum(used_premium[rows])
+
+
+def project_expected_array(values, mask, factors, expected_ultimates):
+    """
+    Bornhuetter-Ferguson style projection: the future cells of row i are
+    latest_i + expected_ultimate_i * (pattern[t] - pattern[last_i]), so the unreported
+    part follows the chain-ladder development pattern but is driven by the a priori
+    ultimate instead of the row's own claims. The last column holds the ultimate.
+    """
+    n_rows, n_cols = values.shape
+    pattern, latest_pattern = percent_developed(values, mask, factors)
+    latest = latest_diagonal(values, mask)
+    last = last_observed_index(mask)
+
+    expected = np.asarray(expected_ultimates, dtype=np.float64)[:, None]
+    projected = latest[:, None] + expected * (pattern[None, :] - latest_pattern[:, None])
+    future = (np.arange(n_cols)[None, :] > last[:, None]) & (last >= 0)[:, None]
+    return np.where(future, projected, values)
+
+
+def bornhuetter_ferguson_array(values, mask, factors, premiums, expected_loss_ratio):
+    """
+    Bornhuetter-Ferguson projection with a priori ultimates premium * expected loss ratio.
+    """
+    expected = np.asarray(premiums, dtype=np.float64) * expected_loss_ratio
+    return project_expected_array(values, mask, factors, expected)
+
+
+def cape_cod_array(values, mask, factors, premiums):
+    """
+    Cape Cod (Stanard-Bühlmann) projection: Bornhuetter-Ferguson with the expected loss
+    ratio estimated from the triangle itself. Returns the projection and the loss ratio.
+    """
+    loss_ratio = cape_cod_loss_ratio(values, mask, factors, premiums)
+    return bornhuetter_ferguson_array(values, mask, factors, premiums, loss_ratio), loss_ratio
+
+
+class IncrementalTriangle:
+    """
+    Claims triangle that can be updated with new settlement rows without regrouping the
+    full history. Keeps the incremental and cumulative amounts as dense arrays, together
+    with the running numerator/denominator sums behind every age-to-age factor.
+    add_claims() only revisits the accident years that received new amounts, so a monthly
+    refresh costs time proportional to the delta rather than to the whole history.
+    """
+    def __init__(self, accident_years, periods, incremental):
+        self.accident_years = np.asarray(accident_years)
+        self.periods = np.asarray(periods)
+        self.incremental = np.asarray(incremental, dtype=np.float64)
+        self.mask = ~np.isnan(self.incremental)
+        self.rebuild()
+
+    @classmethod
+    def from_claims(cls, df):
+        """
+        Build from cleaned claims rows (Accident Year, Development Period, Règlement),
+        e.g. the output of parse_contents or parse_contents_streaming.
+        """
+        cells = df.groupby(['Accident Year', 'Development Period'])['Règlement'].sum()
+        years = cells.index.get_level_values(0).to_numpy().astype(np.int64)
+        devs = cells.index.get_level_values(1).to_numpy().astype(np.int64)
+        accident_years = np.unique(years)
+        periods = np.arange(devs.min(), devs.max() + 1) if len(devs) else np.arange(0)
+        incremental = np.full((len(accident_years), len(periods)), np.nan)
+        incremental[np.searchsorted(accident_years, years), devs - periods[0]] = cells.to_numpy()
+        return cls(accident_years, periods, incremental)
+
+    def rebuild(self):
+        """
+        Recompute cumulative values and factor sums from scratch (also clears rounding drift).
+        """
+        self.cumulative = self._cumulate(self.incremental, self.mask)
+        n_pairs = max(len(self.periods) - 1, 0)
+        self.numerators = np.zeros(n_pairs)
+        self.denominators = np.zeros(n_pairs)
+        self.pair_counts = np.zeros(n_pairs, dtype=np.int64)
+        self._add_contributions(np.arange(len(self.accident_years)), sign=1)
+
+    @staticmethod
+    def _cumulate(incremental, mask):
+        # Running total over observed cells, NaN where nothing was observed (like create_triangle)
+        return np.where(mask, np.cumsum(np.where(mask, incremental, 0.0), axis=1), np.nan)
+
+    def _add_contributions(self, rows, sign):
+        # Add (sign=1) or remove (sign=-1) the factor sums contributed by the given rows
+        if len(self.periods) < 2 or len(rows) == 0:
+            return
+        cumulative = self.cumulative[rows]
+        both = self.mask[rows, :-1] & self.mask[rows, 1:]
+        self.numerators += sign * np.where(both, cumulative[:, 1:], 0.0).sum(axis=0)
+        self.denominators += sign * np.where(both, cumulative[:, :-1], 0.0).sum(axis=0)
+        self.pair_counts += sign * both.sum(axis=0)
+
+    def _grow(self, accident_years, periods):
+        # Extend the arrays to new accident years / development periods (rare: once per new year)
+        new_years = np.union1d(self.accident_years, accident_years)
+        start = min(self.periods.min(initial=periods.min()), periods.min())
+        stop = max(self.periods.max(initial=periods.max()), periods.max())
+        new_periods = np.arange(start, stop + 1)
+        if len(new_years) == len(self.accident_years) and len(new_periods) == len(self.periods):
+            return
+        incremental = np.full((len(new_years), len(new_periods)), np.nan)
+        if self.incremental.size:
+            rows = np.searchsorted(new_years, self.accident_years)
+            cols = self.periods - new_periods[0]
+            incremental[np.ix_(rows, cols)] = self.incremental
+        self.accident_years, self.periods, self.incremental = new_years, new_periods, incremental
+        self.mask = ~np.isnan(incremental)
+        self.rebuild()
+
+    def add_claims(self, df):
+        """
+        Add new claims rows (Accident Year, Development Period, Règlement) to the triangle.
+        Only the accident years that received amounts are re-cumulated, and only their
+        contributions to the factor sums are replaced. Returns the updated accident years.
+        """
+        df = df[df['Development Period'] >= 0]
+        cells = df.groupby(['Accident Year', 'Development Period'])['Règlement'].sum()
+        if cells.empty:
+            return np.array([], dtype=self.accident_years.dtype)
+        years = cells.index.get_level_values(0).to_numpy().astype(np.int64)
+        devs = cells.index.get_level_values(1).to_numpy().astype(np.int64)
+        self._grow(years, devs)
+
+        rows = np.searchsorted(self.accident_years, years)
+        cols = devs - self.periods[0]
+        changed = np.unique(rows)
+
+        self._add_contributions(changed, sign=-1)
+        # Cells seen for the first time start from zero (cells is already one entry per cell)
+        previous = np.where(self.mask[rows, cols], self.incremental[rows, cols], 0.0)
+        self.incremental[rows, cols] = previous + cells.to_numpy()
+        self.mask[rows, cols] = True
+        self.cumulative[changed] = self._cumulate(self.incremental[changed], self.mask[changed])
+        self._add_contributions(changed, sign=1)
+        return self.accident_years[changed]
+
+    def triangle(self):
+        """
+        Cumulative triangle as a DataFrame, in the same shape as utils.create_triangle.
+        """
+        observed = self.mask.any(axis=0)
+        return pd.DataFrame(
+            self.cumulative[:, observed],
+            index=pd.Index(self.accident_years, name='Accident Year'),
+            columns=pd.Index(self.periods[observed], name='Development Period'),
+        )
+
+    def factors(self):
+        """
+        Age-to-age factors keyed by development period, like utils.compute_chain_ladder_factors.
+        """
+        observed = np.flatnonzero(self.mask.any(axis=0))
+        factors = {}
+        for j in observed[:-1]:
+            # The factor pairs column j with the next period, which must itself be observed
+            if j + 1 in observed and self.pair_counts[j] > 0 and self.denominators[j] != 0:
+                factors[self.periods[j].item()] = self.numerators[j] / self.denominators[j]
+            else:
+                factors[self.periods[j].item()] = np.nan
+        return factors
+
+
+class SparseTriangle:
+    """
+    Cumulative claims triangle stored as its observed cells only, row by row (compressed
+    sparse rows: the cells of accident period i are values[offsets[i]:offsets[i + 1]], at
+    development indices cols[...]). Monthly or quarterly triangles are mostly empty once
+    densified (240 x 240 cells for 20 years of months, over half of them in the future), so
+    memory, the factor sums and the projection follow the number of observed cells instead
+    of the size of the grid.
+    """
+    def __init__(self, accident_periods, periods, offsets, cols, values):
+        self.accident_periods = np.asarray(accident_periods)
+        self.periods = np.asarray(periods)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        # 2 bytes per cell are enough for any realistic number of development periods
+        self.cols = np.asarray(cols, dtype=np.int16 if len(self.periods) <= np.iinfo(np.int16).max else np.int32)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_cells(cls, accident_periods, rows, devs, values):
+        # Cells sorted by row then development period, one entry per cell
+        devs = np.asarray(devs, dtype=np.int64)
+        periods = np.arange(devs.min(), devs.max() + 1) if len(devs) else np.arange(0)
+        offsets = np.append(0, np.cumsum(np.bincount(rows, minlength=len(accident_periods))))
+        return cls(accident_periods, periods, offsets, devs - periods[:1].sum(), values)
+
+    @classmethod
+    def from_claims(cls, df):
+        """
+        Build from cleaned claims rows (Accident Year, Development Period, Règlement),
+        at any granularity (see utils.add_development_periods).
+        """
+        cells = df.groupby(['Accident Year', 'Development Period'], observed=True, sort=True)['Règlement'].sum()
+        # Running total along each accident period, over its observed cells (like create_triangle)
+        cumulative = cells.groupby(level=0, sort=False).cumsum()
+        accident_periods, rows = np.unique(cells.index.get_level_values(0).to_numpy(), return_inverse=True)
+        return cls.from_cells(accident_periods, rows, cells.index.get_level_values(1).to_numpy(), cumulative.to_numpy())
+
+    @classmethod
+    def from_dense(cls, triangle):
+        """
+        Build from a cumulative triangle DataFrame (e.g. utils.create_triangle).
+        """
+        values, mask = triangle_to_array(triangle)
+        rows, cols = np.nonzero(mask)
+        devs = np.asarray(triangle.columns, dtype=np.int64)[cols]
+        return cls.from_cells(triangle.index.to_numpy(), rows, devs, values[rows, cols])
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.cols.nbytes + self.values.nbytes
+
+    def rows(self):
+        """
+        Accident period index of every cell.
+        """
+        return np.repeat(np.arange(len(self.accident_periods)), np.diff(self.offsets))
+
+    def cells(self):
+        """
+        Observed cells as a long table (Accident Year, Development Period, Cumulative Claims).
+        """
+        return pd.DataFrame({
+            'Accident Year': self.accident_periods[self.rows()],
+            'Development Period': self.periods[self.cols],
+            'Cumulative Claims': self.values,
+        })
+
+    def to_dense(self):
+        """
+        Cumulative triangle as a DataFrame, in the same shape as utils.create_triangle
+        (observed development periods only). Only sensible for small triangles.
+        """
+        observed = np.unique(self.cols)
+        values = np.full((len(self.accident_periods), len(observed)), np.nan)
+        values[self.rows(), np.searchsorted(observed, self.cols)] = self.values
+        return pd.DataFrame(
+            values,
+            index=pd.Index(self.accident_periods, name='Accident Year'),
+            columns=pd.Index(self.periods[observed], name='Development Period'),
+        )
+
+    def factors(self):
+        """
+        Age-to-age factors keyed by development period, like utils.compute_chain_ladder_factors,
+        with the months without payment of a row carrying its previous cumulative value (as in
+        stochastic.prepare_odp_triangle): every row takes part in the development periods from
+        its first to its last observed cell. Periods that no row spans are NaN.
+        """
+        n_cols = len(self.periods)
+        cols = self.cols.astype(np.int64)
+        # Consecutive observed cells of a row: the earlier value is carried over [start, end),
+        # the later one is reached at end
+        consecutive = np.ones(max(len(cols) - 1, 0), dtype=bool)
+        consecutive[self.offsets[1:-1] - 1] = False  # Last cell of a row and first cell of the next
+        start, end = cols[:-1][consecutive], cols[1:][consecutive]
+        carried, reached = self.values[:-1][consecutive], self.values[1:][consecutive]
+
+        def spread(lower, upper, weights=None):
+            # Sum of weights over every period of [lower, upper), through a difference array
+            bounds = np.bincount(lower, weights, minlength=n_cols + 1) - np.bincount(upper, weights, minlength=n_cols + 1)
+            return np.cumsum(bounds)[:n_cols]
+
+        pairs = spread(start, end)
+        denominators = spread(start, end, carried)
+        numerators = spread(start, end - 1, carried) + np.bincount(end - 1, reached, minlength=n_cols)[:n_cols]
+
+        factors = {}
+        for j in range(n_cols - 1):
+            defined = pairs[j] > 0 and denominators[j] != 0
+            factors[self.periods[j].item()] = numerators[j] / denominators[j] if defined else np.nan
+        return factors
+
+    def latest(self):
+        """
+        Development index and value of the last observed cell of every accident period.
+        """
+        last = self.offsets[1:] - 1
+        return self.cols[last], self.values[last]
+
+    def ultimates(self, factors):
+        """
+        Chain-ladder paid to date, ultimate and reserve per accident period: the latest value
+        times the cumulative factor from its development period, without filling in the future
+        cells. Missing or undefined factors count as 1 (see factor_vector).
+        """
+        last, latest = self.latest()
+        ultimate = latest * cumulative_development_factors(factor_vector(factors, self.periods[:-1].tolist()))[last]
+        return pd.DataFrame({
+            'Accident Year': self.accident_periods,
+            'Paid': latest,
+            'Ultimate': ultimate,
+            'Reserve': ultimate - latest,
+        })
@@ -0,0 +1,243 @@
+"""
+Out-of-core claims triangles for histories larger than memory.
+
+The date parsing, development period, negative period filter and the sum by
+(Accident Year, Development Period) run inside the scan of local CSV / Parquet files, and
+only the aggregated cells come back to pandas, so memory depends on the size of the triangle
+rather than the number of claims:
+
+    from scan import scan_triangle
+    triangle = scan_triangle(["history/*.parquet", "claims_2024.csv"])
+
+Backends, in order of preference: DuckDB, Polars (lazy streaming scan), then the chunked
+pandas reader of utils. MATHURANCE_SCAN_BACKEND picks one explicitly.
+"""
+import glob
+import os
+
+import pandas as pd
+
+from lazy import lazy_import
+from utils import (TRIANGLE_COLUMNS, guess_date_format, read_claims_chunks, aggregate_claims_chunks,
+                   create_triangle)
+
+try:
+    duckdb = lazy_import("duckdb")
+except ImportError:
+    duckdb = None
+try:
+    pl = lazy_import("polars")
+except ImportError:
+    pl = None
+
+SCAN_BACKENDS = ("duckdb", "polars", "chunked")
+# "auto" uses the first installed backend of SCAN_BACKENDS
+SCAN_BACKEND = os.environ.get("MATHURANCE_SCAN_BACKEND", "auto")
+# DuckDB memory limit (e.g. "4GB"); beyond it DuckDB spills to disk. Unset: DuckDB's default
+SCAN_MEMORY_LIMIT = os.environ.get("MATHURANCE_SCAN_MEMORY_LIMIT")
+# Files DuckDB and Polars scan; JSON lines are only read by the chunked backend
+SCAN_EXTENSIONS = (".csv", ".parquet")
+
+
+def available_backends():
+    installed = {"duckdb": duckdb is not None, "polars": pl is not None, "chunked": True}
+    return [backend for backend in SCAN_BACKENDS if installed[backend]]
+
+
+def choose_backend(path, backend=None):
+    """
+    Backend used to scan path: backend (or MATHURANCE_SCAN_BACKEND) if installed and able to
+    read the file, else the first available one.
+    """
+    backend = backend or SCAN_BACKEND
+    candidates = available_backends()
+    if not path.lower().endswith(SCAN_EXTENSIONS):
+        candidates = ["chunked"]
+    if backend in candidates:
+        return backend
+    if backend != "auto":
+        print(f"Scan backend {backend!r} is not available for {os.path.basename(path)}: using {candidates[0]}.")
+    return candidates[0]
+
+
+def sample_claims(path, nrows=100):
+    """
+    First rows of a CSV or Parquet claims file, with its column names as written in the file.
+    """
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+        batch = next(pq.ParquetFile(path).iter_batches(batch_size=nrows), None)
+        return batch.to_pandas() if batch is not None else pd.DataFrame()
+    return pd.read_csv(path, nrows=nrows)
+
+
+def claims_columns(sample, segment_columns=()):
+    """
+    Name in the file of each triangle / segment column (headers may carry spaces).
+    """
+    names = {col.strip(): col for col in sample.columns}
+    missing = [col for col in list(TRIANGLE_COLUMNS) + list(segment_columns) if col not in names]
+    if missing:
+        raise KeyError(f"missing columns {missing}")
+    return {col: names[col] for col in list(TRIANGLE_COLUMNS) + list(segment_columns)}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def scan_duckdb(path, segment_columns=()):
+    """
+    (segments..., Accident Year, Development Period) sums of Règlement aggregated by DuckDB.
+    """
+    sample = sample_claims(path)
+    names = claims_columns(sample, segment_columns)
+    columns = {col: _quote(name) for col, name in names.items()}
+    literal = _literal(path)
+    if path.lower().endswith(".parquet"):
+        source = f"read_parquet({literal})"
+    else:
+        # Read as text and converted below, so malformed values become NULL like errors='coerce';
+        # the header is named explicitly as DuckDB would otherwise trim its spaces
+        header = ", ".join(_literal(name) for name in sample.columns)
+        source = f"read_csv({literal}, header=true, all_varchar=true, names=[{header}])"
+
+    date = columns["Date Survenance"]
+    dates = sample[names["Date Survenance"]]
+    date_format = guess_date_format(dates)
+    if pd.api.types.is_datetime64_any_dtype(dates):
+        accident_date = date
+    elif date_format:
+        accident_date = f"try_strptime(CAST({date} AS VARCHAR), {_literal(date_format)})"
+    else:
+        accident_date = f"TRY_CAST({date} AS DATE)"
+    segments = [f"{columns[col]} AS {_quote(col)}" for col in segment_columns]
+
+    query = f"""
+        SELECT {''.join(f'{_quote(col)}, ' for col in segment_columns)}
+               accident_year AS "Accident Year",
+               CAST(development_period AS INTEGER) AS "Development Period",
+               COALESCE(SUM(amount), 0) AS "Règlement",
+               COUNT(*) AS n_rows
+        FROM (
+            SELECT {''.join(f'{segment}, ' for segment in segments)}
+                   year({accident_date}) AS accident_year,
+                   TRY_CAST({columns['Exercice']} AS DOUBLE) - year({accident_date}) AS development_period,
+                   TRY_CAST({columns['Règlement']} AS DOUBLE) AS amount
+            FROM {source}
+        )
+        WHERE development_period >= 0
+        GROUP BY ALL
+    """
+    connection = duckdb.connect()
+    try:
+        connection.execute("SET enable_progress_bar = false")
+        if SCAN_MEMORY_LIMIT:
+            connection.execute(f"SET memory_limit = {_literal(SCAN_MEMORY_LIMIT)}")
+        return connection.execute(query).df()
+    finally:
+        connection.close()
+
+
+def scan_polars(path, segment_columns=()):
+    """
+    (segments..., Accident Year, Development Period) sums of Règlement aggregated by a
+    Polars lazy scan, collected with the streaming engine.
+    """
+    sample = sample_claims(path)
+    columns = claims_columns(sample, segment_columns)
+    if path.lower().endswith(".parquet"):
+        frame = pl.scan_parquet(path)
+    else:  # Read as text and converted below, so malformed values become null like errors='coerce'
+        frame = pl.scan_csv(path, infer_schema=False)
+
+    dates = sample[columns["Date Survenance"]]
+    date = pl.col(columns["Date Survenance"])
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        date = date.cast(pl.String).str.to_datetime(format=guess_date_format(dates), strict=False)
+    accident_year = date.dt.year()
+    keys = list(segment_columns) + ["Accident Year", "Development Period"]
+    result = (
+        frame.select(
+            *[pl.col(columns[col]).alias(col) for col in segment_columns],
+            accident_year.alias("Accident Year"),
+            (pl.col(columns["Exercice"]).cast(pl.Float64, strict=False) - accident_year).alias("Development Period"),
+            pl.col(columns["Règlement"]).cast(pl.Float64, strict=False).alias("Règlement"),
+        )
+        .filter(pl.col("Development Period") >= 0)
+        .with_columns(pl.col("Development Period").cast(pl.Int32))
+        .group_by(keys)
+        .agg(pl.col("Règlement").sum(), pl.len().alias("n_rows"))
+        .collect(engine="streaming")
+    )
+    return pd.DataFrame(result.to_dict(as_series=False))
+
+
+def scan_chunked(path, segment_columns=(), chunksize=100_000):
+    """
+    (segments..., Accident Year, Development Period) sums of Règlement folded chunk by chunk
+    with pandas (utils.read_claims_chunks), for when neither DuckDB nor Polars is installed.
+    """
+    counts = []
+
+    def counted(chunks):
+        for chunk in chunks:
+            counts.append(len(chunk))
+            yield chunk
+
+    with open(path, "rb") as f:
+        chunks = read_claims_chunks(f, path.lower(), chunksize, segment_columns)
+        result = aggregate_claims_chunks(counted(chunks), segment_columns)
+    result.attrs["rows"] = sum(counts)
+    return result
+
+
+def expand_paths(paths):
+    if isinstance(paths, str):
+        paths = [paths]
+    files = []
+    for path in paths:
+        files += sorted(glob.glob(path, recursive=True)) or [path]
+    return files
+
+
+def aggregate_claims_files(paths, segment_columns=(), backend=None, chunksize=100_000):
+    """
+    Claims of one or more CSV / Parquet files (paths or glob patterns) aggregated out of core into
+    (segments..., Accident Year, Development Period) sums of Règlement, ready for create_triangle.
+    attrs["rows"] holds the number of claims aggregated and attrs["backends"] the backend per file.
+    """
+    keys = list(segment_columns) + ["Accident Year", "Development Period"]
+    partials = []
+    rows = 0
+    backends = {}
+    for path in expand_paths(paths):
+        backends[path] = choose_backend(path, backend)
+        if backends[path] == "duckdb":
+            partial = scan_duckdb(path, segment_columns)
+        elif backends[path] == "polars":
+            partial = scan_polars(path, segment_columns)
+        else:
+            partial = scan_chunked(path, segment_columns, chunksize)
+        rows += int(partial.pop("n_rows").sum()) if "n_rows" in partial else partial.attrs.get("rows", 0)
+        partials.append(partial)
+
+    if partials:
+        # Files are aggregated one by one; their cells are small enough to combine in pandas
+        result = pd.concat(partials, ignore_index=True).groupby(keys, observed=True)["Règlement"].sum().sort_index().reset_index()
+        result[["Accident Year", "Development Period"]] = result[["Accident Year", "Development Period"]].astype("int64")
+    else:
+        result = pd.DataFrame(columns=keys + ["Règlement"])
+    result.attrs.update(rows=rows, backends=backends)
+    return result
+
+
+def scan_triangle(paths, backend=None, chunksize=100_000):
+    """
+    Cumulative claims triangle of claims files too large to load, see aggregate_claims_files.
+    """
+    return create_triangle(aggregate_claims_files(paths, backend=backend, chunksize=chunksize))
@@ -0,0 +1,98 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from reserving import factor_vector, last_observed_index, latest_diagonal, project_array
+from utils import dense_triangle
+
+
+class ScenarioEngine:
+    """
+    Evaluates inflation and development-factor scenarios on top of a chain-ladder projection.
+    Everything that does not depend on the scenario (latest diagonal, calendar years of the
+    future cells, a base projection) is computed once; evaluate() then handles any number of
+    scenarios as one broadcast array of shape (scenarios x accident years x development periods).
+
+    override_periods: development periods whose factor can be overridden (period k develops into k + 1).
+    inflation_years: calendar (payment) years that get a scenario inflation rate. Future payments
+    in year y are inflated by the compounded rates of all scenario years up to y.
+    Undefined chain-ladder factors (no accident year observed at both ages) count as 1, as in
+    utils.project_triangle.
+    """
+    def __init__(self, triangle, factors, override_periods=(1, 2), inflation_years=(2024, 2025)):
+        dense, values, mask, factors_vector = dense_triangle(triangle, factors)
+        self.accident_years = triangle.index
+        self.periods = np.asarray(dense.columns)
+        self.override_periods = list(override_periods)
+        self.inflation_years = np.asarray(inflation_years)
+        self.base_factors = factor_vector(factors, self.override_periods)
+
+        last = last_observed_index(mask)
+        n_cols = len(self.periods)
+        cols = np.arange(n_cols)
+        self.future = (cols[None, :] > last[:, None]) & (last >= 0)[:, None]
+        self.latest = np.nan_to_num(latest_diagonal(values, mask))
+
+        # Base projection with the overridable factors set to 1 ...
+        neutral_factors = factors_vector.copy()
+        self.override_columns = []
+        for period in self.override_periods:
+            j = int(period - self.periods[0])
+            if 0 <= j < n_cols - 1:
+                neutral_factors[j] = 1.0
+            self.override_columns.append(j)
+        self.neutral_projection = project_array(values, mask, neutral_factors)
+
+        # ... and, per overridable factor, the cells it multiplies (future cells after its period)
+        self.override_masks = np.stack([
+            self.future & (cols[None, :] > j) & (last[:, None] <= j) for j in self.override_columns
+        ]) if self.override_columns else np.zeros((0,) + values.shape, dtype=bool)
+
+        # Position of each future cell's payment year among the inflation years (-1: before all of them)
+        calendar_years = np.asarray(self.accident_years)[:, None] + self.periods[None, :]
+        self.inflation_position = np.searchsorted(self.inflation_years, calendar_years, side="right") - 1
+
+    def evaluate(self, inflation_rates, factor_overrides):
+        """
+        inflation_rates: (scenarios x inflation years) rates in %.
+        factor_overrides: (scenarios x override periods) factors; NaN keeps the chain-ladder factor.
+        Returns ultimates and reserves per scenario and accident year, plus total reserves.
+        """
+        inflation_rates = np.atleast_2d(np.asarray(inflation_rates, dtype=np.float64))
+        factor_overrides = np.atleast_2d(np.asarray(factor_overrides, dtype=np.float64))
+        factor_values = np.where(np.isnan(factor_overrides), self.base_factors[None, :], factor_overrides)
+
+        # Development: neutral projection times every overridden factor that applies to a cell
+        multiplier = np.ones((factor_values.shape[0],) + self.future.shape)
+        for k in range(len(self.override_columns)):
+            multiplier *= np.where(self.override_masks[k][None], factor_values[:, k, None, None], 1.0)
+        cumulative = self.neutral_projection[None] * multiplier
+
+        # Future payments per cell, inflated according to their payment year
+        payments = np.diff(cumulative, axis=2, prepend=0.0)
+        payments = np.where(self.future[None], payments, 0.0)
+        inflation_index = np.cumprod(1 + inflation_rates / 100, axis=1)
+        position = np.maximum(self.inflation_position, 0)
+        cell_index = np.where(self.inflation_position[None] >= 0, inflation_index[:, position], 1.0)
+        reserves = (payments * cell_index).sum(axis=2)
+
+        return {
+            "ultimates": self.latest[None, :] + reserves,
+            "reserves": reserves,
+            "total_reserve": reserves.sum(axis=1),
+        }
+
+    def evaluate_grid(self, inflation_grid, factor_grid):
+        """
+        Evaluate the full cartesian grid of inflation values (one list per inflation year)
+        and factor values (one list per override period) in a single pass.
+        Returns the scenario parameters as a DataFrame along with the results.
+        """
+        combos = np.array(list(itertools.product(*inflation_grid, *factor_grid)), dtype=np.float64)
+        n_inflation = len(inflation_grid)
+        results = self.evaluate(combos[:, :n_inflation], combos[:, n_inflation:])
+        columns = [f"Inflation {year}" for year in self.inflation_years] + [
+            f"Factor {period}-{period + 1}" for period in self.override_periods
+        ]
+        return pd.DataFrame(combos, columns=columns), results
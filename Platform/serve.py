@@ -0,0 +1,83 @@
+"""
+Production server: the dashboard under gunicorn with several worker processes.
+
+    python serve.py --workers 4 --threads 4 --bind 0.0.0.0:8050
+
+The app and the modules it imports lazily (pandas, plotly, the LLM client, ...) are loaded
+once in the master process and the workers are forked from it. With more than one worker,
+datasets, figures, background job results and chat streams live in a SQLite database shared
+by the workers (MATHURANCE_SHARED_STATE), so a session works whichever worker handles the
+request. Equivalent gunicorn command line:
+
+    MATHURANCE_SHARED_STATE=.cache/shared.sqlite MATHURANCE_LAZY_IMPORTS=0 \
+        gunicorn --preload -w 4 --threads 4 app:server
+"""
+import argparse
+import os
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn is Unix only; serve.py then falls back to the Flask server
+    BaseApplication = None
+
+DEFAULT_SHARED_STATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "shared.sqlite")
+
+
+def load_server():
+    """
+    Import the app, load the modules it imports lazily, and return its Flask server.
+    """
+    from app import server
+    from lazy import preload
+    preload()
+    return server
+
+
+if BaseApplication is not None:
+    class DashApplication(BaseApplication):
+        """
+        gunicorn application serving app.server; the app is loaded before the workers fork.
+        """
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return load_server()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Mathurance dashboard with several worker processes.")
+    parser.add_argument("--bind", default=os.environ.get("MATHURANCE_BIND", "0.0.0.0:8050"), help="host:port to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MATHURANCE_WORKERS", 2)), help="worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("MATHURANCE_THREADS", 4)), help="threads per worker")
+    parser.add_argument("--timeout", type=int, default=int(os.environ.get("MATHURANCE_TIMEOUT", 300)), help="seconds before a busy worker is restarted")
+    parser.add_argument("--shared-state", default=os.environ.get("MATHURANCE_SHARED_STATE", DEFAULT_SHARED_STATE), help="SQLite file shared by the workers")
+    args = parser.parse_args(argv)
+
+    if args.workers > 1:
+        # Must be set before the app is imported: the stores pick their backend at import
+        os.environ["MATHURANCE_SHARED_STATE"] = args.shared_state
+
+    if BaseApplication is None:
+        print("gunicorn is not installed: serving with the threaded Flask server in a single process.")
+        host, _, port = args.bind.rpartition(":")
+        load_server().run(host=host or "0.0.0.0", port=int(port), threaded=True)
+        return
+
+    DashApplication({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "timeout": args.timeout,
+        "preload_app": True,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
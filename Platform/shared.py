@@ -0,0 +1,67 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# SQLite file holding the state shared by the server worker processes (datasets, figures,
+# background job results, chat streams). Unset: every process keeps its state in memory.
+SHARED_STATE_PATH = os.environ.get("MATHURANCE_SHARED_STATE")
+
+
+class SharedState:
+    """
+    SQLite database shared by the worker processes of the production server.
+    The database runs in WAL mode so readers never block the writer; every process and
+    thread opens its own connection lazily, so nothing is inherited across a fork.
+    """
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._schemas = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._lock:
+                schemas = list(self._schemas)
+            for schema in schemas:
+                conn.executescript(schema)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def ensure_schema(self, schema):
+        """
+        Register CREATE TABLE IF NOT EXISTS statements, run on every new connection.
+        """
+        with self._lock:
+            self._schemas.append(schema)
+        self.connection().executescript(schema)
+
+    def execute(self, sql, params=()):
+        return self.connection().execute(sql, params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Write transaction (BEGIN IMMEDIATE ... COMMIT), rolled back on error.
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+# State shared by all workers, or None when the app runs in a single process
+shared_state = SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
@@ -0,0 +1,164 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from reserving import triangle_to_array, last_observed_index
+
+# Percentiles reported for the reserve distribution
+RESERVE_PERCENTILES = [50, 75, 90, 95, 99, 99.5]
+
+
+def prepare_odp_triangle(values, mask):
+    """
+    Turn a dense cumulative triangle into the regular shape used by the bootstrap:
+    every row is observed from its first to its last observed cell (holes carry the
+    previous cumulative value, i.e. no payment in that period; cells before the first
+    observation, e.g. payments older than the extract, stay unobserved).
+    Returns cumulative values, incremental values and the observed mask.
+    """
+    n_cols = values.shape[1]
+    cols = np.arange(n_cols)[None, :]
+    last = last_observed_index(mask)
+    first = np.argmax(mask, axis=1)
+    observed = (cols >= first[:, None]) & (cols <= last[:, None])
+
+    # Forward-fill the cumulative amounts within each row
+    positions = np.where(mask, cols, -1)
+    filled_from = np.maximum.accumulate(positions, axis=1)
+    rows = np.arange(values.shape[0])[:, None]
+    cumulative = np.where(observed, values[rows, np.maximum(filled_from, 0)], 0.0)
+    incremental = np.diff(cumulative, axis=1, prepend=0.0)
+    return cumulative, np.where(observed, incremental, 0.0), observed
+
+
+def volume_weighted_factors(cumulative, observed):
+    """
+    Chain-ladder factors for one or many triangles (leading axes are batch axes).
+    Development with no data (or a zero base) gets a factor of 1.
+    """
+    both = observed[:, :-1] & observed[:, 1:]
+    numerators = np.where(both, cumulative[..., 1:], 0.0).sum(axis=-2)
+    denominators = np.where(both, cumulative[..., :-1], 0.0).sum(axis=-2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominators > 0, numerators / denominators, 1.0)
+
+
+def fitted_incremental(cumulative, observed, factors):
+    """
+    Expected incremental amounts of the ODP model: each row is back-fitted from its latest
+    cumulative value with the chain-ladder factors (C[j] = C[j + 1] / f[j]).
+    """
+    last = last_observed_index(observed)
+    safe_factors = np.where(factors > 0, factors, 1.0)
+    growth = np.concatenate([[1.0], np.cumprod(safe_factors)])  # growth[j] = f[0] * ... * f[j - 1]
+    latest = cumulative[np.arange(cumulative.shape[0]), np.maximum(last, 0)]
+    fitted_cumulative = latest[:, None] * growth[None, :] / growth[np.maximum(last, 0)][:, None]
+    fitted_cumulative = np.where(observed, fitted_cumulative, 0.0)
+    return np.where(observed, np.diff(fitted_cumulative, axis=1, prepend=0.0), 0.0)
+
+
+def pearson_residuals(incremental, fitted, observed):
+    """
+    Scaled Pearson residuals of the ODP model and its dispersion parameter phi.
+    Only cells with a positive fitted value take part. Residuals are adjusted by
+    sqrt(N / (N - p)) for the N - p degrees of freedom (p = origins + developments - 1).
+    """
+    usable = observed & (fitted > 0)
+    residuals = (incremental[usable] - fitted[usable]) / np.sqrt(fitted[usable])
+    n_cells = residuals.size
+    n_params = incremental.shape[0] + incremental.shape[1] - 1
+    dof = n_cells - n_params
+    if dof <= 0:
+        return residuals, 1.0
+    phi = np.sum(residuals ** 2) / dof
+    return residuals * np.sqrt(n_cells / dof), phi
+
+
+def simulate_odp_batch(incremental, fitted, observed, residuals, phi, n_sims, seed):
+    """
+    Run n_sims bootstrap simulations at once on (simulations x origin x development) arrays:
+    resample residuals into pseudo triangles, refit the chain-ladder factors, re-project the
+    future and add gamma process noise. Returns simulated reserves, shape (n_sims, origins).
+    """
+    rng = np.random.default_rng(seed)
+    n_rows, n_cols = observed.shape
+    usable = observed & (fitted > 0)
+
+    # Pseudo incremental triangles
+    pseudo = np.broadcast_to(incremental, (n_sims, n_rows, n_cols)).copy()
+    sampled = rng.choice(residuals, size=(n_sims, int(usable.sum())), replace=True)
+    pseudo[:, usable] = fitted[usable] + sampled * np.sqrt(fitted[usable])
+    pseudo_cumulative = np.where(observed, np.cumsum(pseudo, axis=2), 0.0)
+
+    # Refit the development factors on every pseudo triangle
+    factors = volume_weighted_factors(pseudo_cumulative, observed)
+
+    # Re-project from the pseudo latest diagonal with one cumulative product
+    last = last_observed_index(observed)
+    cols = np.arange(n_cols)
+    steps = np.ones((n_sims, n_rows, n_cols))
+    steps[:, :, 1:] = factors[:, None, :]
+    steps[:, cols[None, :] <= last[:, None]] = 1.0
+    has_data = last >= 0
+    rows = np.flatnonzero(has_data)
+    steps[:, rows, last[rows]] = pseudo_cumulative[:, rows, last[rows]]
+    projected = np.cumprod(steps, axis=2)
+
+    # Expected future increments, then process variance: Gamma with mean m and variance phi * m
+    future = (cols[None, :] > last[:, None]) & has_data[:, None]
+    means = np.where(future, np.diff(projected, axis=2, prepend=0.0), 0.0)
+    positive = means > 0
+    noisy = means.copy()
+    noisy[positive] = rng.gamma(shape=means[positive] / phi, scale=phi)
+    return noisy.sum(axis=2)
+
+
+def bootstrap_odp(triangle, n_sims=10_000, seed=None, batch_size=1_000, workers=1):
+    """
+    Over-dispersed Poisson bootstrap of the reserves of a cumulative triangle
+    (as returned by create_triangle). Simulations run in batches of batch_size to bound
+    memory; with workers > 1 the batches are spread over a process pool. Every batch has
+    its own seed derived from seed, so results do not depend on the number of workers.
+    Returns the simulated reserves as a DataFrame (one column per accident year).
+    """
+    columns = list(triangle.columns)
+    dense = triangle.reindex(columns=range(min(columns), max(columns) + 1))
+    values, mask = triangle_to_array(dense)
+    cumulative, incremental, observed = prepare_odp_triangle(values, mask)
+    factors = volume_weighted_factors(cumulative, observed)
+    fitted = fitted_incremental(cumulative, observed, factors)
+    residuals, phi = pearson_residuals(incremental, fitted, observed)
+    if residuals.size == 0:
+        raise ValueError("The triangle has no cells to bootstrap from")
+
+    batches = [min(batch_size, n_sims - start) for start in range(0, n_sims, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    args = [(incremental, fitted, observed, residuals, phi, size, batch_seed) for size, batch_seed in zip(batches, seeds)]
+
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(simulate_odp_batch, *zip(*args)))
+    else:
+        results = [simulate_odp_batch(*batch_args) for batch_args in args]
+    return pd.DataFrame(np.concatenate(results), columns=triangle.index)
+
+
+def reserve_risk_summary(simulated_reserves, level=99.5):
+    """
+    Summary of a simulated reserve distribution: per accident year mean / std / percentiles,
+    plus the total reserve's mean, VaR and TVaR at the given level (Solvency II uses 99.5%).
+    """
+    by_year = simulated_reserves.describe(percentiles=[p / 100 for p in RESERVE_PERCENTILES]).T
+    total = simulated_reserves.sum(axis=1).to_numpy()
+    var = np.percentile(total, level)
+    tail = total[total >= var]
+    return {
+        "by_year": by_year,
+        "total": total,
+        "mean": total.mean(),
+        "std": total.std(ddof=1) if total.size > 1 else 0.0,
+        "var": var,
+        "tvar": tail.mean() if tail.size else var,
+        "level": level,
+    }
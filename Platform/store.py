@@ -0,0 +1,199 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from shared import shared_state
+
+# Seconds a dataset stays available after its last access (overridable through the environment)
+DATASET_TTL = float(os.environ.get("MATHURANCE_DATASET_TTL", 3600))
+
+
+class DatasetStore:
+    """
+    Server-side registry of session datasets.
+    The browser only keeps the short handle returned by register(); the parsed claims,
+    the triangle, the factors and the projections stay in process memory.
+    Entries expire ttl seconds after their last access.
+    """
+    def __init__(self, ttl=DATASET_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def register(self, **artifacts):
+        """
+        Store a new dataset (e.g. df=..., triangle=...) and return its handle.
+        """
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._evict_expired()
+            self._entries[handle] = {"artifacts": dict(artifacts), "last_access": time.monotonic()}
+        return handle
+
+    def get(self, handle, name=None, default=None):
+        """
+        Return one artifact of a dataset (or the dict of all its artifacts when name is None).
+        Unknown or expired handles return default.
+        """
+        if not handle:
+            return default
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(handle)
+            if entry is None:
+                return default
+            entry["last_access"] = time.monotonic()
+            artifacts = entry["artifacts"]
+        if name is None:
+            return artifacts
+        return artifacts.get(name, default)
+
+    def get_many(self, handle, names, default=None):
+        """
+        Return the named artifacts of a dataset as a dict (None for the missing ones).
+        Unknown or expired handles return default.
+        """
+        artifacts = self.get(handle)
+        if artifacts is None:
+            return default
+        return {name: artifacts.get(name) for name in names}
+
+    def update(self, handle, **artifacts):
+        """
+        Add or replace artifacts of an existing dataset. Returns False if the handle expired.
+        """
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return False
+            entry["artifacts"].update(artifacts)
+            entry["last_access"] = time.monotonic()
+        return True
+
+    def discard(self, handle):
+        with self._lock:
+            self._entries.pop(handle, None)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [h for h, entry in self._entries.items() if now - entry["last_access"] > self.ttl]
+        for handle in expired:
+            del self._entries[handle]
+
+
+class SharedDatasetStore:
+    """
+    DatasetStore backed by the SQLite database shared by the server workers, so a handle
+    resolves in whichever process serves the request. Each artifact is pickled in its own
+    row with a version number; unpickled artifacts are memoized per process and only reloaded
+    when another worker has replaced them.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS datasets (handle TEXT PRIMARY KEY, last_access REAL);
+        CREATE TABLE IF NOT EXISTS artifacts (
+            handle TEXT, name TEXT, version INTEGER, value BLOB, PRIMARY KEY (handle, name)
+        );
+    """
+
+    def __init__(self, state, ttl=DATASET_TTL, memo_datasets=8):
+        self.state = state
+        self.ttl = ttl
+        self.memo_datasets = memo_datasets
+        self._memo = OrderedDict()  # handle -> {name: (version, artifact)}
+        self._lock = threading.Lock()
+        state.ensure_schema(self.SCHEMA)
+
+    def register(self, **artifacts):
+        handle = uuid.uuid4().hex
+        rows = [(handle, name, 1, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) for name, value in artifacts.items()]
+        with self.state.transaction() as conn:
+            self._evict_expired(conn)
+            conn.execute("INSERT INTO datasets VALUES (?, ?)", (handle, time.time()))
+            conn.executemany("INSERT INTO artifacts VALUES (?, ?, ?, ?)", rows)
+        self._remember(handle, {name: (1, value) for name, value in artifacts.items()})
+        return handle
+
+    def get(self, handle, name=None, default=None):
+        artifacts = self._load(handle, None if name is None else [name])
+        if artifacts is None:
+            return default
+        if name is None:
+            return artifacts
+        return artifacts.get(name, default)
+
+    def get_many(self, handle, names, default=None):
+        artifacts = self._load(handle, names)
+        if artifacts is None:
+            return default
+        return {name: artifacts.get(name) for name in names}
+
+    def _load(self, handle, names):
+        # Artifacts of handle (all when names is None); only the stale ones are unpickled
+        if not handle:
+            return None
+        conn = self.state.connection()
+        cursor = conn.execute("UPDATE datasets SET last_access = ? WHERE handle = ? AND last_access >= ?",
+                              (time.time(), handle, time.time() - self.ttl))
+        if cursor.rowcount == 0:  # Unknown or expired
+            return None
+        if names is None:
+            versions = conn.execute("SELECT name, version FROM artifacts WHERE handle = ?", (handle,)).fetchall()
+        else:
+            versions = conn.execute(
+                f"SELECT name, version FROM artifacts WHERE handle = ? AND name IN ({', '.join('?' * len(names))})",
+                (handle, *names),
+            ).fetchall()
+        with self._lock:
+            memo = dict(self._memo.get(handle, {}))
+        stale = [n for n, version in versions if memo.get(n, (None,))[0] != version]
+        for n in stale:
+            version, value = conn.execute(
+                "SELECT version, value FROM artifacts WHERE handle = ? AND name = ?", (handle, n)
+            ).fetchone()
+            memo[n] = (version, pickle.loads(value))
+        if stale:
+            self._remember(handle, memo)
+        return {n: memo[n][1] for n, _ in versions}
+
+    def update(self, handle, **artifacts):
+        encoded = {name: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) for name, value in artifacts.items()}
+        versions = {}
+        with self.state.transaction() as conn:
+            cursor = conn.execute("UPDATE datasets SET last_access = ? WHERE handle = ?", (time.time(), handle))
+            if cursor.rowcount == 0:
+                return False
+            for name, value in encoded.items():
+                row = conn.execute("SELECT version FROM artifacts WHERE handle = ? AND name = ?", (handle, name)).fetchone()
+                versions[name] = (row[0] if row else 0) + 1
+                conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)", (handle, name, versions[name], value))
+        with self._lock:
+            memo = self._memo.get(handle)
+            if memo is not None:
+                memo.update({name: (versions[name], value) for name, value in artifacts.items()})
+        return True
+
+    def discard(self, handle):
+        with self.state.transaction() as conn:
+            conn.execute("DELETE FROM datasets WHERE handle = ?", (handle,))
+            conn.execute("DELETE FROM artifacts WHERE handle = ?", (handle,))
+        with self._lock:
+            self._memo.pop(handle, None)
+
+    def _remember(self, handle, artifacts):
+        with self._lock:
+            self._memo[handle] = artifacts
+            self._memo.move_to_end(handle)
+            while len(self._memo) > self.memo_datasets:
+                self._memo.popitem(last=False)
+
+    def _evict_expired(self, conn):
+        expired = time.time() - self.ttl
+        conn.execute("DELETE FROM artifacts WHERE handle IN (SELECT handle FROM datasets WHERE last_access < ?)", (expired,))
+        conn.execute("DELETE FROM datasets WHERE last_access < ?", (expired,))
+
+
+# Shared store used by the callbacks (in the SQLite shared state when the server runs several workers)
+dataset_store = SharedDatasetStore(shared_state) if shared_state is not None else DatasetStore()
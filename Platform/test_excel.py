@@ -0,0 +1,50 @@
+import io
+import re
+import zipfile
+
+import pandas as pd
+import pytest
+
+from excel import XlsxReader, read_excel
+
+SHEET = "xl/worksheets/sheet1.xml"
+
+
+def workbook(transform=None):
+    # Workbook written by pandas, with its worksheet XML rewritten by transform
+    buffer = io.BytesIO()
+    pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}).to_excel(buffer, index=False)
+    source = zipfile.ZipFile(buffer)
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as target:
+        for name in source.namelist():
+            data = source.read(name)
+            target.writestr(name, transform(data) if transform is not None and name == SHEET else data)
+    return output.getvalue()
+
+
+def prefixed(xml):
+    # Elements in a prefixed namespace, as written by the OpenXML SDK
+    return re.sub(rb"<(/?)(\w)", rb"<\1x:\2", xml).replace(b"xmlns=", b"xmlns:x=")
+
+
+@pytest.mark.parametrize("transform", [
+    lambda xml: xml.replace(b'<c r="A2" t="n">', b'<c t="n" r="A2">'),  # Reference not first
+    prefixed,
+])
+def test_fast_reader_reads_every_cell(transform):
+    df = XlsxReader(workbook(transform)).read_sheet()
+    assert df["a"].tolist() == [1, 2]
+    assert df["b"].tolist() == ["x", "y"]
+
+
+@pytest.mark.parametrize("transform", [
+    lambda xml: xml.replace(b'<c r="A2" t="n">', b'<c t="n">'),  # Cell without a reference
+    lambda xml: re.sub(rb'<row r="[23]">.*?</row>', b"", xml),  # Header only
+])
+def test_unreadable_sheet_falls_back_to_pandas(transform):
+    data = workbook(transform)
+    with pytest.raises(ValueError):
+        XlsxReader(data).read_sheet()
+    df, _ = read_excel(data, "claims.xlsx")
+    pd.testing.assert_frame_equal(df, pd.read_excel(io.BytesIO(data)))
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from reserving import SparseTriangle, cumulative_development_factors, factor_vector, last_observed_index, triangle_to_array
+from stochastic import prepare_odp_triangle, volume_weighted_factors
+
+
+def monthly_claims(n_origins=24, n_devs=36, keep=0.3, seed=0):
+    # Claims of a monthly triangle where most months have no payment
+    rng = np.random.default_rng(seed)
+    rows = [(origin, dev) for origin in range(n_origins) for dev in range(n_devs - origin)]
+    rows = [cell for cell in rows if cell[1] == 0 or rng.random() < keep]
+    return pd.DataFrame({
+        'Accident Year': [f"2020-{origin:02d}" for origin, _ in rows],
+        'Development Period': [dev for _, dev in rows],
+        'Règlement': rng.gamma(2.0, 1000.0, len(rows)),
+    })
+
+
+def dense_path(sparse):
+    # The same triangle densified onto every development period, with the holes filled as the bootstrap does
+    values, mask = triangle_to_array(sparse.to_dense().reindex(columns=sparse.periods))
+    cumulative, _, observed = prepare_odp_triangle(values, mask)
+    factors = volume_weighted_factors(cumulative, observed)
+    last = last_observed_index(observed)
+    latest = cumulative[np.arange(len(cumulative)), last]
+    return factors, latest * cumulative_development_factors(factors)[last]
+
+
+def test_sparse_factors_carry_empty_months_forward():
+    df = pd.DataFrame({
+        'Accident Year': ["2020-01", "2020-01", "2020-02", "2020-02"],
+        'Development Period': [0, 2, 0, 1],
+        'Règlement': [100.0, 50.0, 50.0, 10.0],
+    })
+    sparse = SparseTriangle.from_claims(df)
+    factors = sparse.factors()
+    assert factors[0] == (100.0 + 60.0) / (100.0 + 50.0)
+    assert factors[1] == 150.0 / 100.0
+    reserves = sparse.ultimates(factors).set_index('Accident Year')['Reserve']
+    assert reserves["2020-02"] == 60.0 * 1.5 - 60.0
+
+
+def test_sparse_matches_dense_path():
+    sparse = SparseTriangle.from_claims(monthly_claims())
+    dense_factors, dense_ultimates = dense_path(sparse)
+    factors = sparse.factors()
+    assert not np.isnan(list(factors.values())).any()
+    np.testing.assert_allclose(factor_vector(factors, sparse.periods[:-1].tolist()), dense_factors, rtol=1e-9)
+    np.testing.assert_allclose(sparse.ultimates(factors)['Ultimate'], dense_ultimates, rtol=1e-9)
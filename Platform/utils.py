@@ -1,18 +1,64 @@
 import base64
 import io
+import os
+import warnings
 import pandas as pd
 import numpy as np
+from pandas.tseries.api import guess_datetime_format
+from cache import upload_cache, content_hash
+from excel import read_excel
+from reserving import (
+    triangle_to_array,
+    chain_ladder_factors_array,
+    last_observed_index,
+    project_array,
+    cape_cod_loss_ratio,
+    bornhuetter_ferguson_array,
+    factor_vector,
+)
 
+# Version of the parsed output in the upload cache keys: bump it whenever parsing changes the
+# resulting frames (e.g. the dtypes produced by excel.XlsxReader), so older entries are not served
+PARSER_VERSION = 2
 
-def parse_contents(contents, filename):
+
+def parse_contents(contents, filename, cache=upload_cache, sheet_name=None, usecols=None):
+    """
+    Decode an uploaded file and return the cleaned claims DataFrame.
+    Parsed results are kept in an on-disk Arrow cache keyed by the hash of the file
+    contents, so re-uploading the same file skips the (slow) parsing step.
+    For workbooks, sheet_name picks the sheet (default: the first one) and usecols the
+    columns to load (the triangle columns are always loaded); the parse time per sheet
+    is reported in df.attrs['parse_timings'].
+    """
     content_type, content_string = contents.split(',')
     decoded = base64.b64decode(content_string)
+    return parse_bytes(decoded, filename, cache, sheet_name, usecols)
+
+
+def parse_bytes(decoded, filename, cache=upload_cache, sheet_name=None, usecols=None):
+    """
+    parse_contents on the raw bytes of a claims file (e.g. read from disk by batch.py).
+    """
+    if usecols:
+        usecols = sorted(set(usecols) | set(TRIANGLE_COLUMNS))
+    digest = content_hash(decoded)
+    cache_key = f"{digest}-{os.path.splitext(filename)[1].lstrip('.').lower()}-v{PARSER_VERSION}"
+    if sheet_name or usecols:
+        cache_key += "-" + content_hash(repr((sheet_name, usecols)).encode())[:16]
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            cached.attrs.pop('parse_timings', None)  # Nothing was parsed this time
+            cached.attrs['content_hash'] = digest
+            return cached
     
     try:
         if filename.endswith('.csv'):
             df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
         elif filename.endswith(('.xls', '.xlsx', '.xlsm')):  # Added .xlsm support
-            df = pd.read_excel(io.BytesIO(decoded))
+            df, parse_timings = read_excel(decoded, filename, sheet_name, usecols or None)
+            df.attrs['parse_timings'] = parse_timings
         elif filename.endswith('.json'):
             df = pd.read_json(io.StringIO(decoded.decode('utf-8')))
         else:
@@ -35,13 +81,212 @@ def parse_contents(contents, filename):
         
         # Filter out any rows with negative development periods
         df = df[df['Development Period'] >= 0]
+        df.attrs['content_hash'] = digest  # Identifies the file the data came from (e.g. in saved closings)
 
+        if cache is not None:
+            cache.put(cache_key, df)
         return df
     
     except Exception as e:
         print("Error reading file:", e)
         return None
 
+# Columns needed to build the claims triangle
+TRIANGLE_COLUMNS = ['Règlement', 'Date Survenance', 'Exercice']
+# Columns of the claims extracts (premium/exposure columns are optional, see PREMIUM_COLUMNS)
+CLAIMS_COLUMNS = ['Exercice', 'Branche', 'Code Produit', 'Désignation Produit', 'Sous-Branche', 'Date Survenance', 'Règlement']
+STREAMING_EXTENSIONS = ('.csv', '.jsonl', '.ndjson')
+
+
+class Base64Reader(io.RawIOBase):
+    """
+    Read-only binary stream over a base64 string that decodes on demand,
+    so an upload never has to be decoded into one big bytes object.
+    """
+    def __init__(self, encoded):
+        self._encoded = encoded
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # 4 base64 characters decode to 3 bytes
+        n_chars = max(len(buffer) // 3, 1) * 4
+        block = self._encoded[self._position:self._position + n_chars]
+        self._position += len(block)
+        data = base64.b64decode(block)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def guess_date_format(dates):
+    """
+    strftime format of the first non-missing date string, guessed like pandas does
+    (None if the dates are not strings or the format is not recognised).
+    """
+    first = dates.dropna()
+    if first.empty or not isinstance(first.iloc[0], str):
+        return None
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return guess_datetime_format(first.iloc[0])
+
+
+def compact_claims_chunk(chunk, date_format=None, segment_columns=(), amount_dtype='float64'):
+    """
+    Accident Year, Development Period, Règlement and the segment columns of a chunk of claims,
+    with negative or undefined development periods filtered out.
+    """
+    dates = pd.to_datetime(chunk['Date Survenance'], errors='coerce', format=date_format)
+
+    accident_year = dates.dt.year
+    development_period = pd.to_numeric(chunk['Exercice'], errors='coerce') - accident_year
+    keep = (development_period >= 0).to_numpy()
+
+    compact = pd.DataFrame({
+        'Accident Year': accident_year[keep].astype(np.int16),
+        'Development Period': development_period[keep].astype(np.int16),
+        'Règlement': pd.to_numeric(chunk['Règlement'][keep], errors='coerce').astype(amount_dtype),
+    })
+    for col in segment_columns:
+        compact[col] = chunk[col][keep].astype('category')
+    return compact
+
+
+def read_claims_chunks(stream, filename, chunksize=100_000, segment_columns=(), amount_dtype='float64'):
+    """
+    Read a CSV, JSON-lines or Parquet claims file chunk by chunk (Parquet needs a seekable stream).
+    Only the triangle columns (plus optional segment columns, e.g. 'Code Produit') are kept,
+    with compact dtypes: int16 years, float32/float64 amounts and categorical segments.
+    Each yielded chunk has Accident Year, Development Period, Règlement and the segment columns,
+    with negative or undefined development periods already filtered out.
+    """
+    wanted = set(TRIANGLE_COLUMNS) | set(segment_columns)
+    if filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(stream)
+        columns = [col for col in parquet.schema_arrow.names if col.strip() in wanted]
+        reader = (batch.to_pandas() for batch in parquet.iter_batches(batch_size=chunksize, columns=columns))
+    elif filename.endswith('.csv'):
+        reader = pd.read_csv(io.TextIOWrapper(stream, encoding='utf-8'), chunksize=chunksize,
+                             usecols=lambda col: col.strip() in wanted)
+    else:
+        reader = pd.read_json(io.TextIOWrapper(stream, encoding='utf-8'), lines=True, chunksize=chunksize)
+
+    date_format = None
+    for chunk in reader:
+        chunk.columns = [col.strip() for col in chunk.columns]
+        chunk = chunk[[col for col in chunk.columns if col in wanted]]
+        # Same date format for every chunk, guessed like pandas does on the first value
+        if date_format is None:
+            date_format = guess_date_format(chunk['Date Survenance'])
+        yield compact_claims_chunk(chunk, date_format, segment_columns, amount_dtype)
+
+
+def aggregate_claims_chunks(chunks, segment_columns=()):
+    """
+    Fold claims chunks into (segments..., Accident Year, Development Period) sums of Règlement.
+    Only the running partial sums are kept, so memory depends on the number of
+    triangle cells, not on the number of rows read.
+    """
+    keys = list(segment_columns) + ['Accident Year', 'Development Period']
+    total = None
+    for chunk in chunks:
+        partial = chunk.groupby(keys, observed=True)['Règlement'].sum().astype(np.float64)
+        total = partial if total is None else total.add(partial, fill_value=0)
+    if total is None:
+        return pd.DataFrame(columns=keys + ['Règlement'])
+    return total.sort_index().reset_index()
+
+
+def parse_contents_streaming(contents, filename, chunksize=100_000, segment_columns=(), amount_dtype='float64'):
+    """
+    Streaming counterpart of parse_contents for large uploads.
+    CSV and JSON-lines files are decoded and read in chunks and aggregated straight into
+    (Accident Year, Development Period) partial sums; the returned frame can be passed
+    to create_triangle like a full claims table. Other formats are parsed in full first.
+    """
+    try:
+        if filename.endswith(STREAMING_EXTENSIONS):
+            content_type, content_string = contents.split(',')
+            stream = io.BufferedReader(Base64Reader(content_string))
+            chunks = read_claims_chunks(stream, filename, chunksize, segment_columns, amount_dtype)
+        else:
+            df = parse_contents(contents, filename)
+            if df is None:
+                return None
+            chunks = [df]
+        return aggregate_claims_chunks(chunks, segment_columns)
+
+    except Exception as e:
+        print("Error reading file:", e)
+        return None
+
+# Periods per year of the origin / development granularities
+GRANULARITIES = {'year': 1, 'quarter': 4, 'month': 12}
+# Settlement date columns for quarterly or monthly development (Exercice only gives the year)
+SETTLEMENT_DATE_COLUMNS = ['Date Règlement', 'Date de Règlement', 'Date Paiement']
+
+
+def period_ordinals(dates, granularity):
+    """
+    Running number of the year, quarter or month containing each date (year * periods + period).
+    """
+    n_periods = GRANULARITIES[granularity]
+    return dates.dt.year * n_periods + (dates.dt.month - 1) // (12 // n_periods)
+
+
+def period_labels(ordinals, granularity):
+    """
+    Labels of period ordinals: 2021, '2021Q3' or '2021-07'. Labels sort in time order.
+    """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    if granularity == 'year':
+        return ordinals
+    unique, inverse = np.unique(ordinals, return_inverse=True)
+    n_periods = GRANULARITIES[granularity]
+    if granularity == 'quarter':
+        labels = [f"{o // n_periods}Q{o % n_periods + 1}" for o in unique]
+    else:
+        labels = [f"{o // n_periods}-{o % n_periods + 1:02d}" for o in unique]
+    return np.array(labels, dtype=object)[inverse]
+
+
+def add_development_periods(df, origin='year', development='year'):
+    """
+    Claims with Accident Year and Development Period at the given granularities
+    (year, quarter or month). With a finer origin, 'Accident Year' holds the origin period
+    label ('2021Q3', '2021-07'). Development Period counts development periods from the start
+    of the origin period to the settlement: the Exercice year for annual development, a
+    settlement date column (SETTLEMENT_DATE_COLUMNS) for quarterly or monthly development.
+    """
+    if origin not in GRANULARITIES or development not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {origin}/{development} (expected one of {list(GRANULARITIES)})")
+    if origin == 'year' and development == 'year':
+        return df
+
+    origin_ordinals = period_ordinals(df['Date Survenance'], origin)
+    # Start of the origin period, as an ordinal of the development granularity
+    n_origin, n_development = GRANULARITIES[origin], GRANULARITIES[development]
+    start_month = (origin_ordinals % n_origin) * (12 // n_origin)
+    origin_start = (origin_ordinals // n_origin) * n_development + start_month // (12 // n_development)
+
+    if development == 'year':
+        settlement = pd.to_numeric(df['Exercice'], errors='coerce')
+    else:
+        date_column = next((col for col in SETTLEMENT_DATE_COLUMNS if col in df.columns), None)
+        if date_column is None:
+            raise ValueError(f"{development.capitalize()} development needs a settlement date column ({', '.join(SETTLEMENT_DATE_COLUMNS)})")
+        settlement = period_ordinals(pd.to_datetime(df[date_column], errors='coerce'), development)
+
+    development_period = settlement - origin_start
+    keep = (development_period >= 0).to_numpy()
+    df = df[keep].copy()
+    df['Accident Year'] = period_labels(origin_ordinals[keep], origin)
+    df['Development Period'] = development_period[keep].astype(np.int64)
+    return df
+
 def create_triangle(df):
     """
     Create a cumulative claims triangle.
@@ -68,49 +313,143 @@ def compute_chain_ladder_factors(triangle):
     For each column (except the last), the factor is calculated as:
          factor = (sum of claims in next period) / (sum of claims in current period)
     If the next period column doesn't exist, the factor is set to NaN.
+    The sums run on the dense NumPy triangle (see reserving.chain_ladder_factors_array).
     """
-    factors = {}
     columns = sorted(triangle.columns)
-    for col in columns[:-1]:
-        next_col = col + 1
-        if next_col not in triangle.columns:
-            factors[col] = np.nan
-            continue
-        valid = triangle[[col, next_col]].dropna()
-        if not valid.empty and valid[col].sum() != 0:
-            factor = valid[next_col].sum() / valid[col].sum()
-            factors[col] = factor
-        else:
-            factors[col] = np.nan
-    return factors
+    values, mask = triangle_to_array(triangle[columns])
+    factor_values = chain_ladder_factors_array(values, mask, columns)
+    return dict(zip(columns[:-1], factor_values))
+
+def dense_triangle(triangle, factors):
+    """
+    Reindex a triangle onto a dense, sorted grid of development periods
+    (gaps in the data become empty columns) and return it with its NumPy values,
+    observed mask and factor vector (factors_vector[j] develops column j into j + 1;
+    missing or undefined factors count as 1, see reserving.factor_vector).
+    """
+    columns = list(triangle.columns)
+    periods = list(range(min(columns), max(columns) + 1))
+    dense = triangle.reindex(columns=periods)
+    values, mask = triangle_to_array(dense)
+    return dense, values, mask, factor_vector(factors, periods[:-1])
+
+# Reserving methods offered in model-dropdown
+RESERVING_METHODS = {
+    "chain_ladder": "Chain-Ladder",
+    "bornhuetter_ferguson": "Bornhuetter-Ferguson",
+    "cape_cod": "Cape Cod",
+}
+PREMIUM_COLUMNS = ['Prime', 'Primes', 'Premium', 'Exposure']
+
+
+def premiums_by_accident_year(df):
+    """
+    Total of the first premium-like column (PREMIUM_COLUMNS) of the claims data per accident
+    year, as a Series; None when there is none. Totals of appended files add up.
+    """
+    for column in PREMIUM_COLUMNS:
+        if df is not None and column in df.columns:
+            return pd.to_numeric(df[column], errors='coerce').groupby(df['Accident Year']).sum()
+    return None
+
+
+def align_exposure(premiums, triangle):
+    """
+    Premiums per accident year (a premiums_by_accident_year Series) aligned on the triangle rows.
+    """
+    if premiums is None:
+        return None
+    return premiums.reindex(triangle.index).to_numpy(dtype=np.float64)
+
+
+def exposure_by_accident_year(df, triangle):
+    """
+    Premium (or exposure) per accident year, aligned on the triangle rows, from the first
+    premium-like column (PREMIUM_COLUMNS) of the claims data; None when there is none.
+    """
+    return align_exposure(premiums_by_accident_year(df), triangle)
+
+
+def project_with_method(triangle, factors, method="chain_ladder", premiums=None, expected_loss_ratio=None):
+    """
+    Project the triangle with the selected reserving method, reusing the chain-ladder factors.
+    Bornhuetter-Ferguson uses premium * expected_loss_ratio as a priori ultimates; when no loss
+    ratio is given it falls back to the Cape Cod estimate. Only this final step depends on the
+    method, so switching methods never rebuilds the triangle or the factors.
+    Returns the projected triangle and the expected loss ratio used (None for chain-ladder).
+    Raises ValueError for Bornhuetter-Ferguson and Cape Cod without premiums.
+    """
+    if method == "chain_ladder":
+        return project_triangle(triangle, factors), None
+
+    if method not in RESERVING_METHODS:
+        raise ValueError(f"Unknown reserving method: {method}")
+
+    if premiums is None or np.isnan(premiums).all():
+        raise ValueError(
+            f"{RESERVING_METHODS[method]} needs premiums per accident year: "
+            f"the claims data has no {' / '.join(PREMIUM_COLUMNS)} column."
+        )
+    dense, values, mask, factors_vector = dense_triangle(triangle, factors)
+    if method == "cape_cod" or expected_loss_ratio is None:
+        loss_ratio = cape_cod_loss_ratio(values, mask, factors_vector, premiums)
+    else:
+        loss_ratio = expected_loss_ratio
+
+    projected = bornhuetter_ferguson_array(values, mask, factors_vector, premiums, loss_ratio)
+    return pd.DataFrame(projected, index=triangle.index, columns=dense.columns), loss_ratio
 
 def project_triangle(triangle, factors):
     """
     Using the computed development factors, project the ultimate claims for each accident year.
     For accident years with missing future periods, the projection is done by multiplying the
     last known cumulative claim amount by the product of the remaining factors.
+    The projection runs as a single cumulative product over the dense triangle
+    (see reserving.project_array); missing or undefined factors count as 1 (no change).
     """
-    triangle_proj = triangle.copy()
-    max_period = max(triangle.columns)  # highest development period present in the data
-    for idx, row in triangle_proj.iterrows():
-        # Identify the last development period with available data
-        known_periods = row.dropna().index.tolist()
-        if not known_periods:
+    columns = list(triangle.columns)
+    dense, values, mask, factors_vector = dense_triangle(triangle, factors)
+    periods = list(dense.columns)
+    projected = project_array(values, mask, factors_vector)
+    triangle_proj = pd.DataFrame(projected, index=triangle.index, columns=dense.columns)
+
+    # Periods missing from the input only appear once some accident year is projected
+    # into them; they are added after the existing columns, in the order they get filled.
+    last = last_observed_index(mask)
+    created = []
+    for j, dev in enumerate(periods):
+        if dev in triangle.columns:
             continue
-        last_known = max(known_periods)
-        last_val = row[last_known]
-        # Project for remaining periods if any
-        for dev in range(last_known + 1, max_period + 1):
-            # Use the factor from the previous period; if missing, default to 1 (no change)
-            factor = factors.get(dev - 1, 1)
-            last_val *= factor
-            triangle_proj.at[idx, dev] = last_val
-    return triangle_proj
-
-    def adjust_claims_for_inflation(claims_df, inflation_df, dev_factor_1_2, dev_factor_2_3):
-        """
-        Adjust claims based on development factors and inflation rates.
-        """
-        claims_df["adjusted_claims"] = claims_df["claims"] * dev_factor_1_2 * dev_factor_2_3
-        claims_df["adjusted_claims"] *= (1 + inflation_df.set_index("year").loc[claims_df["year"], "inflation"].values / 100)
-        return claims_df
\ No newline at end of file
+        filling_rows = np.flatnonzero((last >= 0) & (last < j))
+        if filling_rows.size:
+            created.append((filling_rows[0], dev))
+    return triangle_proj[columns + [dev for _, dev in sorted(created)]]
+
+
+def summarize_reserves(triangle, triangle_proj):
+    """
+    Paid to date, projected ultimate and reserve of a triangle and its projection.
+    An undefined ultimate makes the totals NaN instead of counting as a reserve of zero.
+    """
+    latest = triangle.ffill(axis=1).iloc[:, -1]
+    ultimate = triangle_proj[triangle_proj.columns.max()]
+    return {
+        'Paid': latest.sum(),
+        'Ultimate': ultimate.sum(skipna=False),
+        'Reserve': (ultimate - latest).sum(skipna=False),
+    }
+
+
+def reserves_by_accident_year(triangle, triangle_proj):
+    """
+    summarize_reserves per accident year: paid to date, projected ultimate and reserve
+    (NaN where the ultimate is undefined, never a reserve of zero).
+    """
+    latest = triangle.ffill(axis=1).iloc[:, -1]
+    ultimate = triangle_proj[triangle_proj.columns.max()]
+    return pd.DataFrame({
+        'Accident Year': triangle.index,
+        'Paid': latest.to_numpy(),
+        'Ultimate': ultimate.to_numpy(),
+        'Reserve': (ultimate - latest).to_numpy(),
+    })